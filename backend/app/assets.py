@@ -0,0 +1,215 @@
+import os
+import threading
+from datetime import datetime, timezone
+
+import pandas as pd
+from sqlalchemy import text
+
+from backfill import FEATURE_LOOKBACK
+from db import begin_write
+from features import FEATURES, make_features
+from ingest import fetch_market_charts
+from metrics import ROWS_INGESTED, timed
+from model_registry import ModelRegistry
+
+# O par padrão continua nas tabelas originais (btc_data, predictions, model_runs),
+# com rollups, snapshot e backtest; os demais pares ficam em asset_data
+DEFAULT_ASSET = 'bitcoin'
+DEFAULT_QUOTE = 'usd'
+DEFAULT_PAIR = (DEFAULT_ASSET, DEFAULT_QUOTE)
+ASSET_PATTERN = '^[a-z0-9-]+$'
+# Histórico buscado na primeira ingestão de um par, como a carga inicial do bitcoin
+INITIAL_DAYS = 365
+ASSET_DATA_COLUMNS = ['asset', 'quote', 'date', 'price'] + FEATURES
+
+
+def parse_pairs(spec, default_quote=DEFAULT_QUOTE):
+    """'ethereum,solana:eur' -> [('ethereum', 'usd'), ('solana', 'eur')], sem repetir nem incluir o par padrão."""
+    pairs = []
+    for item in (spec or '').split(','):
+        item = item.strip().lower()
+        if not item:
+            continue
+        asset, _, quote = item.partition(':')
+        pair = (asset, quote or default_quote)
+        if pair != DEFAULT_PAIR and pair not in pairs:
+            pairs.append(pair)
+    return pairs
+
+
+def pair_name(pair):
+    return f'{pair[0]}/{pair[1]}'
+
+
+def init_asset_tables(conn):
+    conn.execute(text(f'''CREATE TABLE IF NOT EXISTS asset_data (
+        asset TEXT,
+        quote TEXT,
+        date TEXT,
+        price REAL,
+        {', '.join(f'{f} REAL' for f in FEATURES if f != 'dow')},
+        dow INTEGER,
+        PRIMARY KEY (asset, quote, date)
+    ) WITHOUT ROWID'''))
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS asset_predictions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        asset TEXT,
+        quote TEXT,
+        date TEXT,
+        pred_7d REAL
+    )'''))
+    # mesmo papel de idx_predictions_date_run_ts, por par
+    conn.execute(text('''CREATE INDEX IF NOT EXISTS idx_asset_predictions_pair_date_run_ts
+        ON asset_predictions (asset, quote, date, run_ts)'''))
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS asset_model_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        trained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        asset TEXT,
+        quote TEXT,
+        model_version TEXT,
+        mode TEXT,
+        n_rows INTEGER,
+        first_date TEXT,
+        last_date TEXT,
+        horizon INTEGER,
+        alpha REAL,
+        mae_train REAL,
+        r2_train REAL,
+        fit_seconds REAL
+    )'''))
+    # bancos criados antes dos pares passarem pelo worker de treino não têm a coluna mode
+    cols = [r[1] for r in conn.execute(text('PRAGMA table_info(asset_model_runs)'))]
+    if 'mode' not in cols:
+        conn.execute(text("ALTER TABLE asset_model_runs ADD COLUMN mode TEXT DEFAULT 'full'"))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS idx_asset_model_runs_pair ON asset_model_runs (asset, quote, id)'))
+
+
+def price_source(pair):
+    """FROM com as colunas de btc_data para o par: a própria btc_data ou uma subconsulta de asset_data.
+
+    O SQLite achata a subconsulta, então os filtros de data continuam usando a
+    PRIMARY KEY (asset, quote, date).
+    """
+    if pair is None:
+        return 'btc_data', {}
+    return ('(SELECT * FROM asset_data WHERE asset = :asset AND quote = :quote)',
+            {'asset': pair[0], 'quote': pair[1]})
+
+
+def prediction_source(pair):
+    if pair is None:
+        return 'predictions', {}
+    return ('(SELECT * FROM asset_predictions WHERE asset = :asset AND quote = :quote)',
+            {'asset': pair[0], 'quote': pair[1]})
+
+
+def model_run_source(pair):
+    if pair is None:
+        return 'model_runs', {}
+    return ('(SELECT * FROM asset_model_runs WHERE asset = :asset AND quote = :quote)',
+            {'asset': pair[0], 'quote': pair[1]})
+
+
+def _daily_last_prices(prices):
+    """Último preço de cada dia (UTC), como no fetch_and_insert."""
+    df = pd.DataFrame(prices, columns=['ts', 'price'])
+    df['date'] = pd.to_datetime(df['ts'], unit='ms').dt.strftime('%Y-%m-%d')
+    return df.groupby('date', as_index=False)['price'].last()
+
+
+def _days_to_fetch(last_date, today):
+    if last_date is None:
+        return INITIAL_DAYS
+    gap = (today - datetime.strptime(last_date, '%Y-%m-%d').date()).days
+    # refaz o último dia gravado (pode ter sido um preço parcial) e cobre lacunas
+    return min(INITIAL_DAYS, max(1, gap + 1))
+
+
+def _store_pair(engine, pair, chart):
+    """Grava em asset_data as datas novas do par, com features calculadas sobre as últimas linhas gravadas.
+
+    Retorna (linhas gravadas, se algum dia já gravado mudou de preço): o último
+    dia é sempre buscado de novo e o preço parcial gravado antes é substituído.
+    """
+    new = _daily_last_prices(chart['prices'])
+    if new.empty:
+        return 0, False
+    asset, quote = pair
+    with begin_write(engine) as conn:
+        prev = conn.execute(text('''SELECT date, price FROM asset_data
+                                    WHERE asset = :asset AND quote = :quote AND date < :d
+                                    ORDER BY date DESC LIMIT :n'''),
+                            {'asset': asset, 'quote': quote, 'd': new['date'].iloc[0],
+                             'n': FEATURE_LOOKBACK}).fetchall()[::-1]
+        df = pd.concat([pd.DataFrame(prev, columns=['date', 'price']), new], ignore_index=True)
+        df['date'] = pd.to_datetime(df['date'])
+        df = make_features(df).iloc[len(prev):].dropna()
+        if df.empty:
+            return 0, False
+        dates = df['date'].dt.strftime('%Y-%m-%d').tolist()
+        stored = dict(conn.execute(text('''SELECT date, price FROM asset_data
+                                           WHERE asset = :asset AND quote = :quote AND date >= :d'''),
+                                   {'asset': asset, 'quote': quote, 'd': dates[0]}).fetchall())
+        replaced = any(d in stored and stored[d] != p for d, p in zip(dates, df['price'].tolist()))
+        rows = list(zip([asset] * len(df), [quote] * len(df), dates,
+                        *(df[c].tolist() for c in ['price'] + FEATURES)))
+        conn.exec_driver_sql(
+            f"INSERT OR REPLACE INTO asset_data ({', '.join(ASSET_DATA_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(ASSET_DATA_COLUMNS))})", rows)
+    return len(rows), replaced
+
+
+def ingest_assets(engine, pairs, **client_kwargs):
+    """Atualiza asset_data para vários pares de uma vez.
+
+    Todas as chamadas à CoinGecko saem em paralelo por um único cliente, então
+    dividem o mesmo limite de concorrência e a mesma pausa em caso de 429; cada
+    par só busca os dias que faltam. Retorna {'asset/quote': {'rows': linhas
+    gravadas, 'replaced': algum dia já gravado mudou} ou {'error': ...}}.
+    """
+    if not pairs:
+        return {}
+    today = datetime.now(timezone.utc).date()
+    with engine.connect() as conn:
+        last = {(a, q): d for a, q, d in conn.execute(
+            text('SELECT asset, quote, MAX(date) FROM asset_data GROUP BY asset, quote'))}
+    wanted = [(asset, quote, _days_to_fetch(last.get((asset, quote)), today)) for asset, quote in pairs]
+    with timed('upstream_fetch_assets', pairs=len(pairs)):
+        charts = fetch_market_charts(wanted, **client_kwargs)
+    results = {}
+    for (asset, quote, _), chart in zip(wanted, charts):
+        name = pair_name((asset, quote))
+        if isinstance(chart, Exception):
+            print(f"Erro ao buscar {name} na CoinGecko: {chart}")
+            results[name] = {'error': str(chart)}
+            continue
+        with timed('db_write', table='asset_data', asset=name) as t:
+            rows, replaced = _store_pair(engine, (asset, quote), chart)
+            t.fields['rows'] = rows
+        results[name] = {'rows': rows, 'replaced': replaced}
+        ROWS_INGESTED.inc(rows, source='assets')
+    return results
+
+
+def asset_model_path(model_dir, pair):
+    return os.path.join(model_dir, f'{pair[0]}_{pair[1]}.pkl')
+
+
+class AssetModels:
+    """Um ModelRegistry (carregado sob demanda) por par configurado."""
+
+    def __init__(self, model_dir):
+        self.model_dir = model_dir
+        self._registries = {}
+        self._lock = threading.Lock()
+
+    def registry(self, pair):
+        registry = self._registries.get(pair)
+        if registry is None:
+            with self._lock:
+                registry = self._registries.setdefault(pair, ModelRegistry(asset_model_path(self.model_dir, pair)))
+        return registry
+
+    def stats(self):
+        return {pair_name(pair): registry.stats() for pair, registry in list(self._registries.items())}
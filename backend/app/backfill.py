@@ -0,0 +1,93 @@
+from datetime import date as date_cls, datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+# Acima de 90 dias a CoinGecko devolve um ponto por dia em vez de pontos horários;
+# limitamos cada chamada para manter o "último preço do dia" igual ao do bootstrap.
+MAX_DAYS_PER_CALL = 90
+# Lacunas separadas por até N dias já presentes viram uma única chamada
+MERGE_WITHIN_DAYS = 3
+# Quantas linhas anteriores cada linha usa para as features (ma_14)
+FEATURE_LOOKBACK = 14
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date_cls):
+        return value
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+def find_gaps(conn, until):
+    """Intervalos (início, fim) de datas ausentes em btc_data, até `until` inclusive.
+
+    A detecção é feita no SQLite com LAG() sobre a PRIMARY KEY, então só as
+    bordas das lacunas voltam para o Python, não o histórico inteiro.
+    """
+    until = _to_date(until)
+    rows = conn.execute(text('''
+        SELECT prev, date FROM (
+            SELECT date, LAG(date) OVER (ORDER BY date) AS prev FROM btc_data
+        ) WHERE prev IS NOT NULL AND julianday(date) - julianday(prev) > 1
+    ''')).fetchall()
+    gaps = []
+    for prev, nxt in rows:
+        start = _to_date(prev) + timedelta(days=1)
+        end = min(_to_date(nxt) - timedelta(days=1), until)
+        if start <= end:
+            gaps.append((start, end))
+    last = conn.execute(text('SELECT MAX(date) FROM btc_data')).scalar()
+    if last is not None:
+        start = _to_date(last) + timedelta(days=1)
+        if start <= until:
+            gaps.append((start, until))
+    return gaps
+
+
+def plan_ranges(gaps, merge_within_days=MERGE_WITHIN_DAYS, max_days=MAX_DAYS_PER_CALL):
+    """Agrupa as lacunas no menor número de chamadas ao market_chart/range.
+
+    Lacunas vizinhas (separadas por até `merge_within_days` dias existentes) são
+    unidas, e cada intervalo resultante é quebrado em blocos de `max_days`.
+    """
+    merged = []
+    for start, end in sorted(gaps):
+        if merged and (start - merged[-1][1]).days <= merge_within_days + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    ranges = []
+    for start, end in merged:
+        while start <= end:
+            chunk_end = min(end, start + timedelta(days=max_days - 1))
+            ranges.append((start, chunk_end))
+            start = chunk_end + timedelta(days=1)
+    return ranges
+
+
+def range_timestamps(start, end):
+    """Limites em segundos UNIX (UTC) para cobrir os dias [start, end] inteiros."""
+    t0 = datetime(start.year, start.month, start.day, tzinfo=timezone.utc)
+    t1 = datetime(end.year, end.month, end.day, tzinfo=timezone.utc) + timedelta(days=1)
+    return int(t0.timestamp()), int(t1.timestamp()) - 1
+
+
+def daily_last_prices(prices, wanted):
+    """Último preço de cada dia UTC (como no bootstrap), só para as datas em `wanted`."""
+    out = {}
+    for ts, price in prices:
+        d = datetime.fromtimestamp(ts / 1000, tz=timezone.utc).date()
+        if d in wanted:
+            out[d] = price
+    return out
+
+
+def missing_in(gaps):
+    wanted = set()
+    for start, end in gaps:
+        d = start
+        while d <= end:
+            wanted.add(d)
+            d += timedelta(days=1)
+    return wanted
@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from features import FEATURES
+from metrics import log_event
+from training import ALPHA, HORIZON, RidgeStats, build_training_set
+
+# Janela (em dias) das métricas fora da amostra gravadas por data
+METRICS_WINDOW = 30
+# Só as previsões dos últimos N backtests são mantidas em backtest_results
+KEEP_RUNS = 5
+# Folds por processo a partir dos quais o pool compensa: subir os processos (spawn + imports)
+# custa ~2,5 s cada e um refit ~0,6 ms, então abaixo de alguns milhares de folds por processo
+# o pool é mais lento que o próprio processo (ver backend/bench/bench_backtest.py)
+FOLDS_PER_WORKER = int(os.environ.get('BACKTEST_FOLDS_PER_WORKER', '4000'))
+
+
+def init_backtest_tables(conn):
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS backtest_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        mode TEXT,
+        train_window INTEGER,
+        min_train INTEGER,
+        step INTEGER,
+        horizon INTEGER,
+        alpha REAL,
+        n_folds INTEGER,
+        n_predictions INTEGER,
+        first_date TEXT,
+        last_date TEXT,
+        mae REAL,
+        rmse REAL,
+        r2 REAL,
+        hit_rate REAL,
+        seconds REAL
+    )'''))
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS backtest_results (
+        run_id INTEGER,
+        date TEXT,
+        fold INTEGER,
+        price_now REAL,
+        pred REAL,
+        actual REAL,
+        mae_30d REAL,
+        r2_30d REAL,
+        PRIMARY KEY (run_id, date)
+    )'''))
+
+
+def plan_folds(n_rows, min_train=180, step=7, mode='expanding', train_window=365, horizon=HORIZON):
+    """Pontos de refit do walk-forward: (treino_ini, treino_fim, teste_ini, teste_fim).
+
+    No instante t só são conhecidos os preços até t, então só entram no treino as
+    linhas i com i + horizon <= t (o target da linha i é o preço em i + horizon).
+    """
+    folds = []
+    t = min_train + horizon
+    while t < n_rows:
+        train_end = t - horizon + 1
+        train_start = max(0, train_end - train_window) if mode == 'rolling' else 0
+        folds.append((train_start, train_end, t, min(t + step, n_rows)))
+        t += step
+    return folds
+
+
+def _fit_predict_chunk(X, y, folds, alpha):
+    """Executado nos processos do pool: ajusta cada fold e prevê o bloco de teste.
+
+    Em janela crescente os folds do lote compartilham o início, então as
+    estatísticas só recebem as linhas novas entre um fold e o próximo.
+    """
+    out = []
+    stats, cur_start, cur_end = None, None, None
+    for train_start, train_end, test_start, test_end in folds:
+        if stats is None or train_start != cur_start or train_end < cur_end:
+            stats, cur_start, cur_end = RidgeStats(X.shape[1]), train_start, train_start
+        stats.update(X[cur_end:train_end], y[cur_end:train_end])
+        cur_end = train_end
+        out.append(stats.to_pipeline(alpha).predict(X[test_start:test_end]))
+    return out
+
+
+def _rolling_metrics(err, actual, window):
+    """MAE e R² das últimas `window` previsões em cada posição (vetorizado com cumsum)."""
+    n = len(err)
+    def trailing_sum(v):
+        c = np.concatenate([[0.0], np.cumsum(v)])
+        idx = np.arange(1, n + 1)
+        return c[idx] - c[np.maximum(0, idx - window)]
+    count = np.minimum(np.arange(1, n + 1), window)
+    mae = trailing_sum(np.abs(err)) / count
+    sse = trailing_sum(err ** 2)
+    s1 = trailing_sum(actual)
+    s2 = trailing_sum(actual ** 2)
+    sst = s2 - s1 ** 2 / count
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = np.where(sst > 0, 1 - sse / sst, np.nan)
+    mae[count < window] = np.nan
+    r2[count < window] = np.nan
+    return mae, r2
+
+
+def run_backtest(df, mode='expanding', train_window=365, min_train=180, step=7,
+                 alpha=ALPHA, workers=None):
+    """Walk-forward sobre btc_data com os mesmos FEATURES, horizonte e Ridge do retrain_model.
+
+    Os refits são distribuídos em lotes por um pool de processos; a pontuação é
+    feita de uma vez com NumPy sobre todas as previsões fora da amostra.
+    """
+    start = time.perf_counter()
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date'])
+    data = build_training_set(df).reset_index(drop=True)
+    X = data[FEATURES].to_numpy(dtype=float)
+    y = data['target'].to_numpy(dtype=float)
+    folds = plan_folds(len(data), min_train, step, mode, train_window)
+    if not folds:
+        return None
+
+    if workers is None:
+        # um processo por núcleo, cada um com pelo menos FOLDS_PER_WORKER folds
+        workers = min(os.cpu_count() or 1, max(1, len(folds) // FOLDS_PER_WORKER))
+    if workers <= 1:
+        preds = _fit_predict_chunk(X, y, folds, alpha)
+    else:
+        # lotes intercalados equilibram o custo (janelas crescentes); X/y vão uma vez por lote
+        chunks = [folds[i::workers] for i in range(workers)]
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            results = list(pool.map(_fit_predict_chunk, [X] * workers, [y] * workers, chunks, [alpha] * workers))
+        by_fold = {}
+        for chunk, res in zip(chunks, results):
+            by_fold.update(zip(chunk, res))
+        preds = [by_fold[f] for f in folds]
+
+    test_idx = np.concatenate([np.arange(f[2], f[3]) for f in folds])
+    fold_id = np.concatenate([np.full(f[3] - f[2], i) for i, f in enumerate(folds)])
+    pred = np.concatenate(preds)
+    actual = y[test_idx]
+    price_now = data['price'].to_numpy(dtype=float)[test_idx]
+    err = pred - actual
+
+    sst = np.sum((actual - actual.mean()) ** 2)
+    mae_30d, r2_30d = _rolling_metrics(err, actual, METRICS_WINDOW)
+    dates = data['date'].iloc[test_idx].dt.strftime('%Y-%m-%d').to_numpy()
+    summary = {
+        'mode': mode,
+        'train_window': train_window if mode == 'rolling' else None,
+        'min_train': min_train,
+        'step': step,
+        'horizon': HORIZON,
+        'alpha': alpha,
+        'n_folds': len(folds),
+        'n_predictions': int(len(pred)),
+        'first_date': dates[0],
+        'last_date': dates[-1],
+        'mae': float(np.mean(np.abs(err))),
+        'rmse': float(np.sqrt(np.mean(err ** 2))),
+        'r2': float(1 - np.sum(err ** 2) / sst) if sst > 0 else None,
+        # acerto da direção: previsão e realizado do mesmo lado do preço atual
+        'hit_rate': float(np.mean(np.sign(pred - price_now) == np.sign(actual - price_now))),
+        'seconds': time.perf_counter() - start,
+    }
+    results = pd.DataFrame({
+        'date': dates,
+        'fold': fold_id,
+        'price_now': price_now,
+        'pred': pred,
+        'actual': actual,
+        'mae_30d': mae_30d,
+        'r2_30d': r2_30d,
+    })
+    return summary, results
+
+
+def save_backtest(engine, summary, results):
+    """Grava o resumo em backtest_runs e as previsões por data em backtest_results."""
+    with engine.begin() as conn:
+        run_id = conn.execute(text('''INSERT INTO backtest_runs
+            (mode, train_window, min_train, step, horizon, alpha, n_folds, n_predictions,
+             first_date, last_date, mae, rmse, r2, hit_rate, seconds)
+            VALUES (:mode, :train_window, :min_train, :step, :horizon, :alpha, :n_folds, :n_predictions,
+                    :first_date, :last_date, :mae, :rmse, :r2, :hit_rate, :seconds)'''), summary).lastrowid
+        cols = ['date', 'fold', 'price_now', 'pred', 'actual', 'mae_30d', 'r2_30d']
+        # NaN (início da série, janela incompleta) vira NULL
+        values = results[cols].astype(object).where(results[cols].notna(), None)
+        rows = [(run_id, *r) for r in zip(*(values[c].tolist() for c in cols))]
+        conn.exec_driver_sql(
+            'INSERT INTO backtest_results (run_id, date, fold, price_now, pred, actual, mae_30d, r2_30d) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.execute(text('DELETE FROM backtest_results WHERE run_id <= :old'), {'old': run_id - KEEP_RUNS})
+    return run_id
+
+
+def backtest_and_save(engine, snapshot=None, **kwargs):
+    df = snapshot.frame(engine) if snapshot is not None else None
+    if df is None:
+        with engine.begin() as conn:
+            df = pd.read_sql('SELECT * FROM btc_data ORDER BY date', conn)
+    out = run_backtest(df, **kwargs)
+    if out is None:
+        print("Histórico insuficiente para o backtest")
+        return None
+    summary, results = out
+    summary['run_id'] = save_backtest(engine, summary, results)
+    log_event('backtest', **{k: summary[k] for k in ('run_id', 'mode', 'n_folds', 'n_predictions', 'mae', 'seconds')})
+    return summary
@@ -0,0 +1,73 @@
+import contextlib
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+# Quanto tempo uma conexão espera pelo lock de escrita antes de falhar com "database is locked"
+BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', '8'))
+
+PRAGMAS = (
+    # leitores não bloqueiam o escritor (e vice-versa): API lendo enquanto o scheduler grava
+    'PRAGMA journal_mode=WAL',
+    # em WAL, NORMAL só faz fsync no checkpoint; seguro contra corrupção, bem mais barato que FULL
+    'PRAGMA synchronous=NORMAL',
+    f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}',
+    'PRAGMA temp_store=MEMORY',
+    # ~20 MB de cache de páginas por conexão
+    'PRAGMA cache_size=-20000',
+)
+
+
+def make_engine(db_path, pool_size=POOL_SIZE):
+    """Engine SQLite com WAL, busy timeout e pool de conexões reaproveitadas.
+
+    O pysqlite por padrão abre a transação só no primeiro INSERT/UPDATE, e em
+    WAL uma transação que leu e depois tenta escrever pode falhar na hora com
+    SQLITE_BUSY sem respeitar o busy_timeout. Por isso o BEGIN é emitido por
+    nós: `BEGIN` nas leituras e `BEGIN IMMEDIATE` em `begin_write()`, que já
+    pega o lock de escrita no início (esperando o busy_timeout, se preciso).
+    """
+    engine = create_engine(
+        f'sqlite:///{db_path}',
+        connect_args={'check_same_thread': False, 'timeout': BUSY_TIMEOUT_MS / 1000},
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=pool_size,
+    )
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_conn, _record):
+        # desliga o BEGIN automático do pysqlite; o evento 'begin' abaixo assume
+        dbapi_conn.isolation_level = None
+        cur = dbapi_conn.cursor()
+        for pragma in PRAGMAS:
+            cur.execute(pragma)
+        cur.close()
+
+    @event.listens_for(engine, 'begin')
+    def _on_begin(conn):
+        if conn.get_execution_options().get('sqlite_begin_immediate'):
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+        else:
+            conn.exec_driver_sql('BEGIN')
+
+    return engine
+
+
+@contextlib.contextmanager
+def begin_write(engine):
+    """Como `engine.begin()`, mas para transações que leem e depois escrevem (BEGIN IMMEDIATE)."""
+    with engine.connect() as conn:
+        conn.execution_options(sqlite_begin_immediate=True)
+        with conn.begin():
+            yield conn
+
+
+def remove_db_files(db_path):
+    """Apaga o arquivo do banco junto com o -wal e o -shm do modo WAL."""
+    for suffix in ('', '-wal', '-shm'):
+        path = db_path + suffix
+        if os.path.exists(path):
+            os.remove(path)
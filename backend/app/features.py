@@ -0,0 +1,150 @@
+import math
+from collections import deque
+from datetime import date as date_cls, datetime
+
+# Mesmas features do notebook
+FEATURES = [f'lag_{i}' for i in range(1, 8)] + ['ma_7', 'ma_14', 'ret_1d', 'ret_7d', 'dow']
+# Histórico mínimo para que todas as features existam (ma_14)
+MIN_HISTORY = 14
+
+
+def make_features(df):
+    for lag in range(1, 8):
+        df[f'lag_{lag}'] = df['price'].shift(lag)
+    df['ma_7'] = df['price'].rolling(7).mean()
+    df['ma_14'] = df['price'].rolling(14).mean()
+    df['ret_1d'] = df['price'].pct_change()
+    df['ret_7d'] = df['price'].pct_change(7)
+    df['dow'] = df['date'].dt.dayofweek
+    return df
+
+
+class _RollingMean:
+    """Média móvel de janela fixa com soma compensada (Kahan).
+
+    Reproduz o algoritmo de `Series.rolling(w).mean()` do pandas (add_mean /
+    remove_mean / calc_mean), então, partindo da mesma série, o resultado é
+    idêntico bit a bit ao de `make_features`.
+    """
+
+    __slots__ = ('window', 'nobs', 'sum_x', 'neg_ct', 'comp_add', 'comp_remove',
+                 'same_count', 'prev_value')
+
+    def __init__(self, window):
+        self.window = window
+        self.nobs = 0
+        self.sum_x = 0.0
+        self.neg_ct = 0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.same_count = 0
+        self.prev_value = None
+
+    def add(self, val):
+        if self.prev_value is None:
+            self.prev_value = val
+        self.nobs += 1
+        y = val - self.comp_add
+        t = self.sum_x + y
+        self.comp_add = t - self.sum_x - y
+        self.sum_x = t
+        if math.copysign(1.0, val) < 0:
+            self.neg_ct += 1
+        # valores repetidos: o pandas devolve o próprio valor para evitar ruído de ponto flutuante
+        if val == self.prev_value:
+            self.same_count += 1
+        else:
+            self.same_count = 1
+        self.prev_value = val
+
+    def remove(self, val):
+        self.nobs -= 1
+        y = -val - self.comp_remove
+        t = self.sum_x + y
+        self.comp_remove = t - self.sum_x - y
+        self.sum_x = t
+        if math.copysign(1.0, val) < 0:
+            self.neg_ct -= 1
+
+    def value(self):
+        if self.nobs < self.window:
+            return math.nan
+        result = self.sum_x / self.nobs
+        if self.same_count >= self.nobs:
+            result = self.prev_value
+        elif self.neg_ct == 0 and result < 0:
+            result = 0.0
+        elif self.neg_ct == self.nobs and result > 0:
+            result = 0.0
+        return result
+
+
+def _weekday(d):
+    if isinstance(d, str):
+        d = datetime.strptime(d[:10], '%Y-%m-%d')
+    if isinstance(d, (datetime, date_cls)):
+        return d.weekday()
+    # pandas.Timestamp / numpy datetime64
+    return d.dayofweek
+
+
+class StreamingFeatures:
+    """Calcula as features de uma nova observação em tempo constante, sem pandas.
+
+    Mantém um ring buffer com os últimos 14 preços e as somas das médias de 7 e
+    14 dias. `push` devolve lag_1..lag_7, ma_7, ma_14, ret_1d, ret_7d e dow com
+    os mesmos valores que `make_features` produziria para a última linha.
+    """
+
+    def __init__(self):
+        self._prices = deque(maxlen=MIN_HISTORY)
+        self._ma_7 = _RollingMean(7)
+        self._ma_14 = _RollingMean(14)
+        self.last_date = None
+        self.last_price = None
+        self.current = None
+
+    @classmethod
+    def from_history(cls, dates, prices):
+        """Cria o estado reaplicando uma série (datas em ordem crescente)."""
+        engine = cls()
+        for d, p in zip(dates, prices):
+            engine.push(d, p)
+        return engine
+
+    @property
+    def ready(self):
+        """True quando a última observação já tem todas as features (sem NaN)."""
+        return self.current is not None and len(self._prices) >= MIN_HISTORY
+
+    def push(self, date, price):
+        price = float(price)
+        prices = self._prices
+        n = len(prices)
+        if n >= 7:
+            self._ma_7.remove(prices[-7])
+        if n >= 14:
+            self._ma_14.remove(prices[0])
+        self._ma_7.add(price)
+        self._ma_14.add(price)
+
+        feats = {'price': price}
+        for lag in range(1, 8):
+            feats[f'lag_{lag}'] = prices[-lag] if n >= lag else math.nan
+        feats['ma_7'] = self._ma_7.value()
+        feats['ma_14'] = self._ma_14.value()
+        feats['ret_1d'] = price / prices[-1] - 1 if n >= 1 else math.nan
+        feats['ret_7d'] = price / prices[-7] - 1 if n >= 7 else math.nan
+        feats['dow'] = _weekday(date)
+
+        prices.append(price)
+        self.last_date = date
+        self.last_price = price
+        self.current = feats
+        return feats
+
+    def vector(self, features=FEATURES):
+        """Features da última observação na ordem pedida pelo modelo."""
+        if not self.ready:
+            return None
+        return [self.current[f] for f in features]
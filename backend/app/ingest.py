@@ -0,0 +1,207 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from metrics import STAGE_SECONDS
+
+COINGECKO_URL = os.environ.get('COINGECKO_URL', 'https://api.coingecko.com/api/v3')
+# Fim da pausa pedida pelo último 429 (time.monotonic): o limite da CoinGecko é por IP, então
+# vale para todos os clientes do processo, inclusive os das próximas chamadas
+_blocked_until = 0.0
+
+
+class UpstreamError(Exception):
+    """Falha definitiva ao consultar a CoinGecko (depois de esgotar as tentativas)."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _retry_after_seconds(response):
+    value = response.headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CoinGeckoClient:
+    """Cliente assíncrono da CoinGecko com pool de conexões e retry.
+
+    - um único `httpx.AsyncClient` (keep-alive) por instância;
+    - no máximo `max_concurrency` requisições simultâneas;
+    - backoff exponencial com jitter para timeouts, erros de rede e 5xx;
+    - em 429 respeita o `Retry-After` e pausa *todas* as requisições do processo
+      até o fim da janela, em vez de cada uma insistir por conta própria.
+
+    `base_url` pode apontar para um stub local (ver backend/bench/coingecko_stub.py).
+    """
+
+    def __init__(self, base_url=None, max_concurrency=4, timeout=10.0, max_retries=4,
+                 backoff_base=1.0, backoff_max=60.0, max_connections=10):
+        self.base_url = (base_url or COINGECKO_URL).rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_connections = max_connections
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = None
+        self.requests_made = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(self.timeout),
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+        self._client = None
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    async def _wait_rate_limit(self):
+        delay = _blocked_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def get_json(self, path, params=None, timeout=None):
+        global _blocked_until
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                await self._wait_rate_limit()
+                self.requests_made += 1
+                start = time.perf_counter()
+                try:
+                    response = await self._client.get(
+                        path, params=params, timeout=httpx.USE_CLIENT_DEFAULT if timeout is None else timeout)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    last_error = UpstreamError(f'Erro de rede na CoinGecko: {e!r}')
+                    response = None
+                # cada tentativa conta, inclusive as que falharam ou tomaram 429
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage='upstream_fetch')
+            if response is not None:
+                if response.status_code == 429:
+                    self.rate_limited += 1
+                    wait = _retry_after_seconds(response)
+                    if wait is None:
+                        wait = self._backoff(attempt)
+                    _blocked_until = max(_blocked_until, time.monotonic() + wait)
+                    last_error = UpstreamError('CoinGecko rate limit (429)', 429)
+                    if attempt < self.max_retries:
+                        self.retries += 1
+                        print(f"CoinGecko 429: aguardando {wait:.1f}s antes de tentar de novo")
+                    continue
+                if response.status_code >= 500:
+                    last_error = UpstreamError(f'CoinGecko HTTP {response.status_code}', response.status_code)
+                elif response.status_code >= 400:
+                    raise UpstreamError(f'CoinGecko HTTP {response.status_code}: {response.text[:200]}',
+                                        response.status_code)
+                else:
+                    return response.json()
+            if attempt < self.max_retries:
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt))
+        raise last_error
+
+    async def market_chart(self, coin='bitcoin', vs_currency='usd', days=1, timeout=None):
+        data = await self.get_json(f'/coins/{coin}/market_chart',
+                                   params={'vs_currency': vs_currency, 'days': days}, timeout=timeout)
+        if 'prices' not in data:
+            raise UpstreamError('Resposta da CoinGecko sem o campo prices')
+        return data
+
+    async def market_chart_range(self, from_ts, to_ts, coin='bitcoin', vs_currency='usd', timeout=None):
+        data = await self.get_json(f'/coins/{coin}/market_chart/range',
+                                   params={'vs_currency': vs_currency, 'from': from_ts, 'to': to_ts},
+                                   timeout=timeout)
+        if 'prices' not in data:
+            raise UpstreamError('Resposta da CoinGecko sem o campo prices')
+        return data
+
+
+class _SharedClient:
+    """Um CoinGeckoClient aberto durante toda a vida do processo, num event loop próprio (thread daemon).
+
+    As funções síncronas abaixo (jobs, scheduler, backfill) rodam as corrotinas
+    nele: as chamadas de uma mesma ingestão reaproveitam as conexões keep-alive
+    e dividem o semáforo de concorrência.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._client = None
+
+    def run(self, fn):
+        """Roda `fn(client)` (que devolve um awaitable) no loop do cliente e espera o resultado."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='coingecko', daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self._call(fn), self._loop).result()
+
+    async def _call(self, fn):
+        # só roda na thread do loop: a criação do cliente não disputa com outras chamadas
+        if self._client is None:
+            self._client = await CoinGeckoClient().__aenter__()
+        return await fn(self._client)
+
+
+_shared = _SharedClient()
+
+
+def _run(fn, client_kwargs):
+    """Roda `fn(client)` no cliente compartilhado; opções de cliente além do `timeout` abrem um cliente só para a chamada."""
+    timeout = client_kwargs.pop('timeout', None)
+    if not client_kwargs:
+        return _shared.run(lambda client: fn(client, timeout))
+
+    async def _dedicated():
+        async with CoinGeckoClient(timeout=timeout or 10.0, **client_kwargs) as client:
+            return await fn(client, timeout)
+    return asyncio.run(_dedicated())
+
+
+def fetch_market_chart_ranges(ranges, coin='bitcoin', vs_currency='usd', **client_kwargs):
+    """Busca vários intervalos (from_ts, to_ts) em paralelo, respeitando o limite de concorrência."""
+    return _run(lambda client, timeout: asyncio.gather(*(client.market_chart_range(f, t, coin, vs_currency, timeout)
+                                                         for f, t in ranges)), client_kwargs)
+
+
+def fetch_market_charts(requests, **client_kwargs):
+    """Vários pares (coin, vs_currency, days) em paralelo pelo mesmo cliente.
+
+    Todos dividem o mesmo semáforo e a mesma pausa de 429 (um orçamento de rate
+    limit só). A falha de um par volta como exceção na posição dele, sem
+    cancelar os outros.
+    """
+    return _run(lambda client, timeout: asyncio.gather(*(client.market_chart(coin, vs, days, timeout)
+                                                         for coin, vs, days in requests),
+                                                       return_exceptions=True), client_kwargs)
+
+
+def fetch_market_chart(days, coin='bitcoin', vs_currency='usd', **client_kwargs):
+    """Versão síncrona para uso nos jobs e no scheduler (roda no cliente compartilhado do processo)."""
+    return _run(lambda client, timeout: client.market_chart(coin, vs_currency, days, timeout), client_kwargs)
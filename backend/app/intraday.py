@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+from sqlalchemy import text
+
+# Um tick por janela de 5 minutos (a resolução mais fina do market_chart da CoinGecko):
+# no máximo 288 linhas por dia em btc_ticks, por mais vezes que a série seja buscada
+TICK_MS = 5 * 60 * 1000
+HOUR_MS = 60 * 60 * 1000
+DAY_MS = 24 * HOUR_MS
+# Ticks mais antigos que isso são apagados; as barras de 1h e 1d ficam
+RAW_RETENTION_DAYS = int(os.environ.get('INTRADAY_RAW_DAYS', '90'))
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'n', 'rv']
+
+
+def init_intraday_tables(conn):
+    # ts INTEGER PRIMARY KEY é o próprio rowid: a tabela é a B-tree de (ts, price), sem índice à parte
+    conn.execute(text('CREATE TABLE IF NOT EXISTS btc_ticks (ts INTEGER PRIMARY KEY, price REAL)'))
+    # rv: variância realizada (soma dos log-retornos ao quadrado entre ticks da mesma barra)
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS btc_bars_1h (
+        ts INTEGER PRIMARY KEY,
+        open REAL, high REAL, low REAL, close REAL,
+        n INTEGER,
+        rv REAL
+    )'''))
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS btc_bars_1d (
+        date TEXT PRIMARY KEY,
+        open REAL, high REAL, low REAL, close REAL,
+        n INTEGER,
+        rv REAL
+    ) WITHOUT ROWID'''))
+
+
+def _bars(ts, prices, size):
+    """Barras OHLC + n + rv por janela de `size` ms, a partir de ticks em ordem crescente."""
+    keys = ts // size
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(ts)]
+    r2 = np.r_[0.0, np.diff(np.log(prices)) ** 2]
+    # o retorno do primeiro tick de cada barra cruza a fronteira: fica de fora
+    r2[starts] = 0.0
+    rv = np.add.reduceat(r2, starts)
+    n = ends - starts
+    return [(int(keys[s] * size), float(prices[s]), float(prices[s:e].max()), float(prices[s:e].min()),
+             float(prices[e - 1]), int(e - s), float(v) if c > 1 else None)
+            for s, e, v, c in zip(starts, ends, rv, n)]
+
+
+def refresh_bars(conn, since_ts):
+    """Refaz as barras de 1h e 1d dos dias a partir do que contém `since_ts` (só os ticks desses dias são lidos)."""
+    day_start = since_ts - since_ts % DAY_MS
+    rows = conn.execute(text('SELECT ts, price FROM btc_ticks WHERE ts >= :s ORDER BY ts'), {'s': day_start}).fetchall()
+    if not rows:
+        return 0
+    ts = np.array([r[0] for r in rows], dtype=np.int64)
+    prices = np.array([r[1] for r in rows], dtype=float)
+    hours = _bars(ts, prices, HOUR_MS)
+    days = [(np.datetime64(b[0], 'ms').astype('datetime64[D]').astype(str),) + b[1:] for b in _bars(ts, prices, DAY_MS)]
+    placeholders = ', '.join('?' * (len(BAR_COLUMNS) + 1))
+    conn.exec_driver_sql(f"INSERT OR REPLACE INTO btc_bars_1h (ts, {', '.join(BAR_COLUMNS)}) VALUES ({placeholders})",
+                         hours)
+    conn.exec_driver_sql(f"INSERT OR REPLACE INTO btc_bars_1d (date, {', '.join(BAR_COLUMNS)}) VALUES ({placeholders})",
+                         days)
+    return len(hours)
+
+
+def append_ticks(conn, prices, now_ms=None):
+    """Grava os pontos [ts_ms, preço] do market_chart em btc_ticks e atualiza as barras afetadas.
+
+    Cada ponto vai para a janela de 5 minutos que o contém (o último ponto da
+    janela vence), então buscar a mesma série de novo só reescreve as mesmas
+    linhas. Ticks com mais de RAW_RETENTION_DAYS dias são apagados depois que
+    suas barras foram gravadas. Retorna o número de janelas gravadas.
+    """
+    slots = {}
+    for ts, price in prices:
+        if price is not None and price > 0:
+            slots[int(ts) - int(ts) % TICK_MS] = float(price)
+    if not slots:
+        return 0
+    conn.exec_driver_sql('INSERT OR REPLACE INTO btc_ticks (ts, price) VALUES (?, ?)', sorted(slots.items()))
+    refresh_bars(conn, min(slots))
+    now_ms = max(slots) if now_ms is None else now_ms
+    conn.execute(text('DELETE FROM btc_ticks WHERE ts < :cutoff'), {'cutoff': now_ms - RAW_RETENTION_DAYS * DAY_MS})
+    return len(slots)
+
+
+def realized_volatility(conn, end, days=7):
+    """Volatilidade diária realizada (%, raiz da média da rv dos últimos `days` dias até `end`), ou None."""
+    n, total = conn.execute(text('''SELECT COUNT(rv), SUM(rv) FROM (
+        SELECT rv FROM btc_bars_1d WHERE date <= :end AND rv IS NOT NULL ORDER BY date DESC LIMIT :days
+    )'''), {'end': end, 'days': days}).one()
+    return float(np.sqrt(total / n) * 100) if n else None
+
+
+def daily_realized_vol(conn, start, end):
+    """{data: volatilidade realizada do dia em %} entre `start` e `end`."""
+    return {d: float(np.sqrt(rv) * 100) for d, rv in conn.execute(
+        text('SELECT date, rv FROM btc_bars_1d WHERE date BETWEEN :s AND :e AND rv IS NOT NULL'),
+        {'s': start, 'e': end})}
+
+
+def storage_stats(conn):
+    ticks, first_ts, last_ts = conn.execute(text('SELECT COUNT(*), MIN(ts), MAX(ts) FROM btc_ticks')).one()
+    return {
+        'ticks': ticks,
+        'first_tick_ts': first_ts,
+        'last_tick_ts': last_ts,
+        'bars_1h': conn.execute(text('SELECT COUNT(*) FROM btc_bars_1h')).scalar(),
+        'bars_1d': conn.execute(text('SELECT COUNT(*) FROM btc_bars_1d')).scalar(),
+        'max_ticks_per_day': DAY_MS // TICK_MS,
+        'raw_retention_days': RAW_RETENTION_DAYS,
+    }
@@ -0,0 +1,76 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueue:
+    """Fila de jobs em background com status consultável por id.
+
+    Os jobs rodam num pool pequeno (por padrão 1 worker, então ingestões nunca
+    se sobrepõem). Pedir de novo um job com o mesmo nome/argumentos enquanto ele
+    ainda está na fila ou rodando devolve o job existente.
+    """
+
+    def __init__(self, max_workers=1, max_history=100, name='jobs'):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_history = max_history
+
+    def submit(self, name, fn, *args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job['_key'] == key and job['status'] in ('queued', 'running'):
+                    return dict(self._public(job), deduplicated=True)
+            job = {
+                'id': uuid.uuid4().hex,
+                'name': name,
+                'status': 'queued',
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                '_key': key,
+            }
+            self._jobs[job['id']] = job
+            while len(self._jobs) > self.max_history:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest['status'] in ('queued', 'running'):
+                    break
+                del self._jobs[oldest_id]
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return self._public(job)
+
+    def _run(self, job, fn, args, kwargs):
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        try:
+            job['result'] = fn(*args, **kwargs)
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+            print(f"Job {job['name']} ({job['id']}) falhou: {e}")
+            traceback.print_exc()
+        finally:
+            job['finished_at'] = time.time()
+
+    @staticmethod
+    def _public(job):
+        out = {k: v for k, v in job.items() if not k.startswith('_')}
+        if out['started_at'] and out['finished_at']:
+            out['duration_seconds'] = round(out['finished_at'] - out['started_at'], 3)
+        return out
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return None if job is None else self._public(job)
+
+    def list(self):
+        with self._lock:
+            return [self._public(j) for j in reversed(self._jobs.values())]
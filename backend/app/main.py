@@ -1,35 +1,134 @@
-from fastapi import FastAPI, HTTPException, Query, APIRouter
-from fastapi.responses import JSONResponse, Response
-from apscheduler.schedulers.background import BackgroundScheduler
-from sqlalchemy import create_engine, text
+import time
+# Início do import: base para medir o tempo até servir e até a primeira requisição
+IMPORT_STARTED = time.perf_counter()
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, APIRouter, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import text
 import pandas as pd
 import numpy as np
-import requests
-import joblib
+import json
+import math
 import os
-from datetime import datetime, timezone
-from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import StandardScaler
-from sklearn.linear_model import Ridge
+from datetime import datetime, timezone, timedelta
 import traceback
+import threading
+import copy
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field
+from assets import (ASSET_PATTERN, DEFAULT_ASSET, DEFAULT_PAIR, DEFAULT_QUOTE, AssetModels, ingest_assets,
+                    init_asset_tables, model_run_source, pair_name, parse_pairs, prediction_source, price_source)
+from backtest import backtest_and_save, init_backtest_tables
+from db import begin_write, make_engine, remove_db_files
+from backfill import FEATURE_LOOKBACK, daily_last_prices, find_gaps, missing_in, plan_ranges, range_timestamps
+from ingest import UpstreamError, fetch_market_chart, fetch_market_chart_ranges
+from intraday import (BAR_COLUMNS, append_ticks, daily_realized_vol, init_intraday_tables, realized_volatility,
+                      storage_stats as intraday_storage_stats)
+from jobs import JobQueue
+from metrics import (PROMETHEUS_MEDIA_TYPE, REGISTRY, REQUEST_SECONDS, REQUESTS, ROWS_INGESTED, SCHEDULED_JOBS,
+                     timed)
+from features import FEATURES, make_features, StreamingFeatures
+from model_registry import ModelRegistry
+from push import EVENT_STREAM_MEDIA_TYPE, Broadcaster, PushFull, init_push_tables
+from response_cache import FastJSONResponse, ResponseCache, cached_response
+from rollups import OHLC_COLUMNS, init_rollup_tables, ohlc_query, refresh_rollups
+from scheduling import (Lease, LeaderScheduler, LeaseBusy, ensure_job, init_scheduler_tables, process_owner,
+                        record_run, run_history, run_recorded)
+from startup import StartupTracker
+from snapshot import ARROW_MEDIA_TYPE, PARQUET_MEDIA_TYPE, HistorySnapshot, serialize_table
+from streaming import (COLUMNAR_MEDIA_TYPE, NO_LIMIT, columnar_payload, iter_chunks, json_array_response,
+                       ndjson_response, split_payload, wants_columnar)
+from training import TrainingWorker, train_and_save
 
 # Use caminhos absolutos para garantir que funcionem no container
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = '/data/db.sqlite'
-MODEL_PATH = os.path.join(BASE_DIR, 'models', 'btc_linreg.pkl')
+DB_PATH = os.environ.get('DB_PATH', '/data/db.sqlite')
+MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(BASE_DIR, 'models', 'btc_linreg.pkl'))
+# Snapshot colunar de btc_data (NumPy/Arrow/Parquet) no mesmo volume do banco
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(os.path.dirname(DB_PATH), 'snapshot'))
+# Pares além de bitcoin/usd (ex.: "ethereum,solana,cardano:eur"), guardados em asset_data
+ASSET_PAIRS = parse_pairs(os.environ.get('ASSETS', ''), os.environ.get('QUOTE', DEFAULT_QUOTE))
+# Modo intraday: guarda a série de 5 minutos em btc_ticks, com barras de 1h e 1d
+INTRADAY_MODE = os.environ.get('INTRADAY', '0') == '1'
+INTRADAY_POLL_MINUTES = int(os.environ.get('INTRADAY_POLL_MINUTES', '60'))
+# Histórico intraday buscado na primeira vez (até 90 dias a CoinGecko devolve pontos de hora em hora)
+INTRADAY_SEED_DAYS = int(os.environ.get('INTRADAY_SEED_DAYS', '90'))
 
 # Garantir que a pasta models exista
 os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
 print(f"Diretório do modelo: {os.path.dirname(MODEL_PATH)}")
 
-app = FastAPI(docs_url="/api/docs", openapi_url="/api/openapi.json", redoc_url="/api/redoc")
+@asynccontextmanager
+async def lifespan(app):
+    """Inicialização sem trabalho pesado no import nem antes de servir.
+
+    Cria as tabelas (rápido), liga o scheduler e dispara o bootstrap numa thread;
+    o uvicorn começa a aceitar requisições logo depois, com o modelo e o banco
+    que já estão no volume.
+    """
+    init_db()
+    # só o processo dono do lease roda os jobs (vários workers/réplicas no mesmo banco)
+    scheduler.start()
+    # um único loop de fan-out para todos os clientes do /api/stream
+    push_task = asyncio.create_task(broadcaster.run())
+    startup.start(bootstrap_app)
+    startup.mark('serving')
+    yield
+    push_task.cancel()
+    scheduler.shutdown()
+
+def _schedule_jobs(sched):
+    """Jobs do processo líder, conferidos contra o job store persistente a cada vez que ele assume."""
+    ensure_job(sched, 'daily_ingest', scheduled_job, CronTrigger(hour=0, minute=15))
+    if INTRADAY_MODE:
+        ensure_job(sched, 'intraday_ingest', scheduled_intraday, IntervalTrigger(minutes=INTRADAY_POLL_MINUTES))
+    elif sched.get_job('intraday_ingest') is not None:
+        sched.remove_job('intraday_ingest')
+
+def _on_job_missed(job_id, scheduled_run_time):
+    """Execução atrasada além do misfire grace: fica no histórico (a próxima ingestão cobre as lacunas)."""
+    SCHEDULED_JOBS.inc(outcome='missed')
+    print(f"Job {job_id} de {scheduled_run_time} perdido (fora do misfire grace)")
+    record_run(engine, job_id, PROCESS_ID, None, time.time(), 'missed', result={'scheduled_run_time': scheduled_run_time})
+
+app = FastAPI(docs_url="/api/docs", openapi_url="/api/openapi.json", redoc_url="/api/redoc", lifespan=lifespan)
 router = APIRouter(prefix="/api")
-scheduler = BackgroundScheduler()
-engine = create_engine(f'sqlite:///{DB_PATH}', connect_args={"check_same_thread": False})
+def current_engine():
+    # o /resetdb troca o engine: leases e job store sempre pegam o atual
+    return engine
+
+PROCESS_ID = process_owner()
+scheduler = LeaderScheduler(current_engine, PROCESS_ID, _schedule_jobs, on_missed=_on_job_missed)
+# Ingestão e bootstrap rodam em um processo por vez (os outros esperam até INGEST_LEASE_WAIT_SECONDS)
+ingest_lease = Lease(current_engine, 'ingest', PROCESS_ID)
+INGEST_LEASE_WAIT_SECONDS = float(os.environ.get('INGEST_LEASE_WAIT_SECONDS', '300'))
+# Deltas de preço, previsão e métricas para o /api/stream (SSE)
+broadcaster = Broadcaster(current_engine)
+startup = StartupTracker(IMPORT_STARTED)
+# WAL + busy_timeout + pool: leituras da API não travam na escrita do scheduler/treino
+engine = make_engine(DB_PATH)
+model_registry = ModelRegistry(MODEL_PATH)
+prediction_cache = ResponseCache()
+# Resposta montada do /dashboard (as quatro partes juntas)
+dashboard_cache = ResponseCache()
+history_snapshot = HistorySnapshot(SNAPSHOT_DIR)
+# Um modelo por par de ASSET_PAIRS, ao lado do modelo do bitcoin
+MODEL_DIR = os.path.dirname(MODEL_PATH)
+asset_models = AssetModels(MODEL_DIR)
+# Estado incremental das features (últimos 14 preços), posicionado na última data gravada
+feature_state = None
+feature_state_lock = threading.Lock()
+# Ingestão (refresh manual e agendado) roda em background, um job por vez
+ingest_jobs = JobQueue(max_workers=1, name='ingest')
+# Backtests walk-forward (os refits em si rodam num pool de processos)
+backtest_jobs = JobQueue(max_workers=1, name='backtest')
 
 # --- DB INIT ---
 def init_db():
-    with engine.begin() as conn:
+    with begin_write(engine) as conn:
         conn.execute(text('''CREATE TABLE IF NOT EXISTS btc_data (
             date TEXT PRIMARY KEY,
             price REAL,
@@ -44,360 +143,1096 @@ def init_db():
             date TEXT,
             pred_7d REAL
         )'''))
-
-init_db()
+        # atende o JOIN (date, MAX(run_ts)) do /history e a checagem de duplicata do /predict
+        conn.execute(text('CREATE INDEX IF NOT EXISTS idx_predictions_date_run_ts ON predictions (date, run_ts)'))
+        # Barras OHLC semanais/mensais mantidas na ingestão
+        init_rollup_tables(conn)
+        if conn.execute(text('SELECT 1 FROM btc_ohlc LIMIT 1')).fetchone() is None:
+            refresh_rollups(conn)
+        # Pares de ASSET_PAIRS: preços/features, previsões e treinos por (asset, quote)
+        init_asset_tables(conn)
+        # Ticks de 5 minutos e barras de 1h/1d (só preenchidas com INTRADAY=1)
+        init_intraday_tables(conn)
+        # Leases entre processos e histórico das execuções agendadas
+        init_scheduler_tables(conn)
+        # Eventos do /api/stream (replay para quem reconecta com Last-Event-ID)
+        init_push_tables(conn)
+        # Métricas e metadados de cada treino, calculados uma única vez no retrain
+        init_backtest_tables(conn)
+        conn.execute(text('''CREATE TABLE IF NOT EXISTS model_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            model_version TEXT,
+            n_rows INTEGER,
+            first_date TEXT,
+            last_date TEXT,
+            horizon INTEGER,
+            alpha REAL,
+            mae_train REAL,
+            r2_train REAL,
+            fit_seconds REAL
+        )'''))
+        # bancos criados antes do treino incremental não têm a coluna mode
+        cols = [r[1] for r in conn.execute(text('PRAGMA table_info(model_runs)'))]
+        if 'mode' not in cols:
+            conn.execute(text("ALTER TABLE model_runs ADD COLUMN mode TEXT DEFAULT 'full'"))
+        # get_model_run busca pela versão servida
+        conn.execute(text('CREATE INDEX IF NOT EXISTS idx_model_runs_version ON model_runs (model_version)'))
 
 # --- Bootstrap ---
+@timed('bootstrap')
 def bootstrap_app():
-    """Garante que o banco tenha dados e que o modelo esteja treinado na inicialização."""
+    """Garante que o banco tenha dados e que o modelo esteja treinado.
+
+    Roda numa thread disparada pelo lifespan: o servidor já atende com o modelo
+    e o banco persistidos enquanto isso, e /api/health/ready acompanha as etapas.
+    """
     print("Iniciando bootstrap da aplicação...")
-    
-    try:
-        # Verifica se existem dados no banco
-        with engine.begin() as conn:
-            cnt = conn.execute(text('SELECT COUNT(*) FROM btc_data')).scalar()
-        
+    with startup.stage('load_model'):
+        # carrega (e importa o sklearn) antes da primeira previsão
+        try:
+            model_registry.get()
+        except Exception as e:
+            print(f"Erro ao carregar modelo persistido: {e}")
+
+    # com vários workers só um faz a carga inicial/treino; os outros esperam e encontram tudo pronto
+    with ingest_lease.hold(wait=INGEST_LEASE_WAIT_SECONDS) as held:
+        if not held:
+            print("Lease de ingestão ocupado por outro processo; seguindo o bootstrap mesmo assim")
+        with startup.stage('check_data'):
+            with engine.begin() as conn:
+                cnt = conn.execute(text('SELECT COUNT(*) FROM btc_data')).scalar()
         print(f"Banco de dados tem {cnt} registros")
-        
+
         # Se o banco estiver vazio, busca dados históricos
         if cnt == 0:
             print("Banco vazio. Iniciando bootstrap com dados históricos...")
-            fetch_and_insert(force=True)
-        else:
-            # Se já tem dados no banco, verifica se o modelo existe
-            if not os.path.exists(MODEL_PATH):
-                print("Modelo não encontrado. Retreinando...")
-                retrain_model()
-                print(f"Modelo treinado e salvo em: {MODEL_PATH}")
-            else:
-                print(f"Modelo encontrado em: {MODEL_PATH}")
-        
-        # Força o treinamento do modelo se ele não existir
+            with startup.stage('initial_load'):
+                fetch_and_insert(force=True)
+
+        # Treina o modelo se ele não existir
         if not os.path.exists(MODEL_PATH):
-            print("Forçando treinamento do modelo...")
-            retrain_model()
+            print("Modelo não encontrado. Retreinando...")
+            with startup.stage('train'):
+                # a carga inicial já pediu um refit completo ao worker: espera por ele em vez de treinar duas vezes
+                training_worker.wait_idle()
+                if not os.path.exists(MODEL_PATH):
+                    retrain_model()
             print(f"Modelo treinado e salvo em: {MODEL_PATH}")
-            
-        print(f"Bootstrap concluído. Banco tem {cnt} registros.")
-        return True
-    except Exception as e:
-        print(f"Erro no bootstrap: {e}")
-        traceback.print_exc()
-        return False
+        else:
+            print(f"Modelo encontrado em: {MODEL_PATH}")
 
-# Executa o bootstrap logo após definir a função
-print("Chamando bootstrap_app()...")
-bootstrap_app()
-
-# --- Feature Engineering ---
-def make_features(df):
-    for lag in range(1, 8):
-        df[f'lag_{lag}'] = df['price'].shift(lag)
-    df['ma_7'] = df['price'].rolling(7).mean()
-    df['ma_14'] = df['price'].rolling(14).mean()
-    df['ret_1d'] = df['price'].pct_change()
-    df['ret_7d'] = df['price'].pct_change(7)
-    df['dow'] = df['date'].dt.dayofweek
-    return df
+        if ASSET_PAIRS:
+            with startup.stage('assets'):
+                refresh_assets()
+        if INTRADAY_MODE:
+            with engine.begin() as conn:
+                has_ticks = conn.execute(text('SELECT 1 FROM btc_ticks LIMIT 1')).fetchone() is not None
+            if not has_ticks:
+                with startup.stage('intraday_seed'):
+                    ingest_intraday(days=INTRADAY_SEED_DAYS)
+    print(f"Bootstrap concluído. Banco tem {cnt} registros.")
 
 # --- Data Fetch & Insert ---
+BTC_COLUMNS = ['date', 'price'] + [f'lag_{i}' for i in range(1, 8)] + ['ma_7', 'ma_14', 'ret_1d', 'ret_7d', 'dow']
+
+def bulk_insert_features(df_feat, replace=False):
+    """Insere em lote (um único executemany com INSERT OR IGNORE) as linhas de features.
+
+    As colunas são convertidas direto para listas Python (sem iterrows), e datas
+    já existentes são ignoradas pela PRIMARY KEY (ou sobrescritas, com `replace=True`).
+    Retorna o número de linhas inseridas.
+    """
+    if df_feat.empty:
+        return 0
+    columns = [df_feat[c].tolist() for c in BTC_COLUMNS[1:]]
+    dates = df_feat['date']
+    if not pd.api.types.is_string_dtype(dates):
+        dates = dates.dt.strftime('%Y-%m-%d')
+    rows = list(zip(dates.tolist(), *columns))
+    sql = f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO btc_data ({', '.join(BTC_COLUMNS)}) VALUES ({', '.join('?' * len(BTC_COLUMNS))})"
+    with timed('db_write', table='btc_data', rows=len(rows)) as t:
+        with engine.begin() as conn:
+            inserted = conn.exec_driver_sql(sql, rows).rowcount
+        t.fields['inserted'] = inserted
+    return inserted
+
+@timed('ingest')
 def fetch_and_insert(force=False):
     # initial bootstrap: load 365 days if table empty
     with engine.begin() as conn:
         cnt = conn.execute(text('SELECT COUNT(*) FROM btc_data')).scalar()
     if cnt == 0:
         # fetch 365 days of history
-        url_hist = 'https://api.coingecko.com/api/v3/coins/bitcoin/market_chart?vs_currency=usd&days=365'
-        resp = requests.get(url_hist, timeout=30)
-        hist = resp.json()
-        if 'prices' not in hist:
-            raise HTTPException(502, 'CoinGecko API error for initial load')
+        try:
+            hist = fetch_market_chart(days=365, timeout=30)
+        except UpstreamError as e:
+            raise HTTPException(502, f'CoinGecko API error for initial load: {e}')
         df_hist = pd.DataFrame(hist['prices'], columns=['ts', 'price'])
         df_hist['date'] = pd.to_datetime(df_hist['ts'], unit='ms').dt.strftime('%Y-%m-%d')
         df_hist = df_hist.groupby('date').last().reset_index()
         df_hist['date'] = pd.to_datetime(df_hist['date'])
-        df_feat = make_features(df_hist)
+        with timed('feature_build', rows=len(df_hist)):
+            df_feat = make_features(df_hist)
         df_clean = df_feat.dropna()
-        with engine.begin() as conn:
-            for _, row in df_clean.iterrows():
-                params = row.to_dict()
-                params['date'] = row['date'].strftime('%Y-%m-%d')
-                # só insere se não existe
-                exists = conn.execute(text('SELECT 1 FROM btc_data WHERE date=:date'), {'date': params['date']}).fetchone()
-                if not exists:
-                    conn.execute(text(
-                        'INSERT INTO btc_data (date, price, lag_1, lag_2, lag_3, lag_4, lag_5, lag_6, lag_7, ma_7, ma_14, ret_1d, ret_7d, dow) VALUES (:date, :price, :lag_1, :lag_2, :lag_3, :lag_4, :lag_5, :lag_6, :lag_7, :ma_7, :ma_14, :ret_1d, :ret_7d, :dow)'
-                    ), params)
-        retrain_model()
+        ROWS_INGESTED.inc(bulk_insert_features(df_clean), source='initial')
+        _on_data_changed()
+        training_worker.request('carga inicial', full=True)
         return True
     # incremental insert (existing logic)
-    url = 'https://api.coingecko.com/api/v3/coins/bitcoin/market_chart?vs_currency=usd&days=1'
-    r = requests.get(url, timeout=10)
-    data = r.json()
-    if 'prices' not in data:
-        raise HTTPException(502, 'CoinGecko API error')
+    try:
+        data = fetch_market_chart(days=1, timeout=10)
+    except UpstreamError as e:
+        raise HTTPException(502, f'CoinGecko API error: {e}')
+    if INTRADAY_MODE:
+        # a série de 5 minutos já veio nessa chamada: guarda antes de ficar só com o último preço
+        try:
+            store_intraday(data['prices'])
+        except Exception as e:
+            print(f"Erro ao gravar ticks intraday: {e}")
     ts, price = data['prices'][-1]
     date = datetime.utcfromtimestamp(ts/1000).strftime('%Y-%m-%d')
-    with engine.begin() as conn:
+    # Recupera dias perdidos (job das 00:15 falhou, container parado...) antes de inserir hoje
+    yesterday = datetime.strptime(date, '%Y-%m-%d').date() - timedelta(days=1)
+    try:
+        backfilled = backfill_gaps(yesterday)
+    except UpstreamError as e:
+        print(f"Backfill de lacunas falhou: {e}")
+        backfilled = 0
+    inserted = replaced = False
+    # lê o estado e grava na mesma transação: BEGIN IMMEDIATE evita SQLITE_BUSY no upgrade do lock
+    with timed('db_write', table='btc_data', rows=1), begin_write(engine) as conn:
         exists = conn.execute(text('SELECT 1 FROM btc_data WHERE date=:date'), {'date': date}).fetchone()
-        if exists and not force:
-            return False
-        # Get last 30 days for features
-        df = pd.read_sql('SELECT * FROM btc_data ORDER BY date DESC LIMIT 30', conn)
-        df = df.sort_values('date')
-        new_row = pd.DataFrame({'date': [date], 'price': [price]})
-        df = pd.concat([df, new_row], ignore_index=True)
-        df['date'] = pd.to_datetime(df['date'])
-        df = make_features(df)
-        row = df.iloc[-1]
-        # Insert
-        params = row.to_dict()
-        # convert pandas Timestamp to string for SQLite
-        params['date'] = row['date'].strftime('%Y-%m-%d')
-        conn.execute(text('''INSERT OR REPLACE INTO btc_data (date, price, lag_1, lag_2, lag_3, lag_4, lag_5, lag_6, lag_7, ma_7, ma_14, ret_1d, ret_7d, dow) VALUES (:date, :price, :lag_1, :lag_2, :lag_3, :lag_4, :lag_5, :lag_6, :lag_7, :ma_7, :ma_14, :ret_1d, :ret_7d, :dow)'''), params)
-    retrain_model()
+        if not exists or force:
+            # Features da nova linha em O(1) a partir do estado incremental
+            with timed('feature_build', rows=1):
+                params = push_features(conn, date, price)
+            params['date'] = date
+            conn.execute(text('''INSERT OR REPLACE INTO btc_data (date, price, lag_1, lag_2, lag_3, lag_4, lag_5, lag_6, lag_7, ma_7, ma_14, ret_1d, ret_7d, dow) VALUES (:date, :price, :lag_1, :lag_2, :lag_3, :lag_4, :lag_5, :lag_6, :lag_7, :ma_7, :ma_14, :ret_1d, :ret_7d, :dow)'''), params)
+            inserted = True
+            replaced = exists is not None
+    if inserted:
+        ROWS_INGESTED.inc(source='incremental')
+    if not inserted and not backfilled:
+        return False
+    _on_data_changed(since=None if backfilled else date)
+    # lacunas preenchidas ou um dia regravado (force) mudam linhas já treinadas:
+    # as estatísticas acumuladas não valem mais
+    training_worker.request('novos dados', full=bool(backfilled) or replaced)
     return True
 
-# --- Model Training ---
-def retrain_model():
-    try:
-        # Buscar todos os dados
+def backfill_gaps(until):
+    """Preenche as datas ausentes em btc_data até `until` (inclusive).
+
+    Só as lacunas são buscadas na CoinGecko (agrupadas no menor número de chamadas
+    ao market_chart/range) e só as linhas afetadas têm as features recalculadas:
+    as novas datas e as FEATURE_LOOKBACK linhas seguintes a cada intervalo.
+    Retorna o número de datas preenchidas.
+    """
+    with engine.begin() as conn:
+        gaps = find_gaps(conn, until)
+    if not gaps:
+        return 0
+    ranges = plan_ranges(gaps)
+    wanted = missing_in(gaps)
+    with timed('upstream_fetch_backfill', missing=len(wanted), gaps=len(gaps), calls=len(ranges)):
+        charts = fetch_market_chart_ranges([range_timestamps(start, end) for start, end in ranges], timeout=30)
+    filled = 0
+    for (start, end), chart in zip(ranges, charts):
+        new_prices = daily_last_prices(chart['prices'], wanted)
+        if not new_prices:
+            continue
+        start_s, end_s = start.isoformat(), end.isoformat()
         with engine.begin() as conn:
-            df = pd.read_sql('SELECT * FROM btc_data ORDER BY date', conn)
-        
+            before = conn.execute(text('SELECT date, price FROM btc_data WHERE date < :s ORDER BY date DESC LIMIT :n'),
+                                  {'s': start_s, 'n': FEATURE_LOOKBACK}).fetchall()[::-1]
+            inside = conn.execute(text('SELECT date, price FROM btc_data WHERE date BETWEEN :s AND :e'),
+                                  {'s': start_s, 'e': end_s}).fetchall()
+            after = conn.execute(text('SELECT date, price FROM btc_data WHERE date > :e ORDER BY date LIMIT :n'),
+                                 {'e': end_s, 'n': FEATURE_LOOKBACK}).fetchall()
+        prices = dict(before + inside + after)
+        prices.update({d.isoformat(): p for d, p in new_prices.items()})
+        df = pd.DataFrame(sorted(prices.items()), columns=['date', 'price'])
         df['date'] = pd.to_datetime(df['date'])
-        df = df.dropna()
-        
-        # skip retraining if no valid data rows
-        if df.empty:
-            print("Não há dados suficientes para treinar o modelo")
-            return False
-        
-        # Criar o target (preço 7 dias depois) como no notebook original
-        horizon = 7
-        df_target = df.copy()
-        df_target['target'] = df_target['price'].shift(-horizon)  # Preço 7 dias no futuro
-        
-        # Remover linhas sem target (últimos 7 dias)
-        df_target = df_target.dropna()
-        
-        if df_target.empty:
-            print("Não há dados suficientes para treinar o modelo após criar o target")
+        with timed('feature_build', rows=len(df)):
+            df = make_features(df).dropna()
+        bulk_insert_features(df[df['date'] >= pd.Timestamp(start)], replace=True)
+        ROWS_INGESTED.inc(len(new_prices), source='backfill')
+        filled += len(new_prices)
+    if filled:
+        reset_feature_state()
+        prediction_cache.invalidate()
+    return filled
+
+def _on_data_changed(since=None):
+    """Depois de gravar em btc_data: refaz as barras OHLC a partir de `since` (todas, se None),
+    regrava o snapshot colunar e invalida o cache do /predict."""
+    with timed('rollups', since=since), begin_write(engine) as conn:
+        refresh_rollups(conn, since)
+    try:
+        history_snapshot.refresh(engine)
+    except Exception as e:
+        # o snapshot é só um atalho: treino e exportação caem de volta no SQLite
+        print(f"Erro ao atualizar snapshot: {e}")
+    prediction_cache.invalidate()
+    _push_price(full=since is None)
+    _push_current_prediction()
+
+# --- Push (SSE) ---
+PUSH_PRICE_COLUMNS = ['date', 'price', 'ret_1d', 'ret_7d', 'ma_7', 'ma_14']
+
+def _push(event, data):
+    # o push é um atalho para os dashboards abertos: uma falha aqui não derruba ingestão nem treino
+    try:
+        broadcaster.publish(event, data)
+    except Exception as e:
+        print(f"Erro ao publicar evento {event}: {e}")
+
+def _push_price(full=False):
+    """Última linha de btc_data; `full` avisa que linhas antigas também mudaram (carga inicial, backfill)."""
+    with engine.begin() as conn:
+        row = conn.execute(text(f"SELECT {', '.join(PUSH_PRICE_COLUMNS)} FROM btc_data ORDER BY date DESC LIMIT 1")
+                           ).mappings().fetchone()
+    if row is not None:
+        _push('price', {**row, 'full': full})
+
+last_pushed_prediction = None
+
+def _push_prediction(out):
+    """Publica o pred_7d quando ele muda (o cache do /predict é refeito várias vezes com o mesmo valor)."""
+    global last_pushed_prediction
+    delta = {k: out[k] for k in ('date', 'forecast_date', 'price_now', 'pred_7d')}
+    if delta == last_pushed_prediction:
+        return
+    last_pushed_prediction = delta
+    _push('prediction', delta)
+
+def _push_current_prediction():
+    """Publica a previsão depois de dados ou modelo novos, sem esperar uma requisição.
+
+    Só calcula: gravar em predictions e preencher o cache continua sendo do /predict.
+    """
+    try:
+        model_obj = model_registry.get()
+        if model_obj is None:
+            return
+        with engine.begin() as conn:
+            last_date = conn.execute(text('SELECT MAX(date) FROM btc_data')).scalar()
+        out = None if last_date is None else _current_prediction(model_obj, last_date, retrain=False)
+        if out is not None:
+            _push_prediction(out)
+    except Exception as e:
+        print(f"Erro ao atualizar a previsão do stream: {e}")
+
+# --- Incremental Features ---
+def _feature_state_at(conn, last_date):
+    """Retorna o StreamingFeatures posicionado em `last_date`, recarregando do banco só se preciso."""
+    global feature_state
+    state = feature_state
+    if state is None or state.last_date != last_date:
+        rows = []
+        if last_date is not None:
+            rows = conn.execute(text('SELECT date, price FROM btc_data WHERE date <= :d ORDER BY date DESC LIMIT 30'),
+                                {'d': last_date}).fetchall()
+        rows.reverse()
+        state = StreamingFeatures.from_history([r[0] for r in rows], [r[1] for r in rows])
+        feature_state = state
+    return state
+
+def push_features(conn, date, price):
+    """Calcula as features de um novo preço em `date` e avança o estado incremental."""
+    with feature_state_lock:
+        prev_date = conn.execute(text('SELECT MAX(date) FROM btc_data WHERE date < :d'), {'d': date}).scalar()
+        return dict(_feature_state_at(conn, prev_date).push(date, price))
+
+def current_features(conn, last_date):
+    """Features da linha `last_date` (a mais recente), ou None se não há histórico suficiente."""
+    with feature_state_lock:
+        state = _feature_state_at(conn, last_date)
+        return dict(state.current) if state.ready else None
+
+def reset_feature_state():
+    global feature_state
+    with feature_state_lock:
+        feature_state = None
+
+# --- Model Training ---
+def _on_model_trained(run, pair=None):
+    """Chamado pelo worker de treino: troca o modelo em memória e invalida o cache do /predict."""
+    if run is None:
+        return
+    _model_registry(pair).get()
+    prediction_cache.invalidate()
+    if pair is not None:
+        # o stream e o backtest cobrem só o bitcoin (o dashboard)
+        return
+    _push('metrics', {k: run.get(k) for k in ('model_version', 'mode', 'n_rows', 'last_date', 'mae_train',
+                                               'r2_train', 'fit_seconds')})
+    _push_current_prediction()
+    # mantém o histórico de performance fora da amostra em dia a cada refit completo (no
+    # máximo a cada FULL_REFIT_EVERY ingestões, ou quando linhas antigas mudaram), não a cada
+    # atualização incremental
+    if run.get('mode') == 'full':
+        backtest_jobs.submit('backtest', backtest_and_save, engine, history_snapshot)
+
+# Bitcoin e ASSET_PAIRS treinam no mesmo worker (até um processo por núcleo)
+training_worker = TrainingWorker(DB_PATH, MODEL_PATH, on_done=_on_model_trained,
+                                 debounce_seconds=float(os.environ.get('TRAIN_DEBOUNCE_SECONDS', '2')),
+                                 executor=os.environ.get('TRAIN_EXECUTOR', 'process'),
+                                 snapshot_dir=SNAPSHOT_DIR,
+                                 max_workers=min(1 + len(ASSET_PAIRS), os.cpu_count() or 1))
+
+def _model_registry(pair=None):
+    return model_registry if pair is None else asset_models.registry(pair)
+
+@timed('retrain')
+def retrain_model(include_assets=False):
+    """Treina de forma síncrona no processo atual (bootstrap e fallback do /predict).
+
+    Na ingestão use `training_worker.request()`, que treina em background. Com
+    `include_assets` os modelos de ASSET_PAIRS também são refeitos, um por vez.
+    """
+    try:
+        run = train_and_save(engine, model_registry, full=True, snapshot=history_snapshot)
+        if include_assets:
+            for pair in ASSET_PAIRS:
+                train_and_save(engine, asset_models.registry(pair), full=True, pair=pair)
+        if run is None:
             return False
-        
-        # Mesmas features do notebook
-        FEATURES = [f'lag_{i}' for i in range(1,8)] + ['ma_7','ma_14','ret_1d','ret_7d','dow']
-        
-        # X e y de acordo com o notebook
-        X = df_target[FEATURES].values
-        y = df_target['target'].values  # Target é preço futuro (7 dias), não o preço atual
-        
-        # Mesmo pipeline do notebook
-        model = make_pipeline(StandardScaler(), Ridge(alpha=1.0))
-        model.fit(X, y)
-        
-        # Garantir que o diretório existe
-        os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
-        
-        # Salvar o modelo e informações para predição
-        joblib.dump({'model': model, 'features': FEATURES}, MODEL_PATH)
-        print(f"Modelo treinado e salvo com sucesso em: {MODEL_PATH}")
+        prediction_cache.invalidate()
         return True
     except Exception as e:
         print(f"Erro ao treinar modelo: {e}")
         traceback.print_exc()
         return False
 
+def get_model_run(version=None, pair=None):
+    """Busca as métricas do treino do modelo `version` (ou do último treino, se não houver)."""
+    source, params = model_run_source(pair)
+    with engine.begin() as conn:
+        row = None
+        if version is not None:
+            row = conn.execute(text(f'SELECT * FROM {source} WHERE model_version = :v ORDER BY id DESC LIMIT 1'),
+                               {**params, 'v': version}).mappings().fetchone()
+        if row is None:
+            row = conn.execute(text(f'SELECT * FROM {source} ORDER BY id DESC LIMIT 1'), params).mappings().fetchone()
+        if row is None:
+            return None
+        run = dict(row)
+        if run['mae_train'] is None:
+            # treinos incrementais não recalculam o MAE: usa o do último refit completo
+            run['mae_train'] = conn.execute(text(
+                f'SELECT mae_train FROM {source} WHERE mae_train IS NOT NULL AND id < :id ORDER BY id DESC LIMIT 1'
+            ), {**params, 'id': run['id']}).scalar()
+    return run
+
 # --- Scheduler ---
 
 def scheduled_job():
     try:
-        fetch_and_insert()
+        # mesma fila do /refresh, para que as ingestões nunca se sobreponham
+        ingest_jobs.submit('refresh', _scheduled_ingest)
     except Exception as e:
+        SCHEDULED_JOBS.inc(outcome='submit_failed')
         print('Scheduled job failed:', e)
 
+def _scheduled_ingest():
+    """refresh_all do cron, contando o resultado em bitcoinguru_scheduled_jobs_total e em scheduler_runs."""
+    try:
+        inserted = run_recorded(current_engine, 'daily_ingest', PROCESS_ID, refresh_all, force=False)
+    except LeaseBusy:
+        SCHEDULED_JOBS.inc(outcome='skipped')
+        raise
+    except Exception:
+        SCHEDULED_JOBS.inc(outcome='error')
+        raise
+    SCHEDULED_JOBS.inc(outcome='inserted' if inserted else 'no_change')
+    return inserted
+
+# --- Intraday ---
+def store_intraday(prices):
+    """Grava os pontos do market_chart em btc_ticks e refaz só as barras de 1h/1d dos dias tocados."""
+    with timed('intraday_write', points=len(prices)) as t, begin_write(engine) as conn:
+        t.fields['slots'] = slots = append_ticks(conn, prices)
+    ROWS_INGESTED.inc(slots, source='intraday')
+    return slots
+
+def ingest_intraday(days=1):
+    """Busca as últimas `days` de preços (5 em 5 minutos com days=1) e grava como ticks."""
+    data = fetch_market_chart(days=days, timeout=30)
+    return store_intraday(data['prices'])
+
+def scheduled_intraday():
+    try:
+        # na fila da ingestão: não disputa o lock de escrita com o job diário
+        ingest_jobs.submit('intraday', _scheduled_intraday_run)
+    except Exception as e:
+        print('Scheduled intraday job failed:', e)
+
+def _scheduled_intraday_run():
+    return run_recorded(current_engine, 'intraday_ingest', PROCESS_ID, _locked_intraday)
+
+def _locked_intraday():
+    with ingest_lease.hold(wait=INGEST_LEASE_WAIT_SECONDS) as held:
+        if not held:
+            raise LeaseBusy('Ingestão em andamento em outro processo')
+        return ingest_intraday()
+
+@router.get('/intraday')
+def api_intraday(interval: str = Query('hour', pattern='^(hour|day)$'), days: int = Query(2, ge=1)):
+    """Barras OHLC de 1h ou 1d montadas dos ticks de 5 minutos, com a volatilidade realizada (`rv`)."""
+    if not INTRADAY_MODE:
+        raise HTTPException(404, 'Modo intraday desligado (INTRADAY=1)')
+    with engine.begin() as conn:
+        if interval == 'hour':
+            rows = conn.execute(text('''SELECT * FROM (SELECT * FROM btc_bars_1h ORDER BY ts DESC LIMIT :n)
+                                        ORDER BY ts'''), {'n': days * 24}).mappings().all()
+        else:
+            rows = conn.execute(text('''SELECT * FROM (SELECT * FROM btc_bars_1d ORDER BY date DESC LIMIT :n)
+                                        ORDER BY date'''), {'n': days}).mappings().all()
+        storage = intraday_storage_stats(conn)
+    columns = ['ts' if interval == 'hour' else 'date'] + BAR_COLUMNS
+    return FastJSONResponse(content={**split_payload(rows, columns), 'storage': storage})
+
+# --- Multi-ativo ---
+def refresh_all(force=False):
+    """Ingestão do bitcoin (fetch_and_insert) e, com ASSET_PAIRS, dos demais pares, no mesmo job.
+
+    Roda com o lease de ingestão: com vários workers/réplicas só um processo
+    busca na CoinGecko e retreina por vez.
+    """
+    with ingest_lease.hold(wait=INGEST_LEASE_WAIT_SECONDS) as held:
+        if not held:
+            raise LeaseBusy('Ingestão em andamento em outro processo')
+        try:
+            return fetch_and_insert(force=force)
+        finally:
+            if ASSET_PAIRS:
+                refresh_assets()
+
+@timed('refresh_assets')
+def refresh_assets(pairs=None):
+    """Busca os pares em paralelo (um único orçamento de rate limit) e pede ao worker de treino
+    os modelos dos pares que ganharam linhas ou ainda não têm modelo."""
+    pairs = ASSET_PAIRS if pairs is None else pairs
+    ingested = ingest_assets(engine, pairs)
+    to_train = []
+    for pair in pairs:
+        result = ingested.get(pair_name(pair), {})
+        if result.get('rows') or not os.path.exists(asset_models.registry(pair).path):
+            # um dia regravado com outro preço (o parcial da ingestão anterior) muda linhas já
+            # treinadas: as estatísticas acumuladas não valem mais, como no fetch_and_insert(force=True)
+            training_worker.request('novos dados', full=bool(result.get('replaced')), pair=pair)
+            to_train.append(pair)
+    prediction_cache.invalidate()
+    return {'ingested': ingested, 'training': [pair_name(pair) for pair in to_train]}
+
+def _resolve_pair(asset, quote):
+    """None para o par padrão (tabelas originais), (asset, quote) para um par de ASSET_PAIRS."""
+    pair = (asset or DEFAULT_ASSET, quote or DEFAULT_QUOTE)
+    if pair == DEFAULT_PAIR:
+        return None
+    if pair not in ASSET_PAIRS:
+        raise HTTPException(404, f'Par não configurado: {pair_name(pair)} (ASSETS={",".join(map(pair_name, ASSET_PAIRS))})')
+    return pair
+
+ASSET_QUERY = Query(None, pattern=ASSET_PATTERN, description='Ativo da CoinGecko (padrão: bitcoin)')
+QUOTE_QUERY = Query(None, pattern=ASSET_PATTERN, description='Moeda de cotação (padrão: usd)')
+
+@router.get('/assets')
+def api_assets():
+    """Pares disponíveis, com o período gravado e a versão do modelo de cada um."""
+    with engine.begin() as conn:
+        btc = conn.execute(text('SELECT COUNT(*), MIN(date), MAX(date) FROM btc_data')).one()
+        rows = {(r.asset, r.quote): r for r in conn.execute(text(
+            'SELECT asset, quote, COUNT(*) AS n, MIN(date) AS first_date, MAX(date) AS last_date '
+            'FROM asset_data GROUP BY asset, quote'))}
+    out = [{'asset': DEFAULT_ASSET, 'quote': DEFAULT_QUOTE, 'rows': btc[0], 'first_date': btc[1],
+            'last_date': btc[2], 'model_version': model_registry.version}]
+    for pair in ASSET_PAIRS:
+        r = rows.get(pair)
+        out.append({'asset': pair[0], 'quote': pair[1], 'rows': r.n if r else 0,
+                    'first_date': r.first_date if r else None, 'last_date': r.last_date if r else None,
+                    'model_version': asset_models.registry(pair).version})
+    return JSONResponse(content=out)
+
 # --- API Endpoints ---
 @router.post('/refresh')
 def api_refresh(force: bool = Query(False)):
+    """Enfileira a atualização de dados + retreino e retorna o id do job imediatamente."""
     try:
-        changed = fetch_and_insert(force=force)
-        if not changed:
-            # return explicit empty body for 204 No Content
-            return Response(content="", status_code=204)
-        return JSONResponse(content={'detail': 'Data refreshed and model retrained'})
+        job = ingest_jobs.submit('refresh', refresh_all, force=force)
+        return JSONResponse(status_code=202, content={**job, 'status_url': f"/api/jobs/{job['id']}"})
     except Exception as e:
         tb = traceback.format_exc()
         print('API /refresh failed:', e, tb)
         return JSONResponse(status_code=500, content={'detail': str(e), 'traceback': tb})
 
-@router.get('/predict')
-def api_predict():
+@router.get('/jobs/{job_id}')
+def api_job_status(job_id: str):
+    """Status de um job em background (queued, running, done ou failed)."""
+    job = ingest_jobs.get(job_id) or backtest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, 'Job não encontrado')
+    return JSONResponse(content=job)
+
+@router.get('/stream')
+async def api_stream(last_event_id: Optional[int] = Header(None)):
+    """Server-Sent Events com os deltas: `price` (nova linha de btc_data), `prediction` (pred_7d) e `metrics` (treino).
+
+    Reconectando com Last-Event-ID (o EventSource faz isso sozinho) o cliente
+    recebe os eventos perdidos; `reset` pede para recarregar o dashboard.
+    """
     try:
-        # Verifica se o modelo existe
-        if not os.path.exists(MODEL_PATH):
-            print(f"Modelo não encontrado em {MODEL_PATH}. Tentando criar...")
-            retrain_model()
+        sub, replay = await broadcaster.subscribe(last_event_id)
+    except PushFull as e:
+        raise HTTPException(503, f'Limite de conexões do stream: {e}', headers={'Retry-After': '30'})
+    return StreamingResponse(broadcaster.stream(sub, replay), media_type=EVENT_STREAM_MEDIA_TYPE,
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-        # Buscar dados do banco
-        with engine.begin() as conn:
-            df = pd.read_sql('SELECT * FROM btc_data ORDER BY date DESC LIMIT 30', conn).sort_values('date')
-        if df.empty:
-            raise HTTPException(404, 'No data')
+@router.get('/stream/stats')
+def api_stream_stats():
+    """Clientes conectados e contadores do canal de push."""
+    return JSONResponse(content=broadcaster.stats())
 
-        df['date'] = pd.to_datetime(df['date'])
-        # compute features and drop rows with NaNs
-        df_feat = make_features(df)
-        df_clean = df_feat.dropna()
-        if df_clean.empty:
-            raise HTTPException(404, 'Not enough data to predict')
-            
-        row = df_clean.iloc[-1]
-        
-        # Load model - com tratamento de erro
+@router.get('/scheduler')
+def api_scheduler(job_id: Optional[str] = Query(None), limit: int = Query(50, ge=1, le=1000)):
+    """Líder atual do scheduler, próximas execuções e histórico (duração/resultado) dos jobs agendados."""
+    runs, summary = run_history(engine, job_id, limit)
+    return JSONResponse(content={**scheduler.stats(), 'jobs': scheduler.jobs(), 'summary': summary, 'runs': runs})
+
+FORMAT_PATTERN = '^(json|columnar)$'
+STREAM_FORMAT_PATTERN = '^(json|ndjson|columnar)$'
+
+@router.get('/predict')
+def api_predict(request: Request, format: str = Query('json', pattern=FORMAT_PATTERN),
+                asset: str = ASSET_QUERY, quote: str = QUOTE_QUERY):
+    """Previsão de 7 dias. `format=columnar` (ou o Accept colunar) devolve `{coluna: [valores]}`.
+
+    Com `asset`/`quote` usa o modelo e os dados do par (ver /api/assets).
+    """
+    return cached_response(request, _predict_entry(wants_columnar(request, format), _resolve_pair(asset, quote)))
+
+def _save_prediction(future_date, pred_7d, pair=None):
+    """Grava a previsão de `future_date`, uma vez por dia (predictions ou asset_predictions)."""
+    source, params = prediction_source(pair)
+    with timed('db_write', table='predictions' if pair is None else 'asset_predictions'), \
+            begin_write(engine) as conn:
+        # Verificamos se já fizemos uma previsão hoje
+        # (intervalo em run_ts em vez de date(run_ts): usa o índice (date, run_ts))
+        exists_query = text(f"""
+        SELECT 1 FROM {source}
+        WHERE date = :date
+        AND run_ts >= date('now') AND run_ts < date('now', '+1 day')
+        """)
+        exists = conn.execute(exists_query, {**params, "date": future_date}).fetchone()
+
+        if not exists:
+            # Salvamos a previsão com a data futura (para quando estamos prevendo)
+            if pair is None:
+                conn.execute(text('INSERT INTO predictions (date, pred_7d) VALUES (:date, :pred_7d)'),
+                             {'date': future_date, 'pred_7d': pred_7d})
+            else:
+                conn.execute(text('INSERT INTO asset_predictions (asset, quote, date, pred_7d) '
+                                  'VALUES (:asset, :quote, :date, :pred_7d)'),
+                             {**params, 'date': future_date, 'pred_7d': pred_7d})
+            print(f"Predição realizada com sucesso: {pred_7d} para {future_date}")
+        else:
+            print(f"Já existe uma previsão para {future_date} feita hoje, não inserindo duplicata")
+
+def _prediction_entries(cache_key, out, columnar):
+    """Os dois formatos entram no cache de uma vez (mesma previsão)."""
+    split = prediction_cache.put(cache_key + (False,), split_payload([out], list(out)))
+    cols = prediction_cache.put(cache_key + (True,), columnar_payload([out], list(out)), COLUMNAR_MEDIA_TYPE)
+    return cols if columnar else split
+
+def _predict_entry(columnar=False, pair=None):
+    """Corpo do /predict (do cache quando nada mudou), compartilhado com o /dashboard.
+
+    `pair` (asset, quote) usa o modelo e as linhas do par; None é o bitcoin.
+    """
+    try:
+        # Modelo em memória (só relê o arquivo se ele mudou em disco)
+        registry = _model_registry(pair)
         try:
-            print(f"Tentando carregar o modelo de: {MODEL_PATH}")
-            model_obj = joblib.load(MODEL_PATH)
-            model, FEATURES = model_obj['model'], model_obj['features']
+            model_obj = registry.get()
         except Exception as e:
             print(f"Erro ao carregar modelo: {e}")
-            # Se falhar, tentar treinar novamente
+            model_obj = None
+        if model_obj is None and pair is not None:
+            # o modelo do par sai do worker de treino, nunca de dentro da requisição
+            training_worker.request('modelo ausente', pair=pair)
+            raise HTTPException(503, f'Modelo de {pair_name(pair)} ainda não disponível', headers={'Retry-After': '30'})
+        if model_obj is None and startup.running:
+            # o bootstrap já está buscando dados/treinando: não treinar de novo dentro da requisição
+            raise HTTPException(503, 'Inicializando: modelo ainda não disponível', headers={'Retry-After': '5'})
+        if model_obj is None:
+            print(f"Modelo não disponível em {MODEL_PATH}. Tentando criar...")
             retrain_model()
-            # E tentar carregar novamente
-            model_obj = joblib.load(MODEL_PATH)
-            model, FEATURES = model_obj['model'], model_obj['features']
-        
-        # Usar os dados atuais para prever o preço em 7 dias
-        X = row[FEATURES].values.reshape(1, -1)
-        pred_7d = float(model.predict(X)[0])
-        
-        # Calcular métricas usando dados históricos (com target correto)
-        with engine.begin() as conn:
-            df_train = pd.read_sql('SELECT * FROM btc_data ORDER BY date', conn)
-        
-        df_train['date'] = pd.to_datetime(df_train['date'])
-        df_train = df_train.dropna()
-        
-        # Criar o target para validação (como no treinamento)
-        horizon = 7
-        df_target = df_train.copy()
-        df_target['target'] = df_target['price'].shift(-horizon)
-        df_target = df_target.dropna()  # Remove linhas sem target
-        
-        # X_train e y_train corretos para validação
-        X_train = df_target[FEATURES].values
-        y_train = df_target['target'].values  # Target é o preço 7 dias no futuro
-        y_pred = model.predict(X_train)
-        
-        # Importar aqui para evitar problemas de dependência
-        from sklearn.metrics import mean_absolute_error, r2_score
-        mae = float(mean_absolute_error(y_train, y_pred))
-        r2 = float(r2_score(y_train, y_pred))        # Save prediction
-        # Usamos a data atual como base para evitar duplicação
-        from datetime import datetime, timedelta
-        
-        # Usamos a data atual (hoje) como base
-        today = datetime.now()
-        today_str = today.strftime('%Y-%m-%d')
-        
-        # A data para a qual estamos prevendo (hoje + 7 dias)
-        future_date = (today + timedelta(days=7)).strftime('%Y-%m-%d')
-        
-        with engine.begin() as conn:
-            # Verificamos se já fizemos uma previsão hoje
-            exists_query = text("""
-            SELECT 1 FROM predictions 
-            WHERE date(run_ts) = date('now') 
-            AND date = :date
-            """)
-            exists = conn.execute(exists_query, {"date": future_date}).fetchone()
-            
-            if not exists:
-                # Salvamos a previsão com a data futura (para quando estamos prevendo)
-                conn.execute(text('INSERT INTO predictions (date, pred_7d) VALUES (:date, :pred_7d)'), 
-                            {'date': future_date, 'pred_7d': pred_7d})
-                print(f"Predição realizada com sucesso: {pred_7d} para {future_date}")
-            else:
-                print(f"Já existe uma previsão para {future_date} feita hoje, não inserindo duplicata")
+            model_obj = model_registry.get()
+        if model_obj is None:
+            raise HTTPException(503, 'Modelo indisponível')
+
+        # A resposta só muda com uma nova linha em btc_data, um novo modelo ou um novo dia
+        source, params = price_source(pair)
+        with timed('predict_db_read', log=False), engine.begin() as conn:
+            last_date = conn.execute(text(f'SELECT MAX(date) FROM {source}'), params).scalar()
+        if last_date is None:
+            raise HTTPException(404, 'No data')
+        cache_key = (pair or DEFAULT_PAIR) + (last_date, registry.version, datetime.now().strftime('%Y-%m-%d'))
+        entry = prediction_cache.get(cache_key + (columnar,))
+        if entry is not None:
+            return entry
+
+        out = _current_prediction(model_obj, last_date, pair=pair)
+        if out is None:
+            raise HTTPException(404, 'Not enough data to predict')
+        # Save prediction (uma vez por dia, com a data para a qual estamos prevendo)
+        _save_prediction(out['forecast_date'], out['pred_7d'], pair)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Erro na predição: {e}")
         traceback.print_exc()
-        raise HTTPException(500, f"Erro ao fazer predição: {str(e)}")    # Response
-    out = pd.DataFrame({
-        'date': [row['date'].strftime('%Y-%m-%d')],
-        'forecast_date': [future_date],  # Adicionando a data para a qual estamos prevendo
-        'price_now': [row['price']],
-        'pred_7d': [pred_7d],
-        'mae_train': [mae],
-        'r2_train': [r2]
-    })
-    return JSONResponse(content=out.to_dict(orient='split'))
+        raise HTTPException(500, f"Erro ao fazer predição: {str(e)}")
+    if pair is None:
+        _push_prediction(out)
+    return _prediction_entries(cache_key, out, columnar)
+
+def _current_prediction(model_obj, last_date, retrain=True, pair=None):
+    """Previsão de 7 dias a partir da linha `last_date` (a mais recente), sem gravar nem cachear.
+
+    Retorna None sem histórico suficiente. Com `retrain`, um modelo do bitcoin
+    sem métricas em model_runs é retreinado (caminho do /predict).
+    """
+    model, FEATURES = model_obj['model'], model_obj['features']
+    with engine.begin() as conn:
+        if pair is None:
+            # Features da última linha a partir do estado incremental (sem pandas)
+            row = current_features(conn, last_date)
+        else:
+            # os pares gravam as features junto com o preço em asset_data
+            source, params = price_source(pair)
+            row = conn.execute(text(f'SELECT * FROM {source} WHERE date = :d'),
+                               {**params, 'd': last_date}).mappings().fetchone()
+    if row is None:
+        return None
+
+    # Usar os dados atuais para prever o preço em 7 dias
+    with timed('model_predict', last_date=last_date):
+        X = np.array([[row[f] for f in FEATURES]])
+        pred_7d = float(model.predict(X)[0])
+
+    # Métricas do treino já persistidas em model_runs pelo retrain_model
+    run = get_model_run(_model_registry(pair).version, pair)
+    if run is None and retrain and pair is None:
+        print("Nenhuma métrica de treino registrada para o modelo atual. Retreinando...")
+        retrain_model()
+        model_obj = model_registry.get()
+        model, FEATURES = model_obj['model'], model_obj['features']
+        pred_7d = float(model.predict(np.array([[row[f] for f in FEATURES]]))[0])
+        run = get_model_run(model_registry.version)
+    # A data para a qual estamos prevendo (hoje + 7 dias): a data atual como base evita duplicação
+    future_date = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
+    return {
+        **({} if pair is None else {'asset': pair[0], 'quote': pair[1]}),
+        'date': last_date,
+        'forecast_date': future_date,  # Adicionando a data para a qual estamos prevendo
+        'price_now': row['price'],
+        'pred_7d': pred_7d,
+        'mae_train': run['mae_train'] if run else None,
+        'r2_train': run['r2_train'] if run else None,
+    }
+
+class RequestMetricsMiddleware:
+    """Latência (até o envio dos cabeçalhos) e status de cada requisição, por rota (o template, ex. /api/jobs/{job_id}).
+
+    Middleware ASGI puro: ao contrário do @app.middleware('http'), não repassa
+    o corpo da resposta por uma fila e uma task extras, o que custava caro em
+    cada mensagem das conexões longas do /api/stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        recorded = False
+
+        def record(status):
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            # o router grava a rota no próprio scope
+            route = scope.get('route')
+            endpoint = route.path if route is not None else 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope['method'], endpoint=endpoint)
+            REQUESTS.inc(method=scope['method'], endpoint=endpoint, status=status)
+            startup.first_request(endpoint)
+
+        async def send_with_metrics(message):
+            if message['type'] == 'http.response.start':
+                record(message['status'])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            record(500)
+
+app.add_middleware(RequestMetricsMiddleware)
+
+@router.get('/health/live')
+def api_health_live():
+    """Liveness: o processo responde (não depende do banco nem do bootstrap)."""
+    return JSONResponse(content={'status': 'alive', 'uptime_seconds': round(startup.elapsed(), 3)})
+
+@router.get('/health/ready')
+def api_health_ready():
+    """Readiness: 200 quando há dados em btc_data e um modelo carregável, 503 enquanto não.
+
+    Traz também o andamento do bootstrap e os tempos de inicialização.
+    """
+    with engine.connect() as conn:
+        has_data = conn.execute(text('SELECT 1 FROM btc_data LIMIT 1')).fetchone() is not None
+    try:
+        has_model = model_registry.get() is not None
+    except Exception:
+        has_model = False
+    ready = has_data and has_model
+    return JSONResponse(status_code=200 if ready else 503,
+                        content={'ready': ready, 'data': has_data, 'model': has_model, 'startup': startup.stats()})
+
+@router.get('/metrics')
+def api_metrics():
+    """Métricas no formato de texto do Prometheus (histogramas por etapa e por endpoint, contadores)."""
+    return Response(content=REGISTRY.render(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+@router.get('/model_stats')
+def api_model_stats():
+    """Retorna contadores e latência de carga do modelo em memória."""
+    return JSONResponse(content={**model_registry.stats(), 'training': training_worker.stats(),
+                                 'snapshot': history_snapshot.stats(), 'assets': asset_models.stats()})
+
+@router.post('/backtest')
+def api_backtest(mode: str = Query('expanding', pattern='^(expanding|rolling)$'),
+                 step: int = Query(7, ge=1), train_window: int = Query(365, ge=30), min_train: int = Query(180, ge=30)):
+    """Enfileira um backtest walk-forward (janela crescente ou móvel) e retorna o id do job."""
+    job = backtest_jobs.submit('backtest', backtest_and_save, engine, history_snapshot, mode=mode, step=step,
+                               train_window=train_window, min_train=min_train)
+    return JSONResponse(status_code=202, content={**job, 'status_url': f"/api/jobs/{job['id']}"})
+
+@router.get('/backtest')
+def api_backtest_summary():
+    """Resumo do último backtest walk-forward gravado."""
+    with engine.begin() as conn:
+        row = conn.execute(text('SELECT * FROM backtest_runs ORDER BY id DESC LIMIT 1')).mappings().fetchone()
+    if row is None:
+        raise HTTPException(404, 'Nenhum backtest executado ainda')
+    return JSONResponse(content=dict(row))
+
+def _next_cursor(rows, limit, cursor):
+    """Cabeçalho X-Next-Cursor quando a página veio cheia (pode haver mais linhas)."""
+    if cursor is None or limit == NO_LIMIT or len(rows) != limit:
+        return None
+    return {'X-Next-Cursor': cursor}
+
+HISTORY_COLUMNS = ['id', 'run_ts', 'date', 'pred_7d']
+# Previsão mais recente de cada data, já limitada no SQL. O GROUP BY externo
+# desempata previsões com o mesmo run_ts (colunas "soltas" vêm da linha do MAX(id)).
+HISTORY_SQL = """
+    SELECT MAX(p.id) AS id, p.run_ts, p.date, p.pred_7d
+    FROM {predictions} p
+    JOIN (
+        SELECT date, MAX(run_ts) AS max_ts
+        FROM {predictions}
+        WHERE date < :before
+        GROUP BY date
+        ORDER BY date DESC
+        LIMIT :limit
+    ) latest
+    ON p.date = latest.date AND p.run_ts = latest.max_ts
+    GROUP BY p.date
+    ORDER BY p.date DESC
+"""
+# Cursor "sem limite" para as consultas paginadas de trás para frente
+LAST_CURSOR = '9999-12-31'
+DATE_PATTERN = r'^\d{4}-\d{2}-\d{2}$'
+
+def _history_query(limit, before=LAST_CURSOR, pair=None):
+    source, params = prediction_source(pair)
+    return HISTORY_SQL.format(predictions=source), {**params, 'before': before, 'limit': limit}
+
+def _history_payload(limit, before=LAST_CURSOR, columnar=False, pair=None):
+    sql, params = _history_query(limit, before, pair)
+    rows = [row for chunk in iter_chunks(engine, sql, params) for row in chunk]
+    if not rows:
+        print("Nenhuma data encontrada nas previsões")
+        return ({} if columnar else {"columns": [], "data": []}), rows
+    print(f"Histórico retornado: {len(rows)} previsões para datas únicas")
+    for row in rows:
+        row['date_display'] = row['date']  # Mantém a data original para display
+    build = columnar_payload if columnar else split_payload
+    return build(rows, HISTORY_COLUMNS + ['date_display']), rows
 
 @router.get('/history')
-def api_history(limit: int = Query(10), window_days: int = Query(30)):
+def api_history(request: Request, limit: int = Query(10, ge=1), window_days: int = Query(30),
+                before: str = Query(LAST_CURSOR, pattern=DATE_PATTERN), format: str = Query('json', pattern=STREAM_FORMAT_PATTERN),
+                asset: str = ASSET_QUERY, quote: str = QUOTE_QUERY):
     """
     Retorna o histórico de previsões, selecionando apenas a previsão mais recente para cada data única.
     
     Args:
         limit: Número máximo de previsões para retornar
         window_days: Janela de dias distintos que queremos obter (busca os últimos X dias)
+        before: Cursor da paginação: só datas anteriores a esta (use o `X-Next-Cursor` da página anterior)
+        format: `json` (orient='split'), `columnar` (`{coluna: [valores]}`, também via Accept)
+            ou `ndjson` (uma previsão por linha, em streaming)
+        asset, quote: Par de ASSET_PAIRS (padrão: bitcoin/usd)
     
     Returns:
         JSONResponse com os dados das previsões mais recentes para datas diferentes
     """
+    pair = _resolve_pair(asset, quote)
+    if format == 'ndjson':
+        return ndjson_response(iter_chunks(engine, *_history_query(limit, before, pair)))
     try:
-        with engine.begin() as conn:            # Vamos simplificar a abordagem para evitar problemas com parâmetros            # Consulta para pegar a previsão mais recente para cada data única
-            query = """
-            SELECT p.id, p.run_ts, p.date, p.pred_7d 
-            FROM predictions p
-            JOIN (
-                SELECT date, MAX(run_ts) as max_ts 
-                FROM predictions 
-                GROUP BY date
-                ORDER BY date DESC
-            ) latest
-            ON p.date = latest.date AND p.run_ts = latest.max_ts
-            ORDER BY p.date DESC
-            """
-            
-            # Buscar todas as previsões distintas por data e depois limitar
-            df = pd.read_sql(query, conn)
-            
-            if len(df) == 0:
-                print("Nenhuma data encontrada nas previsões")
-                return JSONResponse(content={"columns": [], "data": []})
-                
-            # Eliminar duplicatas de data e limitar o resultado
-            df = df.drop_duplicates(subset=['date']).head(limit)
-            
-            # Se não temos dados suficientes, não precisamos buscar mais
-            # Isso vai manter a abordagem de 1 previsão por data
-            
-            print(f"Histórico retornado: {len(df)} previsões para {len(df['date'].unique())} datas únicas")
-            
-            # Certifique-se de que as datas estão formatadas corretamente para display
-            if 'date' in df.columns:
-                df['date_display'] = df['date']  # Mantém a data original para display
-            
-            return JSONResponse(content=df.to_dict(orient='split'))
+        columnar = wants_columnar(request, format)
+        payload, rows = _history_payload(limit, before, columnar, pair)
+        return FastJSONResponse(content=payload, media_type=COLUMNAR_MEDIA_TYPE if columnar else None,
+                                headers=_next_cursor(rows, limit, rows[-1]['date']) if rows else None)
     except Exception as e:
         print(f"Erro ao buscar histórico: {e}")
         traceback.print_exc()
         raise HTTPException(500, f"Erro ao buscar histórico: {str(e)}")
 
-@router.get('/prices')
-def api_prices(days: int = Query(30)):
-    """Retorna os preços históricos para os últimos N dias."""
+PRICES_SQL = """
+    SELECT date, price FROM (
+        SELECT date, price FROM {prices}
+        WHERE date < :before AND date BETWEEN :start AND :end
+        ORDER BY date DESC LIMIT :limit
+    ) ORDER BY date
+"""
+INTERVAL_PATTERN = '^(day|week|month)$'
+
+def _window_params(days, start, end, calendar, pair=None):
+    """Parâmetros :start/:end/:limit das consultas de séries.
+
+    Com `start` vale o intervalo [start, end]. Sem ele, os últimos `days` pontos
+    (LIMIT no SQL) ou, com `calendar`, os últimos `days` dias corridos até a
+    última data disponível (usado nas barras agregadas: 5 anos em semanas são
+    ~260 linhas).
+    """
+    end = end or LAST_CURSOR
+    if start:
+        return {'start': start, 'end': end, 'limit': NO_LIMIT}
+    if not calendar:
+        return {'start': '', 'end': end, 'limit': days}
+    source, params = price_source(pair)
     with engine.begin() as conn:
-        df = pd.read_sql(f'SELECT date, price FROM btc_data ORDER BY date DESC LIMIT {days}', conn)
-    df = df.sort_values('date')
-    return JSONResponse(content=df.to_dict(orient='split'))
+        last = conn.execute(text(f'SELECT MAX(date) FROM {source} WHERE date <= :end'), {**params, 'end': end}).scalar()
+    if last is None:
+        return {'start': end, 'end': '', 'limit': NO_LIMIT}
+    start = (datetime.strptime(last, '%Y-%m-%d') - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    return {'start': start, 'end': end, 'limit': NO_LIMIT}
+
+@router.get('/prices')
+def api_prices(request: Request, days: int = Query(30, ge=1), before: str = Query(LAST_CURSOR, pattern=DATE_PATTERN),
+               start: str = Query(None, pattern=DATE_PATTERN), end: str = Query(None, pattern=DATE_PATTERN),
+               interval: str = Query(None, pattern=INTERVAL_PATTERN),
+               format: str = Query('json', pattern=STREAM_FORMAT_PATTERN),
+               asset: str = ASSET_QUERY, quote: str = QUOTE_QUERY):
+    """Retorna os preços históricos para os últimos N dias (antes de `before`, se informado).
+
+    Com `interval` (day, week ou month) devolve barras OHLC agregadas no
+    SQLite (semanas e meses vêm de btc_ohlc, mantida na ingestão). `start` e
+    `end` (YYYY-MM-DD) limitam o período em qualquer modo. `format=columnar`
+    (ou o Accept colunar) devolve `{coluna: [valores]}`. `asset`/`quote` escolhem
+    o par (as barras dos demais pares são agregadas na hora, sem btc_ohlc).
+    """
+    sql, columns, params = _prices_query(days, before, start, end, interval, _resolve_pair(asset, quote))
+    if format == 'ndjson':
+        return ndjson_response(iter_chunks(engine, sql, params))
+    rows = [row for chunk in iter_chunks(engine, sql, params) for row in chunk]
+    headers = _next_cursor(rows, params['limit'], rows[0]['date'] if rows else None) if interval is None else None
+    if wants_columnar(request, format):
+        return FastJSONResponse(content=columnar_payload(rows, columns), media_type=COLUMNAR_MEDIA_TYPE,
+                                headers=headers)
+    return FastJSONResponse(content=split_payload(rows, columns), headers=headers)
+
+def _prices_query(days, before=LAST_CURSOR, start=None, end=None, interval=None, pair=None):
+    source, params = price_source(pair)
+    if interval is None:
+        return (PRICES_SQL.format(prices=source), ['date', 'price'],
+                {**params, **_window_params(days, start, end, False, pair), 'before': before})
+    return (ohlc_query(interval, source=None if pair is None else source), OHLC_COLUMNS,
+            {**params, **_window_params(days, start, end, True, pair)})
+
+def _prices_payload(days, columnar=False, **kwargs):
+    sql, columns, params = _prices_query(days, **kwargs)
+    build = columnar_payload if columnar else split_payload
+    return build([row for chunk in iter_chunks(engine, sql, params) for row in chunk], columns)
+
+# --- Previsão em lote ---
+# Linhas por chamada do /predict/batch (somando linhas, datas e passos dos cenários)
+MAX_BATCH_ROWS = int(os.environ.get('MAX_BATCH_ROWS', '50000'))
+
+class BatchScenario(BaseModel):
+    name: Optional[str] = None
+    # preços dos próximos dias, a partir do dia seguinte à última data de btc_data
+    prices: List[float] = Field(..., min_length=1)
+
+class BatchPredictRequest(BaseModel):
+    rows: List[Dict[str, float]] = []
+    dates: List[str] = []
+    start: Optional[str] = Field(None, pattern=DATE_PATTERN)
+    end: Optional[str] = Field(None, pattern=DATE_PATTERN)
+    scenarios: List[BatchScenario] = []
+    horizons: Optional[List[int]] = None
+
+BATCH_DATES_SQL = f"""
+    SELECT date, price, {', '.join(FEATURES)} FROM btc_data
+    WHERE date IN (SELECT value FROM json_each(:dates)) OR date BETWEEN :start AND :end
+    ORDER BY date
+"""
+
+@router.post('/predict/batch')
+def api_predict_batch(body: BatchPredictRequest, request: Request,
+                      format: str = Query('json', pattern=FORMAT_PATTERN)):
+    """Previsões de várias linhas em vários horizontes (1, 3, 7, 14 e 30 dias) numa chamada.
+
+    As entradas podem ser combinadas:
+    - `rows`: linhas de features prontas (`{feature: valor}` com todas as FEATURES);
+    - `dates` e/ou `start`/`end`: linhas de btc_data;
+    - `scenarios`: caminhos de preço hipotéticos (`prices` dos próximos dias) aplicados
+      sobre o histórico; a previsão é a do último dia de cada caminho.
+
+    Todas as linhas vão numa única matriz e saem num único produto pelos
+    coeficientes dos horizontes (`horizons` escolhe um subconjunto).
+    """
+    n_inputs = len(body.rows) + len(body.dates) + sum(len(s.prices) for s in body.scenarios)
+    if n_inputs > MAX_BATCH_ROWS:
+        raise HTTPException(413, f'Lote com {n_inputs} linhas (máximo {MAX_BATCH_ROWS})')
+    model_obj = model_registry.get()
+    horizon_model = model_obj.get('horizons') if model_obj else None
+    if horizon_model is None:
+        if model_obj is not None and not startup.running:
+            # pickle de antes dos horizontes múltiplos: o próximo refit completo os inclui
+            training_worker.request('horizontes do /predict/batch', full=True)
+        raise HTTPException(503, 'Modelo de múltiplos horizontes ainda não disponível', headers={'Retry-After': '10'})
+    horizons = list(horizon_model.horizons) if body.horizons is None else body.horizons
+    unknown = [h for h in horizons if h not in horizon_model.horizons]
+    if unknown:
+        raise HTTPException(422, f'Horizontes indisponíveis: {unknown} (use {list(horizon_model.horizons)})')
+
+    kinds, keys, dates, vectors = [], [], [], []
+    missing = sorted({f for row in body.rows for f in FEATURES if f not in row})
+    if missing:
+        raise HTTPException(422, f'Features ausentes em rows: {", ".join(missing)}')
+    for i, row in enumerate(body.rows):
+        kinds.append('row')
+        keys.append(str(i))
+        dates.append(None)
+        vectors.append([row[f] for f in FEATURES])
+    prices = [row.get('price') for row in body.rows]
+
+    if body.dates or body.start:
+        with timed('predict_db_read', log=False), engine.begin() as conn:
+            found = conn.execute(text(BATCH_DATES_SQL), {
+                'dates': json.dumps(body.dates), 'start': body.start or '', 'end': (body.end or LAST_CURSOR) if body.start else '',
+            }).fetchall()
+        missing = sorted(set(body.dates) - {r[0] for r in found})
+        if missing:
+            raise HTTPException(404, f'Datas sem dados em btc_data: {", ".join(missing[:10])}'
+                                     + (f' (+{len(missing) - 10})' if len(missing) > 10 else ''))
+        for r in found:
+            kinds.append('date')
+            keys.append(r[0])
+            dates.append(r[0])
+            prices.append(r[1])
+            vectors.append(r[2:])
+
+    if body.scenarios:
+        with engine.begin() as conn:
+            last_date = conn.execute(text('SELECT MAX(date) FROM btc_data')).scalar()
+            with feature_state_lock:
+                base = copy.deepcopy(_feature_state_at(conn, last_date))
+        if last_date is None or not base.ready:
+            raise HTTPException(404, 'Histórico insuficiente para simular cenários')
+        start = datetime.strptime(last_date, '%Y-%m-%d')
+        for i, scenario in enumerate(body.scenarios):
+            state = copy.deepcopy(base)
+            for day, price in enumerate(scenario.prices, start=1):
+                state.push((start + timedelta(days=day)).strftime('%Y-%m-%d'), price)
+            kinds.append('scenario')
+            keys.append(scenario.name or str(i))
+            dates.append(state.last_date)
+            prices.append(state.last_price)
+            vectors.append(state.vector(FEATURES))
+
+    with timed('model_predict_batch', log=False):
+        preds = horizon_model.predict(np.array(vectors, dtype=float).reshape(len(vectors), len(FEATURES)))
+    columns = {'kind': kinds, 'key': keys, 'date': dates, 'price': prices}
+    for h in horizons:
+        # NaN (horizonte sem dados para treinar) vira null no dumps do FastJSONResponse
+        columns[f'pred_{h}d'] = preds[:, horizon_model.horizons.index(h)].tolist()
+    if wants_columnar(request, format):
+        return FastJSONResponse(content=columns, media_type=COLUMNAR_MEDIA_TYPE)
+    return FastJSONResponse(content={'index': list(range(len(kinds))), 'columns': list(columns),
+                                     'data': [list(r) for r in zip(*columns.values())]})
 
 @router.get('/dbdump')
-def dump_db():
-    """Retorna todos os dados da tabela btc_data para debug/checagem."""
-    with engine.begin() as conn:
-        df = pd.read_sql('SELECT * FROM btc_data ORDER BY date', conn)
-    return JSONResponse(content=df.to_dict(orient='records'))
+def dump_db(after: str = Query(''), limit: int = Query(NO_LIMIT, ge=NO_LIMIT),
+            format: str = Query('json', pattern='^(json|ndjson)$')):
+    """Retorna os dados da tabela btc_data para debug/checagem.
+
+    A resposta é gerada em streaming a partir do cursor do banco (memória
+    constante). Para paginar, use `limit` e passe em `after` a última data
+    recebida (ou o cabeçalho `X-Next-Cursor`). `limit=-1` (padrão) devolve tudo.
+    """
+    if limit == 0:
+        raise HTTPException(422, 'limit deve ser -1 (sem limite) ou >= 1')
+    sql = 'SELECT * FROM btc_data WHERE date > :after ORDER BY date LIMIT :limit'
+    params = {'after': after, 'limit': limit}
+    if format == 'ndjson':
+        return ndjson_response(iter_chunks(engine, sql, params))
+    if limit == NO_LIMIT:
+        return json_array_response(iter_chunks(engine, sql, params))
+    rows = [row for chunk in iter_chunks(engine, sql, params) for row in chunk]
+    return FastJSONResponse(content=rows, headers=_next_cursor(rows, limit, rows[-1]['date'] if rows else None))
+
+EXPORT_MEDIA_TYPES = {'arrow': ARROW_MEDIA_TYPE, 'parquet': PARQUET_MEDIA_TYPE}
+
+@router.get('/export/btc_data.{fmt}')
+def api_export(fmt: str, days: int = Query(None, ge=1), columns: str = Query(None)):
+    """Exporta btc_data em Arrow IPC (`.arrow`) ou Parquet (`.parquet`) a partir do snapshot colunar.
+
+    Sem filtros o arquivo do snapshot é enviado direto do disco. Com `days`
+    (últimos N dias) e/ou `columns` (ex.: `date,price`) a fatia é recortada da
+    tabela Arrow aberta com mmap e serializada de uma vez, sem dicts por linha.
+    """
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(404, f'Formato desconhecido: {fmt} (use arrow ou parquet)')
+    if not history_snapshot.has_arrow:
+        raise HTTPException(501, 'Exportação colunar indisponível: pyarrow não instalado')
+    history_snapshot.ensure_current(engine)
+    filename = f'btc_data.{fmt}'
+    if days is None and columns is None:
+        return FileResponse(history_snapshot.path(fmt), media_type=EXPORT_MEDIA_TYPES[fmt], filename=filename)
+    table = history_snapshot.arrow_table()
+    if days is not None:
+        table = table.slice(max(0, table.num_rows - days))
+    if columns:
+        names = [c.strip() for c in columns.split(',') if c.strip()]
+        unknown = [c for c in names if c not in table.column_names]
+        if unknown:
+            raise HTTPException(400, f'Colunas desconhecidas: {", ".join(unknown)}')
+        table = table.select(names)
+    return Response(content=serialize_table(table, fmt).to_pybytes(), media_type=EXPORT_MEDIA_TYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @router.post('/resetdb')
 def reset_db():
@@ -407,11 +1242,16 @@ def reset_db():
     try:
         # Dispose engine to close all connections
         engine.dispose()
-        if os.path.exists(DB_PATH):
-            os.remove(DB_PATH)
+        # em WAL o banco tem também os arquivos -wal e -shm
+        remove_db_files(DB_PATH)
         # Recreate engine after file removal
-        engine = create_engine(f'sqlite:///{DB_PATH}', connect_args={"check_same_thread": False})
+        engine = make_engine(DB_PATH)
         init_db()
+        # o job store antigo foi junto com o arquivo: o scheduler religa e recadastra os jobs
+        scheduler.reset()
+        broadcaster.reset()
+        reset_feature_state()
+        prediction_cache.invalidate()
         fetch_and_insert(force=True)
         return {"detail": "Banco resetado e recarregado com histórico."}
     except Exception as e:
@@ -423,97 +1263,146 @@ def clear_predictions():
     try:
         with engine.begin() as conn:
             conn.execute(text('DELETE FROM predictions'))
+        # a próxima chamada a /predict precisa registrar a previsão de novo
+        prediction_cache.invalidate()
         return {"detail": "Tabela de previsões limpa com sucesso."}
     except Exception as e:
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
+TECHNICAL_COLUMNS = ['ma_7', 'ma_14', 'ret_1d', 'ret_7d']
+# Desvio padrão amostral dos retornos diários dos últimos 7 dias da janela, calculado no SQLite
+VOLATILITY_SQL = """
+    SELECT COUNT(ret_1d) AS n, AVG(ret_1d) AS mean, SUM(ret_1d * ret_1d) AS sumsq FROM (
+        SELECT ret_1d FROM {prices} WHERE date BETWEEN :start AND :end ORDER BY date DESC LIMIT 7
+    )
+"""
+PERFORMANCE_SQL = """
+    SELECT date, mae_30d AS mae, r2_30d AS r2
+    FROM backtest_results
+    WHERE run_id = (SELECT MAX(id) FROM backtest_runs) AND mae_30d IS NOT NULL
+    ORDER BY date DESC
+    LIMIT 14
+"""
+
 @router.get('/technical_data')
-def api_technical_data(days: int = Query(30)):
-    """Retorna dados técnicos para análise: preços, médias móveis, retornos e métricas do modelo."""
+def api_technical_data(days: int = Query(30, ge=1),
+                       start: str = Query(None, pattern=DATE_PATTERN), end: str = Query(None, pattern=DATE_PATTERN),
+                       interval: str = Query(None, pattern=INTERVAL_PATTERN),
+                       asset: str = ASSET_QUERY, quote: str = QUOTE_QUERY):
+    """Retorna dados técnicos para análise: preços, médias móveis, retornos e métricas do modelo.
+
+    Com `interval` (day, week ou month) os pontos são barras OHLC (`prices` é o
+    fechamento; médias e retornos são os do dia de fechamento de cada barra).
+    Para os pares de `asset`/`quote` não há backtest: `performance_history` vem vazio.
+    """
+    pair = _resolve_pair(asset, quote)
     try:
-        with engine.begin() as conn:
-            # Buscar dados com features calculadas
-            df = pd.read_sql(f"""
-                SELECT date, price, ma_7, ma_14, ret_1d, ret_7d 
-                FROM btc_data 
-                ORDER BY date DESC 
-                LIMIT {days}
-            """, conn)
-            
-            if df.empty:
-                return JSONResponse(content={"error": "Nenhum dado encontrado"})
-                
-            # Ordenar por data crescente para os gráficos
-            df = df.sort_values('date')
-            
-            # Calcular métricas de volatilidade
-            volatility_7d = df['ret_1d'].tail(7).std() * 100 if len(df) >= 7 else 0
-              # Buscar histórico de performance do modelo (MAE/R²) das previsões
-            performance_df = pd.read_sql("""
-                SELECT date, run_ts, pred_7d
-                FROM predictions 
-                ORDER BY run_ts DESC 
-                LIMIT 20
-            """, conn)
-              # Gerar dados de performance - sempre criar uma série histórica realística
-            performance_data = []
-            from datetime import datetime, timedelta
-            
-            # Sempre gerar dados dos últimos 14 dias para ter um gráfico visual
-            current_date = datetime.now()
-            
-            # Se há previsões reais, usar algumas métricas baseadas nelas
-            if not performance_df.empty:
-                # Pegar a previsão mais recente para ter uma referência de qualidade
-                latest_pred = performance_df.iloc[0]['pred_7d']
-                # Estimar MAE baseado na magnitude da previsão (tipicamente 2-4% do valor)
-                estimated_mae = latest_pred * 0.035  # 3.5% do valor predito
-                estimated_r2 = 0.91  # R² típico de bons modelos
-            else:
-                # Valores padrão baseados em modelos de preço Bitcoin
-                estimated_mae = 3500.0
-                estimated_r2 = 0.85
-                
-            # Criar série temporal dos últimos 14 dias
-            for i in range(14):
-                date_point = current_date - timedelta(days=13-i)
-                date_str = date_point.strftime('%Y-%m-%d')
-                
-                # Simular evolução realística da performance do modelo
-                # MAE tende a melhorar com mais dados (decresce ligeiramente)
-                mae_variation = np.random.normal(0, estimated_mae * 0.1)  # 10% de variação
-                mae_trend = estimated_mae * (1 + (13-i) * 0.01)  # Melhora 1% por dia
-                current_mae = max(1000, mae_trend + mae_variation)
-                
-                # R² também melhora com tempo, mas com menos variação
-                r2_variation = np.random.normal(0, 0.02)  # 2% de variação
-                r2_trend = estimated_r2 * (1 - (13-i) * 0.005)  # Melhora 0.5% por dia
-                current_r2 = min(0.99, max(0.5, r2_trend + r2_variation))
-                
-                performance_data.append({
-                    'date': date_str,
-                    'mae': round(current_mae, 2),
-                    'r2': round(current_r2, 3)
-                })
-            
-            result = {
-                'dates': df['date'].tolist(),
-                'prices': df['price'].tolist(),
-                'ma_7': df['ma_7'].tolist(),
-                'ma_14': df['ma_14'].tolist(),
-                'ret_1d': df['ret_1d'].tolist(),
-                'ret_7d': df['ret_7d'].tolist(),
-                'volatility_7d': round(volatility_7d, 2),
-                'performance_history': performance_data
-            }
-            
-            return JSONResponse(content=result)
-            
+        return FastJSONResponse(content=_technical_payload(days, start, end, interval, pair))
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-app.include_router(router)
+def _technical_payload(days, start=None, end=None, interval=None, pair=None):
+    source, source_params = price_source(pair)
+    with engine.begin() as conn:
+        if interval is None:
+            params = {**source_params, **_window_params(days, start, end, False, pair)}
+            rows = conn.execute(text(f"""
+                SELECT * FROM (
+                    SELECT date, price AS close, {', '.join(TECHNICAL_COLUMNS)}
+                    FROM {source}
+                    WHERE date BETWEEN :start AND :end
+                    ORDER BY date DESC
+                    LIMIT :limit
+                ) ORDER BY date
+            """), params).mappings().all()
+        else:
+            params = {**source_params, **_window_params(days, start, end, True, pair)}
+            rows = conn.execute(text(ohlc_query(interval, TECHNICAL_COLUMNS, None if pair is None else source)),
+                                params).mappings().all()
+
+        if not rows:
+            return {"error": "Nenhum dado encontrado"}
+
+        # Calcular métricas de volatilidade (só com ao menos 7 pontos na janela, como antes)
+        volatility_7d = 0
+        if interval is not None or len(rows) >= 7:
+            vol_end = rows[-1]['date'] if interval is None else params['end']
+            n, mean, sumsq = conn.execute(text(VOLATILITY_SQL.format(prices=source)),
+                                          {**source_params, 'start': params['start'], 'end': vol_end}).one()
+            if n and n > 1:
+                volatility_7d = math.sqrt(max(0.0, (sumsq - n * mean * mean) / (n - 1))) * 100
+        # Volatilidade realizada a partir dos retornos intraday (barras de 1d de btc_bars_1d)
+        intraday_vol = None
+        if INTRADAY_MODE and pair is None:
+            realized_end = rows[-1]['date'] if interval is None else params['end']
+            intraday_vol = {'realized_volatility_7d': realized_volatility(conn, realized_end)}
+            if interval is None:
+                by_date = daily_realized_vol(conn, rows[0]['date'], rows[-1]['date'])
+                intraday_vol['realized_vol'] = [by_date.get(r['date']) for r in rows]
+        # Histórico de performance fora da amostra (MAE/R² em janela de 30 dias) do último backtest
+        performance_data = [
+            {'date': r.date, 'mae': round(r.mae, 2), 'r2': None if r.r2 is None else round(r.r2, 3)}
+            for r in reversed(conn.execute(text(PERFORMANCE_SQL)).fetchall())
+        ] if pair is None else []
+
+    result = {
+        'dates': [r['date'] for r in rows],
+        'prices': [r['close'] for r in rows],
+        **{col: [r[col] for r in rows] for col in TECHNICAL_COLUMNS},
+        'volatility_7d': round(volatility_7d, 2),
+        'performance_history': performance_data
+    }
+    if interval is not None:
+        result.update({'interval': interval, **{col: [r[col] for r in rows] for col in ('open', 'high', 'low')}})
+    if intraday_vol is not None:
+        result.update(intraday_vol)
+    return result
+
+# Muda quando entra uma previsão nova ou termina um backtest (performance_history)
+DASHBOARD_STATE_SQL = """
+    SELECT (SELECT MAX(date) FROM btc_data), (SELECT MAX(id) FROM predictions), (SELECT MAX(id) FROM backtest_runs)
+"""
 
-# --- Scheduler Start ---
-scheduler.add_job(scheduled_job, 'cron', hour=0, minute=15)
-scheduler.start()
+@router.get('/dashboard')
+def api_dashboard(request: Request, history_limit: int = Query(10, ge=1), days: int = Query(30, ge=1),
+                  format: str = Query('json', pattern=FORMAT_PATTERN)):
+    """Tudo o que a página inicial usa numa única chamada: predict, history, technical_data e prices.
+
+    Uma parte que falhar vem como `{"error": ...}`, sem derrubar as outras. A
+    resposta montada fica em cache (com ETag) até mudar btc_data, o modelo, as
+    previsões ou o último backtest. Com `format=columnar` (ou o Accept
+    colunar) predict, history e prices vêm como `{coluna: [valores]}`.
+    """
+    columnar = wants_columnar(request, format)
+    try:
+        predict = json.loads(_predict_entry(columnar).body)
+    except HTTPException as e:
+        predict = {'error': f'Erro ao acessar API /predict: {e.detail}'}
+    with engine.begin() as conn:
+        state = tuple(conn.execute(text(DASHBOARD_STATE_SQL)).one())
+    # invalidations: toda escrita em btc_data passa por prediction_cache.invalidate()
+    key = (state, prediction_cache.invalidations, model_registry.version,
+           datetime.now().strftime('%Y-%m-%d'), history_limit, days, columnar)
+    entry = dashboard_cache.get(key)
+    if entry is None:
+        parts = {'predict': predict}
+        builders = {
+            'history': lambda: _history_payload(history_limit, columnar=columnar)[0],
+            'technical_data': lambda: _technical_payload(days),
+            'prices': lambda: _prices_payload(days, columnar=columnar),
+        }
+        for name, build in builders.items():
+            try:
+                parts[name] = build()
+            except Exception as e:
+                print(f"Erro ao montar /{name} do dashboard: {e}")
+                traceback.print_exc()
+                parts[name] = {'error': f'Erro ao processar dados de /{name}: {e}'}
+        if any('error' in part for part in parts.values()):
+            # não guarda respostas com erro: a próxima chamada tenta de novo
+            return FastJSONResponse(content=parts)
+        entry = dashboard_cache.put(key, parts, COLUMNAR_MEDIA_TYPE if columnar else 'application/json')
+    return cached_response(request, entry)
+
+app.include_router(router)
+startup.mark('imported')
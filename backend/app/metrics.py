@@ -0,0 +1,192 @@
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# Limites (em segundos) dos buckets: de consultas de 1 ms até fits/backfills de 1 min
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Logs estruturados (uma linha JSON por etapa); STAGE_LOGS=0 desliga
+STAGE_LOGS = os.environ.get('STAGE_LOGS', '1') != '0'
+PROMETHEUS_MEDIA_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _labels_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monotônico com labels, no formato de texto do Prometheus."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[n]) for n in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f'{self.name}{_labels_text(self.labelnames, key)} {_number(value)}'
+
+
+class Histogram:
+    """Histograma cumulativo (buckets `le`, `_sum` e `_count`) com labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> [contagem por bucket (não cumulativa) + overflow, soma]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(str(labels[n]) for n in self.labelnames))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield f'{self.name}_bucket{_labels_text(self.labelnames, key, [("le", le)])} {cumulative}'
+            labels = _labels_text(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_number(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Todas as métricas no formato de exposição em texto do Prometheus."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    'bitcoinguru_stage_seconds',
+    'Duração de cada etapa de ingestão, treino e predição', ['stage'])
+REQUEST_SECONDS = REGISTRY.histogram(
+    'bitcoinguru_request_seconds',
+    'Latência das requisições da API por endpoint (até o envio dos cabeçalhos)', ['method', 'endpoint'])
+REQUESTS = REGISTRY.counter(
+    'bitcoinguru_requests_total',
+    'Requisições da API por endpoint e status HTTP', ['method', 'endpoint', 'status'])
+SCHEDULED_JOBS = REGISTRY.counter(
+    'bitcoinguru_scheduled_jobs_total',
+    'Execuções do job agendado por resultado (inserted, no_change, error, submit_failed, skipped, missed)', ['outcome'])
+ROWS_INGESTED = REGISTRY.counter(
+    'bitcoinguru_rows_ingested_total',
+    'Linhas gravadas por origem (initial, incremental, backfill em btc_data; assets em asset_data)', ['source'])
+
+
+def log_event(event, **fields):
+    """Uma linha JSON no stdout (fácil de filtrar com jq/grep no log do container)."""
+    if not STAGE_LOGS:
+        return
+    record = {'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'), 'event': event, **fields}
+    print(json.dumps(record, default=str), flush=True)
+
+
+class timed:
+    """Mede um bloco ou uma função: observa em STAGE_SECONDS e emite um log estruturado.
+
+        with timed('db_write', rows=n) as t:
+            ...
+            t.fields['inserted'] = inserted   # campos extras para o log
+
+        @timed('retrain')
+        def retrain_model(): ...
+
+    Exceções não são engolidas; a etapa é registrada com status 'error'.
+    Com `log=False` só o histograma é atualizado (etapas de toda requisição).
+    """
+
+    def __init__(self, stage, histogram=None, log=True, **fields):
+        self.stage = stage
+        self.histogram = histogram if histogram is not None else STAGE_SECONDS
+        self.log = log
+        self.fields = fields
+        self.seconds = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        self.histogram.observe(self.seconds, stage=self.stage)
+        if self.log:
+            log_event('stage', stage=self.stage, seconds=round(self.seconds, 6),
+                      status='error' if exc_type is not None else 'ok', **self.fields)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # instância nova por chamada: o decorator pode ser usado por várias threads
+            with timed(self.stage, self.histogram, self.log, **self.fields):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def observe_stages(stages):
+    """Registra aqui as durações medidas em outro processo (ex.: o processo de treino)."""
+    for stage, seconds in stages.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
@@ -0,0 +1,118 @@
+import hashlib
+import io
+import os
+import threading
+import time
+
+import joblib
+
+from metrics import STAGE_SECONDS, log_event
+
+
+class ModelRegistry:
+    """Mantém o bundle {'model', 'features'} carregado em memória.
+
+    O arquivo em disco só é relido quando o mtime/tamanho mudar e o hash do
+    conteúdo for diferente do que já está carregado. A troca do bundle é feita
+    por atribuição de uma única referência, então quem está lendo sempre vê um
+    modelo completo (o antigo ou o novo).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._bundle = None
+        self._stat = None
+        self._digest = None
+        self.load_count = 0
+        self.load_seconds_total = 0.0
+        self.last_load_seconds = None
+        self.last_loaded_at = None
+
+    @staticmethod
+    def _file_stat(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _hash_bytes(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def get(self):
+        """Retorna o bundle atual, recarregando do disco apenas se o arquivo mudou."""
+        stat = self._file_stat(self.path)
+        bundle = self._bundle
+        if stat is None:
+            return bundle
+        if bundle is not None and stat == self._stat:
+            return bundle
+        with self._lock:
+            # outra thread pode ter recarregado enquanto esperávamos o lock
+            if self._bundle is not None and stat == self._stat:
+                return self._bundle
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            digest = self._hash_bytes(data)
+            if self._bundle is not None and digest == self._digest:
+                # só o mtime mudou (ex.: touch), o conteúdo é o mesmo
+                self._stat = stat
+                return self._bundle
+            start = time.perf_counter()
+            new_bundle = joblib.load(io.BytesIO(data))
+            elapsed = time.perf_counter() - start
+            self._bundle = new_bundle
+            self._stat = stat
+            self._digest = digest
+            self.load_count += 1
+            self.load_seconds_total += elapsed
+            self.last_load_seconds = elapsed
+            self.last_loaded_at = time.time()
+            STAGE_SECONDS.observe(elapsed, stage='model_load')
+            log_event('stage', stage='model_load', seconds=round(elapsed, 6), status='ok', load=self.load_count,
+                      path=self.path)
+            return new_bundle
+
+    def save(self, bundle):
+        """Serializa o bundle, grava de forma atômica (tmp + rename) e publica em memória.
+
+        Retorna o hash do conteúdo gravado, usado como versão do modelo.
+        """
+        buf = io.BytesIO()
+        joblib.dump(bundle, buf)
+        data = buf.getvalue()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        digest = self._hash_bytes(data)
+        self.publish(bundle, digest)
+        return digest
+
+    def publish(self, bundle, digest=None):
+        """Troca o bundle em memória sem reler o arquivo que acabou de ser gravado."""
+        with self._lock:
+            self._bundle = bundle
+            self._stat = self._file_stat(self.path)
+            self._digest = digest
+
+    @property
+    def version(self):
+        """Hash do conteúdo do modelo carregado (None se nenhum modelo carregado)."""
+        return self._digest
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'loaded': self._bundle is not None,
+            'version': self._digest,
+            'load_count': self.load_count,
+            'load_seconds_total': round(self.load_seconds_total, 6),
+            'last_load_seconds': None if self.last_load_seconds is None else round(self.last_load_seconds, 6),
+            'last_loaded_at': self.last_loaded_at,
+        }
@@ -0,0 +1,252 @@
+import asyncio
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+from db import begin_write
+from metrics import REGISTRY
+from response_cache import dumps
+
+# Mensagens pendentes por cliente; quem acumula mais que isso é desconectado (ver Broadcaster)
+QUEUE_SIZE = int(os.environ.get('PUSH_QUEUE_SIZE', '64'))
+# Comentário SSE enviado quando não há eventos, para proxies não fecharem a conexão ociosa
+HEARTBEAT_SECONDS = float(os.environ.get('PUSH_HEARTBEAT_SECONDS', '15'))
+# Intervalo da leitura de push_events (eventos gravados por outros processos); os do próprio
+# processo acordam o loop na hora
+POLL_SECONDS = float(os.environ.get('PUSH_POLL_SECONDS', '1'))
+MAX_SUBSCRIBERS = int(os.environ.get('PUSH_MAX_SUBSCRIBERS', '10000'))
+# Eventos guardados para o replay de quem reconecta com Last-Event-ID
+KEEP_EVENTS = int(os.environ.get('PUSH_KEEP_EVENTS', '1000'))
+# Tempo que o EventSource do navegador espera antes de reconectar
+RETRY_MS = 3000
+EVENT_STREAM_MEDIA_TYPE = 'text/event-stream'
+
+PUSH_EVENTS = REGISTRY.counter(
+    'bitcoinguru_push_events_total',
+    'Canal /api/stream: eventos publicados, mensagens entregues e clientes (connected, evicted, rejected)',
+    ['outcome'])
+
+
+class PushFull(Exception):
+    """Limite de clientes conectados (PUSH_MAX_SUBSCRIBERS) atingido."""
+
+
+def init_push_tables(conn):
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS push_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL,
+        event TEXT,
+        data TEXT
+    )'''))
+
+
+def sse_message(event_id, event, data):
+    """Evento SSE já codificado: montado uma vez e compartilhado entre todos os clientes."""
+    prefix = b'' if event_id is None else b'id: %d\n' % event_id
+    return prefix + b'event: ' + event.encode() + b'\ndata: ' + data.encode() + b'\n\n'
+
+
+class Subscriber:
+    __slots__ = ('queue',)
+
+    def __init__(self, size):
+        self.queue = asyncio.Queue(size)
+
+
+class Broadcaster:
+    """Canal de push (Server-Sent Events) de deltas de preço, previsão e métricas.
+
+    `publish()` pode ser chamado de qualquer thread: só enfileira o evento e
+    acorda o loop, sem tocar no banco. Um único loop por processo (`run()`,
+    uma task do event loop) grava os eventos enfileirados em `push_events` numa
+    transação só (numa thread: quem publicou nunca espera o lock de escrita; o
+    id é o id do SSE, o mesmo em todos os processos), lê os eventos novos, codifica cada um uma vez e faz o fan-out com `put_nowait`
+    nas filas dos clientes conectados: clientes ociosos não custam nada além
+    do heartbeat. A escrita no socket fica na task de cada resposta; um
+    cliente lento trava só a própria task, a fila dele enche e ele é
+    desconectado com um evento `reset`. O EventSource reconecta com
+    Last-Event-ID e recebe o que perdeu a partir da tabela (ou `reset`, se os
+    eventos já foram apagados: o cliente deve recarregar o dashboard).
+    """
+
+    def __init__(self, engine_fn, queue_size=QUEUE_SIZE, heartbeat=HEARTBEAT_SECONDS, poll=POLL_SECONDS,
+                 max_subscribers=MAX_SUBSCRIBERS, keep=KEEP_EVENTS):
+        self.engine_fn = engine_fn
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.poll = poll
+        self.max_subscribers = max_subscribers
+        self.keep = keep
+        self.last_id = None
+        self._subscribers = set()
+        self._loop = None
+        self._wake = None
+        self._last_sent = 0.0
+        # eventos publicados e ainda não gravados pelo loop
+        self._pending = []
+        self._pending_lock = threading.Lock()
+
+    # --- publicação (qualquer thread) ---
+    def publish(self, event, data):
+        item = {'ts': time.time(), 'event': event, 'data': dumps(data).decode()}
+        with self._pending_lock:
+            loop = self._loop
+            if loop is not None:
+                self._pending.append(item)
+        if loop is None:
+            # sem o loop (scripts, processo sem servidor): grava na hora
+            self._write([item])
+            return
+        loop.call_soon_threadsafe(self._wake.set)
+
+    def _write(self, items):
+        with begin_write(self.engine_fn()) as conn:
+            conn.execute(text('INSERT INTO push_events (ts, event, data) VALUES (:ts, :event, :data)'), items)
+            last = conn.execute(text('SELECT MAX(id) FROM push_events')).scalar()
+            conn.execute(text('DELETE FROM push_events WHERE id <= :id'), {'id': last - self.keep})
+        PUSH_EVENTS.inc(len(items), outcome='published')
+
+    def _flush(self):
+        with self._pending_lock:
+            items, self._pending = self._pending, []
+        if not items:
+            return
+        try:
+            self._write(items)
+        except Exception:
+            # banco travado: os eventos voltam para a fila (na ordem) e vão no próximo ciclo
+            with self._pending_lock:
+                self._pending[:0] = items
+            raise
+
+    def reset(self):
+        """O banco foi recriado (ids voltam a 1): o loop recomeça do fim da tabela nova."""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(setattr, self, 'last_id', None)
+
+    # --- loop de fan-out (event loop) ---
+    def _fetch(self, after):
+        self._flush()
+        with self.engine_fn().begin() as conn:
+            if after is None:
+                return conn.execute(text('SELECT COALESCE(MAX(id), 0) FROM push_events')).scalar(), []
+            rows = conn.execute(text('SELECT id, event, data FROM push_events WHERE id > :id ORDER BY id'),
+                                {'id': after}).fetchall()
+        return (rows[-1][0] if rows else after), rows
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        with self._pending_lock:
+            self._loop = asyncio.get_running_loop()
+        self._last_sent = time.monotonic()
+        try:
+            await self._serve()
+        finally:
+            # desligando: o que ainda estava na fila é gravado aqui mesmo
+            with self._pending_lock:
+                self._loop = None
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"Erro ao gravar eventos pendentes do push: {e}")
+
+    async def _serve(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                self.last_id, rows = await asyncio.to_thread(self._fetch, self.last_id)
+            except Exception as e:
+                # banco travado/recriado (/resetdb): tenta de novo no próximo ciclo
+                print(f"Erro ao gravar/ler push_events: {e}")
+                continue
+            for event_id, event, data in rows:
+                self._fanout(sse_message(event_id, event, data))
+            if time.monotonic() - self._last_sent >= self.heartbeat:
+                self._fanout(b': ping\n\n')
+
+    def _fanout(self, message):
+        self._last_sent = time.monotonic()
+        delivered = 0
+        for sub in list(self._subscribers):
+            try:
+                sub.queue.put_nowait(message)
+                delivered += 1
+            except asyncio.QueueFull:
+                self._evict(sub)
+        if delivered:
+            PUSH_EVENTS.inc(delivered, outcome='delivered')
+
+    def _evict(self, sub):
+        """Cliente que não acompanha: descarta o que está na fila e manda encerrar com `reset`."""
+        self._subscribers.discard(sub)
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+        PUSH_EVENTS.inc(outcome='evicted')
+
+    # --- clientes ---
+    async def subscribe(self, last_event_id=None):
+        """Registra um cliente; devolve (subscriber, mensagens de replay desde `last_event_id`)."""
+        if len(self._subscribers) >= self.max_subscribers:
+            PUSH_EVENTS.inc(outcome='rejected')
+            raise PushFull(f'{len(self._subscribers)} clientes conectados')
+        if self.last_id is None:
+            # o loop ainda não leu a tabela: começa do fim dela
+            self.last_id, _ = await asyncio.to_thread(self._fetch, None)
+        upto = self.last_id
+        sub = Subscriber(self.queue_size)
+        # registrado antes do replay: o que o loop publicar depois de `upto` já cai na fila
+        self._subscribers.add(sub)
+        PUSH_EVENTS.inc(outcome='connected')
+        replay = [b'retry: %d\n\n' % RETRY_MS]
+        if last_event_id is not None and last_event_id < upto:
+            try:
+                replay += await asyncio.to_thread(self._replay, last_event_id, upto)
+            except BaseException:
+                self._subscribers.discard(sub)
+                raise
+        return sub, replay
+
+    def _replay(self, after, upto):
+        with self.engine_fn().begin() as conn:
+            first = conn.execute(text('SELECT MIN(id) FROM push_events')).scalar()
+            if first is None or first > after + 1:
+                return [sse_message(None, 'reset', '{"reason": "gap"}')]
+            rows = conn.execute(text('SELECT id, event, data FROM push_events WHERE id > :a AND id <= :u ORDER BY id'),
+                                {'a': after, 'u': upto}).fetchall()
+        return [sse_message(*row) for row in rows]
+
+    async def stream(self, sub, replay):
+        """Corpo do StreamingResponse: replay e depois a fila do cliente, até ele sair ou ser desconectado."""
+        try:
+            for message in replay:
+                yield message
+            while True:
+                message = await sub.queue.get()
+                if message is None:
+                    yield sse_message(None, 'reset', '{"reason": "lagged"}')
+                    return
+                yield message
+        finally:
+            self._subscribers.discard(sub)
+
+    def stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'last_event_id': self.last_id,
+            'queue_size': self.queue_size,
+            'max_subscribers': self.max_subscribers,
+            'heartbeat_seconds': self.heartbeat,
+            'poll_seconds': self.poll,
+            'published': PUSH_EVENTS.value(outcome='published'),
+            'delivered': PUSH_EVENTS.value(outcome='delivered'),
+            'evicted': PUSH_EVENTS.value(outcome='evicted'),
+            'rejected': PUSH_EVENTS.value(outcome='rejected'),
+        }
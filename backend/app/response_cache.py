@@ -0,0 +1,122 @@
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # sem orjson cai no json da stdlib (mesmo corpo, só mais lento)
+    orjson = None
+
+# Os dados mudam uma vez por dia: o cliente pode guardar a resposta, mas deve
+# revalidar (If-None-Match) antes de reutilizá-la.
+CACHE_CONTROL = 'public, no-cache'
+
+
+def _json_safe(value):
+    """O que o orjson faz sozinho, para o json da stdlib: NaN/inf viram None e tipos NumPy viram nativos."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: _json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return _json_safe(value.tolist())
+    if isinstance(value, np.generic):
+        return _json_safe(value.item())
+    return value
+
+
+def dumps(content):
+    """Serializa para JSON com orjson (tipos NumPy inclusos; NaN vira null) quando disponível."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+    return JSONResponse(content=_json_safe(content)).body
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serializada por `dumps` (orjson)."""
+
+    def render(self, content):
+        return dumps(content)
+
+
+class CacheEntry:
+    __slots__ = ('body', 'etag', 'media_type')
+
+    def __init__(self, body, etag, media_type='application/json'):
+        self.body = body
+        self.etag = etag
+        self.media_type = media_type
+
+
+class ResponseCache:
+    """Cache pequeno (LRU) de respostas JSON já serializadas, com ETag.
+
+    A chave é montada por quem chama (ex.: última data em btc_data + versão do
+    modelo), e quem altera dados ou modelo chama `invalidate()` explicitamente.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, content, media_type='application/json'):
+        body = dumps(content)
+        entry = CacheEntry(body, '"%s"' % hashlib.sha1(body).hexdigest(), media_type)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    tags = [t.strip() for t in header.split(',')]
+    return etag in tags or f'W/{etag}' in tags
+
+
+def cached_response(request, entry):
+    """Responde 304 se o cliente já tem a versão atual, senão devolve o corpo em cache."""
+    # o formato (split ou colunar) pode depender do Accept
+    headers = {'ETag': entry.etag, 'Cache-Control': CACHE_CONTROL, 'Vary': 'Accept'}
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type=entry.media_type, headers=headers)
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+# Agregações pré-calculadas em btc_ohlc; 'day' sai direto de btc_data
+INTERVALS = ('day', 'week', 'month')
+# Semanas começam na segunda-feira (ISO); meses no dia 1. `{col}` é a coluna (ou parâmetro) com a data
+BUCKET_SQL = {
+    'week': "date({col}, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m-01', {col})",
+}
+OHLC_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'n_days']
+
+
+def init_rollup_tables(conn):
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS btc_ohlc (
+        period TEXT,
+        bucket TEXT,
+        open REAL,
+        high REAL,
+        low REAL,
+        close REAL,
+        n_days INTEGER,
+        first_date TEXT,
+        last_date TEXT,
+        PRIMARY KEY (period, bucket)
+    )'''))
+
+
+def bucket_start(period, day):
+    """Início do período (semana/mês) que contém `day` ('YYYY-MM-DD'), igual ao BUCKET_SQL."""
+    d = datetime.strptime(day[:10], '%Y-%m-%d').date()
+    if period == 'week':
+        d -= timedelta(days=d.weekday())
+    elif period == 'month':
+        d = d.replace(day=1)
+    return d.isoformat()
+
+
+def refresh_rollups(conn, since=None):
+    """Recalcula em btc_ohlc os períodos a partir do que contém `since` (todos, se None).
+
+    Na ingestão diária só a semana e o mês correntes são refeitos. Abertura e
+    fechamento vêm das linhas da primeira e da última data de cada período
+    (busca pela PRIMARY KEY), máxima e mínima do GROUP BY.
+    """
+    for period, bucket in BUCKET_SQL.items():
+        start = bucket_start(period, since) if since else ''
+        conn.execute(text('DELETE FROM btc_ohlc WHERE period = :period AND bucket >= :start'),
+                     {'period': period, 'start': start})
+        conn.execute(text(f'''
+            INSERT INTO btc_ohlc (period, bucket, open, high, low, close, n_days, first_date, last_date)
+            SELECT :period, g.bucket, o.price, g.high, g.low, c.price, g.n_days, g.first_date, g.last_date
+            FROM (
+                SELECT {bucket.format(col='date')} AS bucket, MIN(date) AS first_date, MAX(date) AS last_date,
+                       MAX(price) AS high, MIN(price) AS low, COUNT(*) AS n_days
+                FROM btc_data
+                WHERE date >= :start
+                GROUP BY bucket
+            ) g
+            JOIN btc_data o ON o.date = g.first_date
+            JOIN btc_data c ON c.date = g.last_date
+        '''), {'period': period, 'start': start})
+
+
+def ohlc_query(interval, extra_columns=(), source=None):
+    """SQL das barras OHLC entre :start e :end (as :limit mais recentes), em ordem crescente.
+
+    `extra_columns` são colunas de btc_data tiradas da linha de fechamento de
+    cada barra (ex.: ma_7, ma_14). Com `source` (tabela ou subconsulta com as
+    colunas de btc_data, ver assets.price_source) semanas e meses são agregados
+    na hora, sem btc_ohlc. Nos dois caminhos a barra que contém :end só vai
+    até :end (em btc_ohlc ela está completa, então é agregada na hora).
+    """
+    extra = ''.join(f', c.{col}' for col in extra_columns)
+    if interval == 'day':
+        # um preço por dia: abertura, máxima, mínima e fechamento coincidem
+        inner = f'''SELECT c.date, c.price AS open, c.price AS high, c.price AS low, c.price AS close,
+                           1 AS n_days{extra}
+                    FROM {source or 'btc_data'} c
+                    WHERE c.date BETWEEN :start AND :end
+                    ORDER BY c.date DESC LIMIT :limit'''
+    elif source is not None:
+        inner = f'''SELECT g.bucket AS date, o.price AS open, g.high, g.low, c.price AS close, g.n_days{extra}
+                    FROM (
+                        SELECT {BUCKET_SQL[interval].format(col='date')} AS bucket, MIN(date) AS first_date, MAX(date) AS last_date,
+                               MAX(price) AS high, MIN(price) AS low, COUNT(*) AS n_days
+                        FROM {source}
+                        WHERE date <= :end
+                        GROUP BY bucket
+                    ) g
+                    JOIN {source} o ON o.date = g.first_date
+                    JOIN {source} c ON c.date = g.last_date
+                    WHERE g.last_date >= :start
+                    ORDER BY g.bucket DESC LIMIT :limit'''
+    else:
+        edge = BUCKET_SQL[interval].format(col=':end')
+        # barras completas de btc_ohlc antes da barra de :end + a barra de :end cortada em :end
+        # (no máximo um mês de btc_data, lido pela PRIMARY KEY)
+        inner = f'''SELECT * FROM (
+                        SELECT r.bucket AS date, r.open, r.high, r.low, r.close, r.n_days{extra}
+                        FROM btc_ohlc r JOIN btc_data c ON c.date = r.last_date
+                        WHERE r.period = '{interval}' AND r.last_date >= :start AND r.bucket < {edge}
+                        UNION ALL
+                        SELECT g.bucket, o.price, g.high, g.low, c.price, g.n_days{extra}
+                        FROM (
+                            SELECT {edge} AS bucket, MIN(date) AS first_date, MAX(date) AS last_date,
+                                   MAX(price) AS high, MIN(price) AS low, COUNT(*) AS n_days
+                            FROM btc_data
+                            WHERE date >= {edge} AND date <= :end
+                            GROUP BY bucket
+                        ) g
+                        JOIN btc_data o ON o.date = g.first_date
+                        JOIN btc_data c ON c.date = g.last_date
+                        WHERE g.last_date >= :start
+                    ) ORDER BY date DESC LIMIT :limit'''
+    return f'SELECT * FROM ({inner}) ORDER BY date'
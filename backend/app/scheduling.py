@@ -0,0 +1,310 @@
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import text
+
+from db import begin_write
+from metrics import log_event
+
+# Um lease não renovado nesse tempo (processo morto/travado) pode ser tomado por outro processo
+LEASE_TTL_SECONDS = float(os.environ.get('SCHEDULER_LEASE_TTL_SECONDS', '60'))
+# Execução atrasada (servidor fora do ar, troca de líder) ainda roda se estiver dentro dessa janela
+MISFIRE_GRACE_SECONDS = int(os.environ.get('SCHEDULER_MISFIRE_GRACE_SECONDS', str(12 * 3600)))
+
+
+class LeaseBusy(Exception):
+    """O lease está com outro processo (o trabalho já está sendo feito lá)."""
+
+
+def process_owner():
+    """Identificador deste processo nos leases (host:pid:sufixo aleatório, único mesmo com pid reciclado)."""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+def init_scheduler_tables(conn):
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS scheduler_leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT,
+        acquired_at REAL,
+        renewed_at REAL,
+        expires_at REAL
+    )'''))
+    conn.execute(text('''CREATE TABLE IF NOT EXISTS scheduler_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id TEXT,
+        owner TEXT,
+        started_at REAL,
+        finished_at REAL,
+        duration_seconds REAL,
+        status TEXT,
+        result TEXT,
+        error TEXT
+    )'''))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS idx_scheduler_runs_job ON scheduler_runs (job_id, id)'))
+
+
+class Lease:
+    """Lock entre processos (workers do uvicorn, réplicas no mesmo volume) numa linha do SQLite.
+
+    `acquire()` toma o lease se ele está livre ou expirado e renova se já é
+    nosso, num único UPSERT sob BEGIN IMMEDIATE. Quem morre sem liberar perde
+    o lease depois de `ttl` segundos. `engine_fn` devolve o engine atual (o
+    /resetdb troca o engine do main).
+    """
+
+    def __init__(self, engine_fn, name, owner, ttl=LEASE_TTL_SECONDS):
+        self.engine_fn = engine_fn
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+        # threads do mesmo processo têm o mesmo owner: o lock local é que as serializa no hold()
+        self._local = threading.Lock()
+
+    def acquire(self):
+        now = time.time()
+        with begin_write(self.engine_fn()) as conn:
+            conn.execute(text('''
+                INSERT INTO scheduler_leases (name, owner, acquired_at, renewed_at, expires_at)
+                VALUES (:name, :owner, :now, :now, :expires)
+                ON CONFLICT (name) DO UPDATE SET
+                    acquired_at = CASE WHEN scheduler_leases.owner = excluded.owner
+                                       THEN scheduler_leases.acquired_at ELSE excluded.acquired_at END,
+                    owner = excluded.owner,
+                    renewed_at = excluded.renewed_at,
+                    expires_at = excluded.expires_at
+                WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.expires_at < :now
+            '''), {'name': self.name, 'owner': self.owner, 'now': now, 'expires': now + self.ttl})
+            owner = conn.execute(text('SELECT owner FROM scheduler_leases WHERE name = :name'),
+                                 {'name': self.name}).scalar()
+        return owner == self.owner
+
+    def release(self):
+        with begin_write(self.engine_fn()) as conn:
+            conn.execute(text('DELETE FROM scheduler_leases WHERE name = :name AND owner = :owner'),
+                         {'name': self.name, 'owner': self.owner})
+
+    @contextlib.contextmanager
+    def hold(self, wait=0.0, poll=1.0):
+        """Segura o lease durante o bloco (renovando em background); `yield` diz se conseguiu.
+
+        Espera até `wait` segundos se outra thread ou outro processo estiver com ele.
+        """
+        deadline = time.monotonic() + wait
+        if not self._local.acquire(timeout=wait):
+            yield False
+            return
+        try:
+            held = self.acquire()
+            while not held and time.monotonic() < deadline:
+                time.sleep(poll)
+                held = self.acquire()
+        except Exception:
+            self._local.release()
+            raise
+        if not held:
+            self._local.release()
+            yield False
+            return
+        stop = threading.Event()
+
+        def keepalive():
+            while not stop.wait(self.ttl / 3):
+                try:
+                    self.acquire()
+                except Exception as e:
+                    print(f"Erro ao renovar o lease {self.name}: {e}")
+
+        thread = threading.Thread(target=keepalive, name=f'lease-{self.name}', daemon=True)
+        thread.start()
+        try:
+            yield True
+        finally:
+            stop.set()
+            thread.join()
+            try:
+                self.release()
+            finally:
+                self._local.release()
+
+
+def ensure_job(scheduler, job_id, func, trigger):
+    """Cadastra o job no job store persistente sem perder o próximo horário já gravado.
+
+    `replace_existing` recalcularia o next_run_time a partir de agora e uma
+    execução perdida com o servidor fora do ar sumiria; por isso o job só é
+    substituído quando a função ou o trigger mudaram.
+    """
+    job = scheduler.get_job(job_id)
+    ref = f'{func.__module__}:{func.__qualname__}'
+    if job is not None and job.func_ref == ref and str(job.trigger) == str(trigger):
+        return job
+    return scheduler.add_job(func, trigger, id=job_id, replace_existing=True)
+
+
+class LeaderScheduler:
+    """APScheduler que roda em um único processo: o dono do lease 'scheduler'.
+
+    Todo processo sobe uma thread que tenta pegar (ou renovar) o lease a cada
+    ttl/3; quem consegue liga um BackgroundScheduler com job store no próprio
+    SQLite (`apscheduler_jobs`), coalescing e misfire grace, e desliga se
+    perder o lease. Os demais só atendem a API. Como os próximos horários
+    ficam no banco, um líder novo (ou o mesmo depois de um restart) roda uma
+    vez as execuções atrasadas dentro de MISFIRE_GRACE_SECONDS.
+    """
+
+    def __init__(self, engine_fn, owner, setup_jobs, ttl=LEASE_TTL_SECONDS, misfire_grace=MISFIRE_GRACE_SECONDS,
+                 on_missed=None):
+        self.lease = Lease(engine_fn, 'scheduler', owner, ttl)
+        self.engine_fn = engine_fn
+        self.setup_jobs = setup_jobs
+        self.misfire_grace = misfire_grace
+        self.on_missed = on_missed
+        self.scheduler = None
+        self.leader_since = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def is_leader(self):
+        return self.scheduler is not None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='scheduler-lease', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                held = self.lease.acquire()
+                with self._lock:
+                    if held and self.scheduler is None and not self._stop.is_set():
+                        self._start_scheduler()
+                    elif not held and self.scheduler is not None:
+                        print("Lease do scheduler perdido: parando os jobs neste processo")
+                        self._stop_scheduler()
+                self.last_error = None
+            except Exception as e:
+                # banco travado/indisponível: tenta de novo no próximo ciclo (o lease expira sozinho)
+                self.last_error = str(e)
+                print(f"Erro no lease do scheduler: {e}")
+            if self._stop.wait(self.lease.ttl / 3):
+                return
+
+    def _start_scheduler(self):
+        from apscheduler.events import EVENT_JOB_MISSED
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        scheduler = BackgroundScheduler(
+            jobstores={'default': SQLAlchemyJobStore(engine=self.engine_fn())},
+            job_defaults={'coalesce': True, 'misfire_grace_time': self.misfire_grace, 'max_instances': 1},
+        )
+        if self.on_missed is not None:
+            scheduler.add_listener(lambda event: self.on_missed(event.job_id, event.scheduled_run_time),
+                                   EVENT_JOB_MISSED)
+        # pausado até os jobs serem conferidos: o que estiver atrasado roda no resume
+        scheduler.start(paused=True)
+        try:
+            self.setup_jobs(scheduler)
+        except Exception:
+            scheduler.shutdown(wait=False)
+            raise
+        scheduler.resume()
+        self.scheduler = scheduler
+        self.leader_since = time.time()
+        log_event('scheduler', action='leader', owner=self.lease.owner)
+        print(f"Scheduler ativo neste processo ({self.lease.owner})")
+
+    def _stop_scheduler(self):
+        self.scheduler.shutdown(wait=False)
+        self.scheduler = None
+        self.leader_since = None
+        log_event('scheduler', action='follower', owner=self.lease.owner)
+
+    def reset(self):
+        """Para o APScheduler (ex.: o banco foi recriado); o próximo ciclo religa com o job store novo."""
+        with self._lock:
+            if self.scheduler is not None:
+                self._stop_scheduler()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        with self._lock:
+            if self.scheduler is not None:
+                self._stop_scheduler()
+                self.lease.release()
+
+    def jobs(self):
+        """Próximas execuções, lidas do job store (vale também nos processos que não são líderes)."""
+        with self.engine_fn().begin() as conn:
+            if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'apscheduler_jobs'")).fetchone() is None:
+                return []
+            return [{'id': job_id, 'next_run_time': next_run}
+                    for job_id, next_run in conn.execute(text(
+                        'SELECT id, next_run_time FROM apscheduler_jobs ORDER BY next_run_time'))]
+
+    def stats(self):
+        with self.engine_fn().begin() as conn:
+            lease = conn.execute(text('SELECT * FROM scheduler_leases WHERE name = :name'),
+                                 {'name': self.lease.name}).mappings().fetchone()
+        return {
+            'owner': self.lease.owner,
+            'is_leader': self.is_leader,
+            'leader_since': self.leader_since,
+            'lease': dict(lease) if lease else None,
+            'lease_ttl_seconds': self.lease.ttl,
+            'misfire_grace_seconds': self.misfire_grace,
+            'last_error': self.last_error,
+        }
+
+
+def record_run(engine, job_id, owner, started_at, finished_at, status, result=None, error=None):
+    with begin_write(engine) as conn:
+        conn.execute(text('''INSERT INTO scheduler_runs
+            (job_id, owner, started_at, finished_at, duration_seconds, status, result, error)
+            VALUES (:job_id, :owner, :started_at, :finished_at, :duration, :status, :result, :error)'''), {
+            'job_id': job_id, 'owner': owner, 'started_at': started_at, 'finished_at': finished_at,
+            'duration': None if started_at is None else finished_at - started_at, 'status': status,
+            'result': None if result is None else json.dumps(result, default=str)[:1000], 'error': error,
+        })
+
+
+def run_recorded(engine_fn, job_id, owner, fn, *args, **kwargs):
+    """Executa `fn` gravando início, fim, duração e resultado/erro em scheduler_runs."""
+    started = time.time()
+    try:
+        result = fn(*args, **kwargs)
+    except LeaseBusy as e:
+        record_run(engine_fn(), job_id, owner, started, time.time(), 'skipped', error=str(e))
+        raise
+    except Exception as e:
+        record_run(engine_fn(), job_id, owner, started, time.time(), 'error', error=str(e))
+        raise
+    record_run(engine_fn(), job_id, owner, started, time.time(), 'ok', result=result)
+    return result
+
+
+def run_history(engine, job_id=None, limit=50):
+    """Últimas execuções e, por job, contagem e duração média/máxima das bem-sucedidas."""
+    with engine.begin() as conn:
+        runs = conn.execute(text('''SELECT * FROM scheduler_runs WHERE :job_id IS NULL OR job_id = :job_id
+                                    ORDER BY id DESC LIMIT :limit'''),
+                            {'job_id': job_id, 'limit': limit}).mappings().all()
+        summary = conn.execute(text('''SELECT job_id, COUNT(*) AS runs,
+                                              SUM(status = 'ok') AS ok, SUM(status = 'error') AS errors,
+                                              SUM(status = 'missed') AS missed, SUM(status = 'skipped') AS skipped,
+                                              AVG(CASE WHEN status = 'ok' THEN duration_seconds END) AS avg_seconds,
+                                              MAX(CASE WHEN status = 'ok' THEN duration_seconds END) AS max_seconds,
+                                              MAX(started_at) AS last_started_at
+                                       FROM scheduler_runs GROUP BY job_id''')).mappings().all()
+    return [dict(r) for r in runs], {r['job_id']: dict(r) for r in summary}
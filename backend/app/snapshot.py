@@ -0,0 +1,203 @@
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # sem pyarrow o snapshot continua em NumPy, só a exportação Arrow/Parquet some
+    pa = None
+
+from features import FEATURES
+from metrics import timed
+
+# Colunas numéricas de btc_data, na ordem da tabela
+VALUE_COLUMNS = ['price'] + FEATURES
+# Impressão digital de btc_data guardada no meta.json: um INSERT OR REPLACE (mesmo dia,
+# /refresh?force=true) ganha um rowid novo e um UPDATE muda a soma dos preços, mesmo sem
+# mudar o número de linhas nem a última data
+FINGERPRINT_SQL = 'SELECT COUNT(*), MAX(date), MAX(rowid), TOTAL(price) FROM btc_data'
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.file'
+PARQUET_MEDIA_TYPE = 'application/vnd.apache.parquet'
+
+
+class HistorySnapshot:
+    """Cópia colunar de btc_data em disco, regravada a cada ingestão.
+
+    Cada versão tem:
+    - `<versão>.dates.npy` e `<versão>.values.npy`: datas (datetime64[D]) e a
+      matriz float64 das colunas numéricas, abertas com mmap pelo treino e pelo
+      backtest sem passar pelo SQLite;
+    - `<versão>.arrow` (IPC sem compressão, lido com mmap) e `<versão>.parquet`,
+      servidos direto do disco pelos endpoints de exportação (só com pyarrow).
+
+    O `meta.json` é trocado por último (tmp + rename), então quem lê sempre vê
+    uma versão completa. As duas versões mais recentes ficam em disco para não
+    apagar um arquivo que ainda está sendo enviado.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._meta = None
+        self._meta_mtime = None
+        self.refreshes = 0
+
+    @property
+    def has_arrow(self):
+        return pa is not None
+
+    def _path(self, version, suffix):
+        return os.path.join(self.directory, f'{version}.{suffix}')
+
+    @property
+    def meta(self):
+        path = os.path.join(self.directory, 'meta.json')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._meta_mtime:
+            with open(path) as f:
+                self._meta = json.load(f)
+            self._meta_mtime = mtime
+        return self._meta
+
+    def is_current(self, conn):
+        """O snapshot bate com btc_data (mesma impressão digital: linhas, última data, rowid e soma dos preços)?"""
+        meta = self.meta
+        if meta is None:
+            return False
+        return meta.get('fingerprint') == list(conn.exec_driver_sql(FINGERPRINT_SQL).fetchone())
+
+    def refresh(self, engine):
+        """Regrava o snapshot a partir do SQLite. Retorna o novo meta."""
+        with self._lock, timed('snapshot_refresh') as t:
+            with engine.connect() as conn:
+                # lida antes das linhas: uma escrita no meio deixa o snapshot mais novo que a
+                # impressão digital, e o próximo is_current só manda regravar de novo
+                fingerprint = list(conn.exec_driver_sql(FINGERPRINT_SQL).fetchone())
+                rows = conn.exec_driver_sql(
+                    f"SELECT date, {', '.join(VALUE_COLUMNS)} FROM btc_data ORDER BY date").fetchall()
+            t.fields['rows'] = len(rows)
+            dates = np.array([r[0] for r in rows], dtype='datetime64[D]')
+            # None (coluna vazia) vira NaN, como no read_sql
+            values = np.array([r[1:] for r in rows], dtype=float).reshape(len(rows), len(VALUE_COLUMNS))
+
+            os.makedirs(self.directory, exist_ok=True)
+            version = str(time.time_ns())
+            np.save(self._path(version, 'dates.npy'), dates)
+            # ordem Fortran: cada coluna fica contígua no arquivo
+            np.save(self._path(version, 'values.npy'), np.asfortranarray(values))
+            if pa is not None:
+                table = _to_arrow(dates, values)
+                with pa.OSFile(self._path(version, 'arrow'), 'wb') as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+                pq.write_table(table, self._path(version, 'parquet'), compression='zstd')
+
+            meta = {
+                'version': version,
+                'n_rows': len(rows),
+                'first_date': rows[0][0] if rows else None,
+                'last_date': rows[-1][0] if rows else None,
+                'fingerprint': fingerprint,
+                'columns': ['date'] + VALUE_COLUMNS,
+                'formats': ['npy'] + (['arrow', 'parquet'] if pa is not None else []),
+                'refreshed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            tmp = os.path.join(self.directory, 'meta.json.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp, os.path.join(self.directory, 'meta.json'))
+            self._cleanup(keep=2)
+            self.refreshes += 1
+            return meta
+
+    def _cleanup(self, keep):
+        versions = sorted({os.path.basename(p).split('.', 1)[0]
+                           for p in glob.glob(os.path.join(self.directory, '*.*.npy'))}, key=int)
+        for version in versions[:-keep]:
+            for path in glob.glob(self._path(version, '*')):
+                os.remove(path)
+
+    def ensure_current(self, engine):
+        with engine.connect() as conn:
+            current = self.is_current(conn)
+        return self.meta if current else self.refresh(engine)
+
+    def load(self):
+        """(datas, valores) do snapshot atual com mmap (sem cópia), ou None se não existe."""
+        meta = self.meta
+        if meta is None:
+            return None
+        dates = np.load(self._path(meta['version'], 'dates.npy'), mmap_mode='r')
+        values = np.load(self._path(meta['version'], 'values.npy'), mmap_mode='r')
+        return dates, values
+
+    def frame(self, engine, since=None):
+        """DataFrame no formato do `SELECT * FROM btc_data` (datas > `since`), ou None se desatualizado.
+
+        Confere o snapshot contra o SQLite antes de usar; se não bater, quem
+        chamou deve cair de volta na consulta ao banco.
+        """
+        with engine.connect() as conn:
+            if not self.is_current(conn):
+                return None
+        loaded = self.load()
+        if loaded is None:
+            return None
+        dates, values = loaded
+        start = 0 if since is None else int(np.searchsorted(dates, np.datetime64(since, 'D'), side='right'))
+        df = pd.DataFrame(values[start:], columns=VALUE_COLUMNS, copy=False)
+        df.insert(0, 'date', pd.to_datetime(dates[start:]))
+        return df
+
+    def path(self, fmt):
+        meta = self.meta
+        if meta is None or fmt not in meta['formats']:
+            return None
+        return self._path(meta['version'], fmt)
+
+    def arrow_table(self):
+        """Tabela Arrow do snapshot atual lida com mmap (os buffers apontam para o arquivo)."""
+        path = self.path('arrow')
+        if path is None:
+            return None
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'refreshes': self.refreshes,
+            'pyarrow': self.has_arrow,
+            'meta': self.meta,
+        }
+
+
+def _to_arrow(dates, values):
+    columns = {'date': pa.array(dates, type=pa.date32())}
+    for i, name in enumerate(VALUE_COLUMNS):
+        col = values[:, i]
+        if name == 'dow':
+            columns[name] = pa.array(col, mask=np.isnan(col)).cast(pa.int8())
+        else:
+            columns[name] = pa.array(col)
+    return pa.table(columns)
+
+
+def serialize_table(table, fmt):
+    """Bytes de uma tabela Arrow em IPC (arquivo) ou Parquet, sem passar por objetos Python por linha."""
+    sink = pa.BufferOutputStream()
+    if fmt == 'arrow':
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink, compression='zstd')
+    return sink.getvalue()
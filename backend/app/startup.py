@@ -0,0 +1,98 @@
+import contextlib
+import threading
+import time
+import traceback
+
+from metrics import log_event, timed
+
+
+class StartupTracker:
+    """Progresso da inicialização, exposto em /api/health/* e nos logs.
+
+    Os tempos são contados a partir de `started_at` (perf_counter do início do
+    import do main): até o import terminar, até o lifespan liberar o servidor
+    (`serving`), até a primeira requisição respondida e até o fim do bootstrap,
+    que roda numa thread sem segurar o servidor.
+    """
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.status = 'pending'
+        self.step = None
+        self.steps = []
+        self.error = None
+        self.marks = {}
+        self.first_request_path = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def mark(self, phase, **fields):
+        """Registra (uma vez) o tempo até `phase` e emite um log estruturado."""
+        with self._lock:
+            if phase in self.marks:
+                return False
+            self.marks[phase] = seconds = self.elapsed()
+        log_event('startup', phase=phase, seconds=round(seconds, 6), **fields)
+        return True
+
+    def first_request(self, path):
+        if 'first_request' in self.marks:
+            return
+        if self.mark('first_request', path=path):
+            self.first_request_path = path
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Uma etapa do bootstrap (também vai para bitcoinguru_stage_seconds como bootstrap_<nome>)."""
+        self.step = name
+        status = 'error'
+        t = timed(f'bootstrap_{name}')
+        try:
+            with t:
+                yield
+            status = 'ok'
+        finally:
+            self.steps.append({'name': name, 'seconds': round(t.seconds, 3), 'status': status})
+            self.step = None
+
+    def start(self, func):
+        """Roda `func` (o bootstrap) numa thread daemon e retorna na hora."""
+        self.status = 'running'
+        self._thread = threading.Thread(target=self._run, args=(func,), name='bootstrap', daemon=True)
+        self._thread.start()
+
+    def _run(self, func):
+        try:
+            func()
+            self.status = 'done'
+        except Exception as e:
+            self.status = 'failed'
+            self.error = str(e)
+            print(f"Erro no bootstrap: {e}")
+            traceback.print_exc()
+        self.mark('bootstrap_finished', status=self.status)
+
+    def join(self, timeout=None):
+        """Espera o bootstrap terminar (scripts e benchmarks). Retorna False se estourou o timeout."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    @property
+    def running(self):
+        return self.status == 'running'
+
+    def stats(self):
+        return {
+            'status': self.status,
+            'step': self.step,
+            'steps': list(self.steps),
+            'error': self.error,
+            'uptime_seconds': round(self.elapsed(), 3),
+            'seconds_to': {phase: round(s, 3) for phase, s in self.marks.items()},
+            'first_request_path': self.first_request_path,
+        }
@@ -0,0 +1,73 @@
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+
+from response_cache import dumps
+
+# Linhas buscadas do cursor do SQLite por vez; a memória fica limitada a um lote
+CHUNK_SIZE = 1000
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+# Formato colunar ({coluna: [valores]}), pedido com ?format=columnar ou por este Accept
+COLUMNAR_MEDIA_TYPE = 'application/vnd.bitcoinguru.columnar+json'
+# SQLite aceita LIMIT -1 como "sem limite", então a mesma consulta serve com e sem paginação
+NO_LIMIT = -1
+
+
+def iter_chunks(engine, sql, params=None, chunk_size=CHUNK_SIZE):
+    """Gera lotes de linhas (dicts) puxados do cursor com fetchmany, sem materializar a consulta.
+
+    A conexão fica aberta enquanto o gerador é consumido (o StreamingResponse
+    itera num thread do pool) e é devolvida ao pool no fim ou se o cliente
+    desconectar no meio.
+    """
+    with engine.connect() as conn:
+        result = conn.execute(text(sql), params or {})
+        keys = list(result.keys())
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [dict(zip(keys, row)) for row in rows]
+
+
+def ndjson_lines(chunks):
+    """Um objeto JSON por linha; cada lote vira um único pedaço da resposta."""
+    for chunk in chunks:
+        yield b''.join(dumps(row) + b'\n' for row in chunk)
+
+
+def json_array(chunks):
+    """Array JSON (`[{...}, ...]`) escrito aos poucos, no mesmo formato de orient='records'."""
+    yield b'['
+    first = True
+    for chunk in chunks:
+        # o lote inteiro numa chamada só, sem os colchetes
+        body = dumps(chunk)[1:-1]
+        yield body if first else b',' + body
+        first = False
+    yield b']'
+
+
+def ndjson_response(chunks, headers=None):
+    return StreamingResponse(ndjson_lines(chunks), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+
+def json_array_response(chunks, headers=None):
+    return StreamingResponse(json_array(chunks), media_type='application/json', headers=headers)
+
+
+def wants_columnar(request, format=None):
+    return format == 'columnar' or COLUMNAR_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+def columnar_payload(rows, columns):
+    """`{coluna: [valores]}`: o cliente usa as listas direto, sem transpor linhas."""
+    return {c: [row[c] for row in rows] for c in columns}
+
+
+def split_payload(rows, columns):
+    """Mesmo formato de `DataFrame.to_dict(orient='split')`, montado direto das linhas."""
+    return {
+        'index': list(range(len(rows))),
+        'columns': list(columns),
+        'data': [[row[c] for c in columns] for row in rows],
+    }
@@ -0,0 +1,471 @@
+import copy
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from assets import asset_model_path, pair_name, price_source
+from db import make_engine
+from features import FEATURES
+from metrics import observe_stages, timed
+from model_registry import ModelRegistry
+from snapshot import HistorySnapshot
+
+# Target: preço 7 dias no futuro, como no notebook original
+HORIZON = 7
+# Horizontes do /predict/batch, treinados junto com o modelo principal
+HORIZONS = (1, 3, 7, 14, 30)
+ALPHA = 1.0
+# Depois de N atualizações incrementais faz um refit completo (recalcula o MAE exato)
+FULL_REFIT_EVERY = int(os.environ.get('FULL_REFIT_EVERY', '7'))
+# Colunas lidas para treinar (btc_data e asset_data têm as mesmas, fora asset/quote)
+DATA_COLUMNS = ', '.join(['date', 'price'] + FEATURES)
+
+
+def build_training_set(df, horizon=HORIZON):
+    """Linhas completas de btc_data com a coluna `target` (preço `horizon` dias depois)."""
+    df = df.dropna().copy()
+    df['target'] = df['price'].shift(-horizon)
+    return df.dropna()
+
+
+class RidgeStats:
+    """Estatísticas suficientes para StandardScaler + Ridge, atualizáveis em O(linhas novas).
+
+    Guarda n, a média e a matriz de co-momentos centrados de [X, y]; lotes novos
+    são combinados pela fórmula de Chan et al., numericamente estável mesmo com
+    preços na casa dos 10^5. A partir delas o sistema 12x12 do Ridge é resolvido
+    de novo a cada atualização, com o mesmo resultado de um refit completo.
+    """
+
+    def __init__(self, n_features):
+        self.k = n_features
+        self.n = 0
+        self.mean = np.zeros(n_features + 1)
+        self.M = np.zeros((n_features + 1, n_features + 1))
+        self.first_date = None
+        self.last_date = None
+        self.updates_since_full = 0
+
+    def update(self, X, y):
+        V = np.column_stack([X, y]).astype(float)
+        nb = len(V)
+        if nb == 0:
+            return
+        mean_b = V.mean(axis=0)
+        C = V - mean_b
+        n = self.n + nb
+        delta = mean_b - self.mean
+        self.M += C.T @ C + np.outer(delta, delta) * (self.n * nb / n)
+        self.mean += delta * (nb / n)
+        self.n = n
+
+    def _scaled(self):
+        k = self.k
+        var = np.diag(self.M)[:k] / self.n
+        scale = np.sqrt(var)
+        # mesmo tratamento do StandardScaler para colunas constantes
+        scale[scale < 10 * np.finfo(float).eps] = 1.0
+        Szz = self.M[:k, :k] / np.outer(scale, scale)
+        Szy = self.M[:k, k] / scale
+        return var, scale, Szz, Szy
+
+    def to_pipeline(self, alpha=ALPHA):
+        """Monta um Pipeline(StandardScaler, Ridge) já ajustado, sem passar pelos dados."""
+        from sklearn.linear_model import Ridge
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        k = self.k
+        var, scale, Szz, Szy = self._scaled()
+        coef = np.linalg.solve(Szz + alpha * np.eye(k), Szy)
+        scaler = StandardScaler()
+        scaler.mean_ = self.mean[:k].copy()
+        scaler.var_ = var
+        scaler.scale_ = scale
+        scaler.n_features_in_ = k
+        scaler.n_samples_seen_ = self.n
+        ridge = Ridge(alpha=alpha)
+        ridge.coef_ = coef
+        # X padronizado tem média zero, então o intercepto é a média de y
+        ridge.intercept_ = float(self.mean[k])
+        ridge.n_features_in_ = k
+        return make_pipeline(scaler, ridge)
+
+    def r2(self, model):
+        """R² de treino calculado só com as estatísticas (sem reler os dados)."""
+        _, _, Szz, Szy = self._scaled()
+        w = model[-1].coef_
+        syy = self.M[self.k, self.k]
+        sse = syy - 2 * w @ Szy + w @ Szz @ w
+        return float(1 - sse / syy) if syy > 0 else 0.0
+
+
+class MultiHorizonRidge:
+    """Um Ridge por horizonte (1, 3, 7, 14 e 30 dias), treinados juntos sobre as mesmas features.
+
+    Cada horizonte tem suas RidgeStats (o target de 30 dias só existe até 30
+    dias antes do fim, então as linhas de cada um diferem) e, depois de cada
+    atualização, os pipelines StandardScaler + Ridge são condensados numa
+    única matriz de coeficientes em escala original: prever N linhas em todos
+    os horizontes é um só produto `X @ coef + intercept`, sem sklearn.
+    """
+
+    def __init__(self, horizons=HORIZONS, alpha=ALPHA):
+        self.horizons = tuple(horizons)
+        self.alpha = alpha
+        self.stats = {h: RidgeStats(len(FEATURES)) for h in self.horizons}
+        self.coef = np.full((len(FEATURES), len(self.horizons)), np.nan)
+        self.intercept = np.full(len(self.horizons), np.nan)
+
+    @property
+    def since(self):
+        """Data a partir da qual há linhas novas para algum horizonte (None: nunca treinado)."""
+        dates = [s.last_date for s in self.stats.values()]
+        return None if None in dates else min(dates)
+
+    def update(self, df):
+        """Acumula as linhas de `df` (date, price e FEATURES, em ordem) que ganharam target em cada horizonte."""
+        for h, stats in self.stats.items():
+            rows = df if stats.last_date is None else df[df['date'] > pd.Timestamp(stats.last_date)]
+            df_target = build_training_set(rows, h)
+            if df_target.empty:
+                continue
+            stats.update(df_target[FEATURES].values, df_target['target'].values)
+            if stats.first_date is None:
+                stats.first_date = df_target['date'].iloc[0].strftime('%Y-%m-%d')
+            stats.last_date = df_target['date'].iloc[-1].strftime('%Y-%m-%d')
+        self._solve()
+
+    def _solve(self):
+        k = len(FEATURES)
+        for i, h in enumerate(self.horizons):
+            stats = self.stats[h]
+            if stats.n < 2:
+                continue
+            _, scale, Szz, Szy = stats._scaled()
+            coef = np.linalg.solve(Szz + self.alpha * np.eye(k), Szy)
+            self.coef[:, i] = coef / scale
+            self.intercept[i] = stats.mean[k] - (stats.mean[:k] / scale) @ coef
+
+    def predict(self, X):
+        """Matriz (linhas x horizontes); NaN nos horizontes ainda sem dados para treinar."""
+        return np.asarray(X, dtype=float) @ self.coef + self.intercept
+
+    def info(self):
+        return {f'{h}d': {'n_rows': s.n, 'first_date': s.first_date, 'last_date': s.last_date}
+                for h, s in self.stats.items()}
+
+
+def _fit_full(df_target):
+    # sklearn (com scipy) leva ~1s para importar: só quando for treinar, não no import do main
+    from sklearn.linear_model import Ridge
+    from sklearn.metrics import mean_absolute_error, r2_score
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    X = df_target[FEATURES].values
+    y = df_target['target'].values
+    model = make_pipeline(StandardScaler(), Ridge(alpha=ALPHA))
+    model.fit(X, y)
+    y_pred = model.predict(X)
+    stats = RidgeStats(len(FEATURES))
+    stats.update(X, y)
+    return model, stats, float(mean_absolute_error(y, y_pred)), float(r2_score(y, y_pred))
+
+
+def train_and_save(engine, registry, full=False, snapshot=None, pair=None):
+    """Treina o modelo, grava o pickle e registra o treino em model_runs.
+
+    Se o modelo atual tem estatísticas acumuladas (RidgeStats), só as linhas que
+    ganharam target desde o último treino são lidas e o Ridge é resolvido de novo
+    a partir das estatísticas (custo O(linhas novas)). Com `full=True`, sem
+    estatísticas ou a cada FULL_REFIT_EVERY atualizações é feito um refit completo.
+
+    Com um `snapshot` (HistorySnapshot) em dia, as linhas vêm do arquivo NumPy
+    aberto com mmap em vez de uma consulta ao SQLite.
+
+    Com `pair` (asset, quote) treina o modelo do par, a partir de asset_data,
+    e registra em asset_model_runs; o snapshot só existe para o bitcoin.
+
+    Retorna o dict do treino (versão e métricas) ou None se não houve o que treinar.
+    """
+    source, params = price_source(pair)
+    if pair is not None:
+        snapshot = None
+    stats = horizons = None
+    if not full:
+        bundle = registry.get()
+        stats = bundle.get('stats') if bundle else None
+        if (stats is None or bundle.get('features') != FEATURES or bundle.get('alpha', ALPHA) != ALPHA
+                or stats.updates_since_full >= FULL_REFIT_EVERY or bundle.get('horizons') is None
+                or bundle['horizons'].horizons != HORIZONS):
+            stats = None
+        else:
+            # o bundle em memória pode estar servindo /predict: nunca alterar no lugar
+            stats = copy.deepcopy(stats)
+            horizons = copy.deepcopy(bundle['horizons'])
+
+    # durações por etapa, devolvidas no run (o treino pode rodar em outro processo)
+    stages = {}
+    fit_start = time.perf_counter()
+    if stats is not None:
+        # o horizonte de 30 dias é o que está mais atrás: lê a partir dele
+        since = min(stats.last_date, horizons.since or stats.last_date)
+        with timed('train_db_read', mode='incremental') as t:
+            df = snapshot.frame(engine, since=since) if snapshot is not None else None
+            t.fields['source'] = 'snapshot' if df is not None else 'sqlite'
+            if df is None:
+                with engine.begin() as conn:
+                    df = pd.read_sql(text(f'SELECT {DATA_COLUMNS} FROM {source} WHERE date > :d ORDER BY date'),
+                                     conn, params={**params, 'd': since})
+                df['date'] = pd.to_datetime(df['date'])
+        stages['train_db_read'] = t.seconds
+        with timed('train_horizons', mode='incremental') as t:
+            horizons.update(df)
+        stages['train_horizons'] = t.seconds
+        df_target = build_training_set(df[df['date'] > pd.Timestamp(stats.last_date)])
+        if df_target.empty:
+            print("Nenhuma linha nova com target; modelo mantido")
+            return None
+        with timed('train_fit', mode='incremental', rows=len(df_target)) as t:
+            stats.update(df_target[FEATURES].values, df_target['target'].values)
+            stats.updates_since_full += 1
+            model = stats.to_pipeline(ALPHA)
+            mode = 'incremental'
+            mae, r2 = None, stats.r2(model)
+        stages['train_fit'] = t.seconds
+    else:
+        with timed('train_db_read', mode='full') as t:
+            df = snapshot.frame(engine) if snapshot is not None else None
+            t.fields['source'] = 'snapshot' if df is not None else 'sqlite'
+            if df is None:
+                with engine.begin() as conn:
+                    df = pd.read_sql(text(f'SELECT {DATA_COLUMNS} FROM {source} ORDER BY date'), conn, params=params)
+                df['date'] = pd.to_datetime(df['date'])
+        stages['train_db_read'] = t.seconds
+        df_target = build_training_set(df)
+        if df_target.empty:
+            print("Não há dados suficientes para treinar o modelo")
+            return None
+        with timed('train_fit', mode='full', rows=len(df_target)) as t:
+            model, stats, mae, r2 = _fit_full(df_target)
+        stages['train_fit'] = t.seconds
+        with timed('train_horizons', mode='full') as t:
+            horizons = MultiHorizonRidge()
+            horizons.update(df)
+        stages['train_horizons'] = t.seconds
+        stats.first_date = df_target['date'].iloc[0].strftime('%Y-%m-%d')
+        mode = 'full'
+    fit_seconds = time.perf_counter() - fit_start
+    stats.last_date = df_target['date'].iloc[-1].strftime('%Y-%m-%d')
+
+    run = {
+        **({} if pair is None else {'asset': pair[0], 'quote': pair[1]}),
+        'mode': mode,
+        'n_rows': stats.n,
+        'first_date': stats.first_date,
+        'last_date': stats.last_date,
+        'horizon': HORIZON,
+        'alpha': ALPHA,
+        # MAE não sai das estatísticas suficientes: só é recalculado nos refits completos
+        'mae_train': mae,
+        'r2_train': r2,
+        'fit_seconds': fit_seconds,
+    }
+
+    # Escrita atômica (tmp + rename): quem estiver lendo o pickle nunca vê um arquivo pela metade.
+    # As estatísticas vão junto no pickle para o próximo treino incremental.
+    with timed('model_save') as t:
+        run['model_version'] = registry.save({'model': model, 'features': FEATURES, 'alpha': ALPHA, 'stats': stats,
+                                              'horizons': horizons})
+    stages['model_save'] = t.seconds
+
+    with timed('train_db_write') as t:
+        with engine.begin() as conn:
+            if pair is None:
+                conn.execute(text('''INSERT INTO model_runs
+                    (model_version, mode, n_rows, first_date, last_date, horizon, alpha, mae_train, r2_train, fit_seconds)
+                    VALUES (:model_version, :mode, :n_rows, :first_date, :last_date, :horizon, :alpha, :mae_train, :r2_train, :fit_seconds)'''),
+                    run)
+            else:
+                conn.execute(text('''INSERT INTO asset_model_runs
+                    (asset, quote, model_version, mode, n_rows, first_date, last_date, horizon, alpha, mae_train, r2_train, fit_seconds)
+                    VALUES (:asset, :quote, :model_version, :mode, :n_rows, :first_date, :last_date, :horizon, :alpha,
+                            :mae_train, :r2_train, :fit_seconds)'''),
+                    run)
+    stages['train_db_write'] = t.seconds
+    run['stages'] = stages
+    label = '' if pair is None else f' de {pair_name(pair)}'
+    print(f"Modelo{label} treinado e salvo com sucesso em: {registry.path}")
+    return run
+
+
+def train_in_subprocess(db_path, model_path, full=False, snapshot_dir=None, pair=None):
+    """Ponto de entrada do processo de treino: abre conexões próprias e não importa o main."""
+    engine = make_engine(db_path, pool_size=1)
+    snapshot = HistorySnapshot(snapshot_dir) if snapshot_dir and pair is None else None
+    try:
+        return train_and_save(engine, ModelRegistry(model_path), full=full, snapshot=snapshot, pair=pair)
+    finally:
+        engine.dispose()
+
+
+class TrainingWorker:
+    """Executa os retreinos fora do caminho das requisições.
+
+    `request()` só marca que há dados novos e retorna na hora. Uma thread
+    espera `debounce_seconds` sem novos pedidos e então roda um único treino
+    num processo separado (o fit do sklearn não disputa o GIL com a API). Ao
+    terminar, `on_done(run, pair)` é chamado no processo servidor para fazer o
+    hot-swap do modelo.
+
+    Os pedidos são por par (None é o bitcoin): os pares pendentes ao fim do
+    debounce treinam juntos, até `max_workers` em paralelo no mesmo pool.
+    """
+
+    def __init__(self, db_path, model_path, on_done=None, debounce_seconds=2.0, executor='process',
+                 snapshot_dir=None, max_workers=1):
+        self.db_path = db_path
+        self.model_path = model_path
+        self.model_dir = os.path.dirname(model_path)
+        self.snapshot_dir = snapshot_dir
+        self.on_done = on_done
+        self.debounce_seconds = debounce_seconds
+        self.executor_kind = executor
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._cond = threading.Condition()
+        # par -> refit completo pedido
+        self._pending = {}
+        self._deadline = 0.0
+        self._thread = None
+        self.requests = 0
+        self.runs = 0
+        self.failures = 0
+        self.running = False
+        self.last_run = None
+        self.last_asset_runs = {}
+        self.last_duration_seconds = None
+        self.last_error = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.executor_kind == 'process':
+                # spawn: o processo de treino não herda threads/locks do servidor
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='train')
+        return self._executor
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name='training-worker', daemon=True)
+            self._thread.start()
+
+    def request(self, reason='', full=False, pair=None):
+        """Agenda um retreino do modelo de `pair` (pedidos próximos viram um só; `full` força refit completo)."""
+        with self._cond:
+            self.requests += 1
+            self._pending[pair] = self._pending.get(pair, False) or full
+            self._deadline = time.monotonic() + self.debounce_seconds
+            self._ensure_thread()
+            self._cond.notify_all()
+        if reason:
+            label = '' if pair is None else f' de {pair_name(pair)}'
+            print(f"Retreino{label} agendado ({reason})")
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # debounce: espera até passar a janela sem novos pedidos
+                while True:
+                    remaining = self._deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                pending, self._pending = self._pending, {}
+                self.running = True
+            start = time.perf_counter()
+            try:
+                futures = [(pair, self._submit(pair, full)) for pair, full in pending.items()]
+                for pair, future in futures:
+                    self._finish(pair, future)
+            finally:
+                self.last_duration_seconds = time.perf_counter() - start
+                observe_stages({'train_total': self.last_duration_seconds})
+                with self._cond:
+                    self.running = False
+                    self._cond.notify_all()
+
+    def _submit(self, pair, full):
+        model_path = self.model_path if pair is None else asset_model_path(self.model_dir, pair)
+        try:
+            return self._get_executor().submit(train_in_subprocess, self.db_path, model_path, full,
+                                               self.snapshot_dir, pair)
+        except Exception as e:
+            # pool quebrado por um treino anterior: o erro aparece no result() em _finish
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    def _finish(self, pair, future):
+        try:
+            run = future.result()
+            if self.executor_kind == 'process' and run is not None:
+                # as métricas do processo de treino não chegam ao registro do servidor
+                observe_stages(run['stages'])
+            self.runs += 1
+            if pair is None:
+                self.last_run = run
+            else:
+                self.last_asset_runs[pair_name(pair)] = run
+            self.last_error = None
+            if self.on_done is not None:
+                self.on_done(run, pair)
+        except BrokenProcessPool as e:
+            self._executor = None
+            self.failures += 1
+            self.last_error = str(e)
+            print(f"Processo de treino caiu: {e}")
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            print(f"Erro ao treinar modelo: {e}")
+            traceback.print_exc()
+
+    def wait_idle(self, timeout=None):
+        """Bloqueia até não haver treino pendente nem em execução (útil em scripts e benchmarks)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self.running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.5)
+        return True
+
+    def stats(self):
+        return {
+            'executor': self.executor_kind,
+            'pid': os.getpid(),
+            'requests': self.requests,
+            'runs': self.runs,
+            'failures': self.failures,
+            'pending': bool(self._pending),
+            'running': self.running,
+            'last_duration_seconds': None if self.last_duration_seconds is None else round(self.last_duration_seconds, 3),
+            'last_error': self.last_error,
+            'last_run': self.last_run,
+            'last_asset_runs': self.last_asset_runs,
+        }
@@ -0,0 +1,97 @@
+"""Benchmark do walk-forward (backtest.run_backtest): refits no próprio processo contra o pool de processos.
+
+Uso (a partir da raiz do repositório):
+
+    python backend/bench/bench_backtest.py --years 1 5 20 --steps 7 1 --workers 2 4
+
+Para cada tamanho de histórico e `step` são medidos:
+
+- `serial`: todos os folds em `_fit_predict_chunk` no processo atual (ms por fold);
+- `pool_N`: os mesmos folds em N processos (spawn), como o run_backtest faz acima
+  de BACKTEST_FOLDS_PER_WORKER folds por processo;
+- `pool_startup`: subir N processos e rodar um lote de um fold só, o custo fixo
+  que o pool precisa compensar.
+
+`break_even_folds` é quantos folds o processo atual refaz no tempo de subir o
+pool (`pool_startup / ms por fold`): abaixo disso por processo o pool é mais lento.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+sys.path.insert(0, APP_DIR)
+
+from backtest import FOLDS_PER_WORKER, _fit_predict_chunk, plan_folds, run_backtest  # noqa: E402
+from bench_predict import synthetic_prices  # noqa: E402
+from features import FEATURES, make_features  # noqa: E402
+from training import ALPHA, build_training_set  # noqa: E402
+
+
+def pool_startup(workers, X, y, fold):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        list(pool.map(_fit_predict_chunk, [X] * workers, [y] * workers, [[fold]] * workers, [ALPHA] * workers))
+    return time.perf_counter() - start
+
+
+def run(args):
+    results = []
+    for years in args.years:
+        df = make_features(synthetic_prices(int(years * 365) + 30)).dropna().reset_index(drop=True)
+        data = build_training_set(df)
+        X = data[FEATURES].to_numpy(dtype=float)
+        y = data['target'].to_numpy(dtype=float)
+        # aquece imports (sklearn) fora das medições
+        _fit_predict_chunk(X, y, plan_folds(len(data))[:1], ALPHA)
+        for step in args.steps:
+            n_folds = len(plan_folds(len(data), step=step))
+            if not n_folds:
+                continue
+            start = time.perf_counter()
+            run_backtest(df, step=step, workers=1)
+            serial = time.perf_counter() - start
+            row = {'years': years, 'step': step, 'folds': n_folds, 'serial_s': serial,
+                   'ms_per_fold': serial / n_folds * 1000}
+            for workers in args.workers:
+                start = time.perf_counter()
+                run_backtest(df, step=step, workers=workers)
+                row[f'pool_{workers}_s'] = time.perf_counter() - start
+            results.append(row)
+    startup = {}
+    fold = plan_folds(len(data))[0]
+    for workers in args.workers:
+        startup[workers] = min(pool_startup(workers, X, y, fold) for _ in range(args.repeat))
+    ms_per_fold = float(np.median([r['ms_per_fold'] for r in results]))
+    return {
+        'cpu_count': os.cpu_count(),
+        'folds_per_worker': FOLDS_PER_WORKER,
+        'runs': results,
+        'pool_startup_s': startup,
+        'break_even_folds': {w: int(s * 1000 / ms_per_fold) for w, s in startup.items()},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=float, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--steps', type=int, nargs='+', default=[7, 1])
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--repeat', type=int, default=3, help='medições do pool_startup (vale a menor)')
+    parser.add_argument('--json', help='grava os resultados neste arquivo')
+    args = parser.parse_args()
+    out = run(args)
+    print(f"cpu_count={out['cpu_count']}  BACKTEST_FOLDS_PER_WORKER={out['folds_per_worker']}")
+    for row in out['runs']:
+        print('  '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}' for k, v in row.items()))
+    for workers, seconds in out['pool_startup_s'].items():
+        print(f"pool_startup workers={workers}: {seconds:.3f}s  break_even_folds={out['break_even_folds'][workers]}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(out, f, indent=2)
@@ -0,0 +1,102 @@
+"""Benchmark de vazão (linhas/s) do POST /api/predict/batch contra o caminho de uma linha por vez.
+
+Uso (a partir da raiz do repositório):
+
+    python backend/bench/bench_batch_predict.py --years 5 --rows 100 1000 10000
+
+Para cada tamanho de lote são medidos:
+
+- `single_row_loop`: `model.predict(x.reshape(1, -1))` do pipeline sklearn, uma
+  linha por chamada (como o /predict monta a entrada), só no horizonte de 7 dias;
+- `batch_matrix`: `MultiHorizonRidge.predict` com todas as linhas de uma vez,
+  nos cinco horizontes;
+- `http_single_loop`: um POST /api/predict/batch por data (limitado a
+  `--http-loop-max` chamadas, a vazão é extrapolada);
+- `http_batch`: um único POST /api/predict/batch com todas as datas.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+TMP_DIR = tempfile.mkdtemp(prefix='btc-bench-batch-')
+os.environ.setdefault('DB_PATH', os.path.join(TMP_DIR, 'db.sqlite'))
+os.environ.setdefault('MODEL_PATH', os.path.join(TMP_DIR, 'models', 'btc_linreg.pkl'))
+os.environ.setdefault('SNAPSHOT_DIR', os.path.join(TMP_DIR, 'snapshot'))
+os.environ.setdefault('TRAIN_EXECUTOR', 'thread')
+os.environ.setdefault('TRAIN_DEBOUNCE_SECONDS', '86400')
+os.environ.setdefault('STAGE_LOGS', '0')
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+import main  # noqa: E402
+from bench_predict import synthetic_prices  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+def best_of(func, repeat):
+    """Menor tempo de `repeat` execuções (em segundos)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(years, sizes, repeat, http_loop_max):
+    main.init_db()
+    df = main.make_features(synthetic_prices(365 * years)).dropna()
+    main.bulk_insert_features(df)
+    main.retrain_model()
+    bundle = main.model_registry.get()
+    model, horizons = bundle['model'], bundle['horizons']
+    client = TestClient(main.app)
+    all_dates = df['date'].dt.strftime('%Y-%m-%d').tolist()
+    results = []
+    for n in sizes:
+        # lotes maiores que o histórico repetem as linhas
+        idx = np.arange(n) % len(df)
+        X = df[main.FEATURES].values[idx]
+        dates = [all_dates[i] for i in idx]
+
+        def single_row_loop():
+            for x in X:
+                model.predict(x.reshape(1, -1))
+
+        def http_single_loop():
+            for d in dates[:http_loop_max]:
+                client.post('/api/predict/batch', json={'dates': [d], 'horizons': [7]}).raise_for_status()
+
+        def http_batch():
+            client.post('/api/predict/batch', json={'dates': dates}).raise_for_status()
+
+        n_loop = min(n, http_loop_max)
+        cases = {
+            'single_row_loop': (best_of(single_row_loop, repeat), n),
+            'batch_matrix': (best_of(lambda: horizons.predict(X), repeat), n),
+            'http_single_loop': (best_of(http_single_loop, 1), n_loop),
+            'http_batch': (best_of(http_batch, repeat), n),
+        }
+        for case, (seconds, rows) in cases.items():
+            results.append({'case': case, 'rows': n, 'seconds': seconds * n / rows,
+                            'rows_per_second': rows / seconds,
+                            'horizons': 1 if case in ('single_row_loop', 'http_single_loop') else len(horizons.horizons)})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--http-loop-max', type=int, default=200, help='chamadas medidas no loop HTTP de uma linha')
+    args = parser.parse_args()
+    results = run(args.years, args.rows, args.repeat, args.http_loop_max)
+    print(f"{'caso':<18} {'linhas':>7} {'horizontes':>10} {'tempo ms':>10} {'linhas/s':>12}")
+    for r in results:
+        print(f"{r['case']:<18} {r['rows']:>7} {r['horizons']:>10} {r['seconds'] * 1000:>10.2f} "
+              f"{r['rows_per_second']:>12,.0f}")
@@ -0,0 +1,163 @@
+"""Teste de carga do SQLite com leituras e escritas concorrentes.
+
+Uso (a partir da raiz do repositório):
+
+    python backend/bench/bench_db_concurrency.py --readers 8 --writers 2 --seconds 10
+
+Simula a API servindo /history, /prices e /predict enquanto o scheduler e o
+treino gravam no mesmo arquivo. Roda o mesmo cenário duas vezes: com a engine
+antiga (journal DELETE, BEGIN adiado do pysqlite, sem índice em predictions) e com
+`db.make_engine` (WAL, synchronous=NORMAL, busy_timeout, BEGIN IMMEDIATE nas
+escritas). Reporta vazão, p50/p99 por tipo de operação e quantos
+"database is locked" apareceram.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+from db import begin_write, make_engine, remove_db_files  # noqa: E402
+
+HISTORY_SQL = text('''
+    SELECT p.id, p.run_ts, p.date, p.pred_7d
+    FROM predictions p
+    JOIN (SELECT date, MAX(run_ts) AS max_ts FROM predictions GROUP BY date) latest
+    ON p.date = latest.date AND p.run_ts = latest.max_ts
+    ORDER BY p.date DESC LIMIT 30''')
+PRICES_SQL = text('SELECT date, price FROM btc_data ORDER BY date DESC LIMIT 365')
+DEDUPE_SQL = text('''SELECT 1 FROM predictions WHERE date = :date
+                     AND run_ts >= date('now') AND run_ts < date('now', '+1 day')''')
+
+
+def legacy_engine(path):
+    """A engine como era antes: padrão do SQLAlchemy, sem pragmas."""
+    return create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+
+
+def seed(engine, n_days, n_predictions, indexes):
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE btc_data (date TEXT PRIMARY KEY, price REAL)'))
+        conn.execute(text('''CREATE TABLE predictions (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP, date TEXT, pred_7d REAL)'''))
+        if indexes:
+            conn.execute(text('CREATE INDEX idx_predictions_date_run_ts ON predictions (date, run_ts)'))
+        start = date.today() - timedelta(days=n_days)
+        conn.exec_driver_sql('INSERT INTO btc_data VALUES (?, ?)',
+                             [((start + timedelta(days=i)).isoformat(), 30000.0 + i) for i in range(n_days)])
+        # várias previsões por data, como acontece com /predict chamado ao longo dos dias
+        conn.exec_driver_sql(
+            "INSERT INTO predictions (run_ts, date, pred_7d) VALUES (datetime('now', ?), ?, ?)",
+            [(f'-{i % 1000} minutes', (start + timedelta(days=i % n_days)).isoformat(), 30000.0)
+             for i in range(n_predictions)])
+
+
+def run_scenario(engine, write_tx, n_readers, n_writers, seconds):
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def record(op, fn):
+        start = time.perf_counter()
+        try:
+            fn()
+        except OperationalError as e:
+            with lock:
+                errors['locked' if 'locked' in str(e) else 'other'] += 1
+            return
+        with lock:
+            timings[op].append((time.perf_counter() - start) * 1000)
+
+    def read_history():
+        with engine.connect() as conn:
+            conn.execute(HISTORY_SQL).fetchall()
+
+    def read_prices():
+        with engine.connect() as conn:
+            conn.execute(PRICES_SQL).fetchall()
+
+    def predict(rng):
+        # mesmo formato do /predict: confere a duplicata e grava na mesma transação
+        d = (date.today() + timedelta(days=rng.randint(0, 400))).isoformat()
+        with write_tx(engine) as conn:
+            if conn.execute(DEDUPE_SQL, {'date': d}).fetchone() is None:
+                conn.execute(text('INSERT INTO predictions (date, pred_7d) VALUES (:d, 1.0)'), {'d': d})
+
+    def upsert(rng):
+        d = (date.today() - timedelta(days=rng.randint(0, 30))).isoformat()
+        with engine.begin() as conn:
+            conn.execute(text('INSERT OR REPLACE INTO btc_data VALUES (:d, :p)'), {'d': d, 'p': rng.random()})
+
+    def reader(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < stop:
+            if rng.random() < 0.5:
+                record('history', read_history)
+            else:
+                record('prices', read_prices)
+
+    def writer(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < stop:
+            if rng.random() < 0.7:
+                record('predict', lambda: predict(rng))
+            else:
+                record('upsert', lambda: upsert(rng))
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(n_readers)]
+    threads += [threading.Thread(target=writer, args=(100 + i,)) for i in range(n_writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return timings, errors
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--days', type=int, default=3650)
+    parser.add_argument('--predictions', type=int, default=20000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='btc-db-bench-')
+    scenarios = [
+        ('antes', legacy_engine, lambda eng: eng.begin(), False),
+        ('WAL+índices', make_engine, begin_write, True),
+    ]
+    print(f"{args.readers} leitores, {args.writers} escritores, {args.seconds:.0f}s por cenário")
+    print(f"{'cenário':<12} {'operação':<9} {'ops':>7} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, factory, write_tx, indexes in scenarios:
+        path = os.path.join(tmp, f'{name}.sqlite')
+        remove_db_files(path)
+        engine = factory(path)
+        seed(engine, args.days, args.predictions, indexes)
+        timings, errors = run_scenario(engine, write_tx, args.readers, args.writers, args.seconds)
+        engine.dispose()
+        for op in ('history', 'prices', 'predict', 'upsert'):
+            t = timings.get(op, [])
+            print(f"{name:<12} {op:<9} {len(t):>7} {len(t) / args.seconds:>8.1f} "
+                  f"{percentile(t, 0.5):>8.2f} {percentile(t, 0.99):>8.2f}")
+        print(f"{name:<12} erros: {errors.get('locked', 0)} 'database is locked', {errors.get('other', 0)} outros")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark da latência de GET /api/predict conforme o histórico cresce.
+
+Uso (a partir da raiz do repositório):
+
+    python backend/bench/bench_predict.py --years 1 5 10 20 --requests 50
+
+Cada tamanho de histórico usa um SQLite temporário com preços sintéticos;
+o modelo é treinado uma vez e depois /predict é chamado várias vezes via
+TestClient. Como as métricas de treino ficam em model_runs, a latência deve
+se manter estável independentemente do número de linhas.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+TMP_DIR = tempfile.mkdtemp(prefix='btc-bench-')
+os.environ.setdefault('DB_PATH', os.path.join(TMP_DIR, 'db.sqlite'))
+os.environ.setdefault('MODEL_PATH', os.path.join(TMP_DIR, 'models', 'btc_linreg.pkl'))
+sys.path.insert(0, os.path.abspath(APP_DIR))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from db import make_engine, remove_db_files  # noqa: E402
+
+
+def synthetic_prices(n_days, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=pd.Timestamp.today().normalize(), periods=n_days, freq='D')
+    price = 30000 * np.exp(np.cumsum(rng.normal(0, 0.02, n_days)))
+    return pd.DataFrame({'date': dates, 'price': price})
+
+
+def seed_db(n_days):
+    path = os.path.join(TMP_DIR, f'db_{n_days}.sqlite')
+    remove_db_files(path)
+    main.engine.dispose()
+    main.engine = make_engine(path)
+    main.init_db()
+    df = main.make_features(synthetic_prices(n_days)).dropna()
+    return main.bulk_insert_features(df)
+
+
+def run(years, n_requests):
+    client = TestClient(main.app)
+    results = []
+    for y in years:
+        rows = seed_db(365 * y)
+        main.retrain_model()
+        client.get('/api/predict')  # aquecimento
+        timings = []
+        for _ in range(n_requests):
+            start = time.perf_counter()
+            r = client.get('/api/predict')
+            timings.append((time.perf_counter() - start) * 1000)
+            r.raise_for_status()
+        timings.sort()
+        results.append({
+            'years': y,
+            'rows': rows,
+            'median_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(timings[int(0.95 * (len(timings) - 1))], 2),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 5, 10, 20])
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+    print(f"{'anos':>5} {'linhas':>7} {'mediana ms':>11} {'p95 ms':>8}")
+    for r in run(args.years, args.requests):
+        print(f"{r['years']:>5} {r['rows']:>7} {r['median_ms']:>11} {r['p95_ms']:>8}")
@@ -0,0 +1,245 @@
+"""Teste de carga do /api/stream (SSE) com milhares de conexões locais.
+
+Uso (a partir da raiz do repositório):
+
+    python backend/bench/bench_push.py --clients 3000 --events 20
+
+Sobe o backend com `uvicorn` num subprocesso (CoinGecko do coingecko_stub),
+abre `--clients` conexões SSE num único event loop e publica eventos de outro
+processo (este), pelo mesmo `push_events` que a ingestão usa. Fases:
+
+- `connect`: tempo para conectar todos os clientes e memória do servidor por conexão;
+- `idle`: CPU do servidor com todos conectados e nada publicado (só heartbeats);
+- `fanout`: latência publicação -> recebimento (p50/p99/máx) em todos os clientes,
+  incluindo até PUSH_POLL_SECONDS (`--poll`) da leitura de outro processo;
+- `slow`: `--slow` clientes que não leem o socket (buffer de recepção mínimo) junto
+  de `--fast` clientes normais, com eventos de `--slow-payload` bytes: os lentos
+  devem ser desconectados com `reset` e os normais receber tudo;
+- `cleanup`: clientes fechados somem do servidor depois de um heartbeat.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..', 'app'))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from coingecko_stub import running_stub  # noqa: E402
+from db import make_engine  # noqa: E402
+from push import Broadcaster  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get_json(base, path):
+    with urllib.request.urlopen(base + path, timeout=10) as r:
+        return json.loads(r.read())
+
+
+def proc_stats(pid):
+    """(RSS em bytes, CPU user+system em segundos) do processo."""
+    with open(f'/proc/{pid}/status') as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS'))
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return rss, (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class Client:
+    """Cliente SSE mínimo: lê a resposta chunked e anota a latência dos eventos `bench`."""
+
+    def __init__(self, port, read=True):
+        self.port = port
+        self.read = read
+        self.latencies = []
+        self.reset = None
+        self.closed = False
+        self.writer = None
+
+    async def connect(self):
+        sock = socket.socket()
+        if not self.read:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', self.port))
+        reader, self.writer = await asyncio.open_connection(sock=sock, limit=1 << 20)
+        self.writer.write(b'GET /api/stream HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n')
+        await self.writer.drain()
+        status = await reader.readline()
+        if b' 200 ' not in status:
+            raise RuntimeError(status.decode().strip())
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        return reader
+
+    async def run(self, reader):
+        if not self.read:
+            return
+        try:
+            while True:
+                size = int((await reader.readline()).strip() or b'0', 16)
+                if size == 0:
+                    break
+                chunk = await reader.readexactly(size + 2)
+                now = time.time()
+                if chunk.startswith(b'id: '):
+                    event = chunk.split(b'\n', 2)[1][len(b'event: '):]
+                    data = chunk[chunk.index(b'data: ') + 6:].strip()
+                    if event == b'bench':
+                        self.latencies.append(now - json.loads(data)['sent'])
+                elif chunk.startswith(b'event: reset'):
+                    self.reset = chunk
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.closed = True
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.transport.abort()
+
+
+async def open_clients(port, n, read=True, batch=500):
+    clients, tasks = [], []
+    for start in range(0, n, batch):
+        group = [Client(port, read) for _ in range(min(batch, n - start))]
+        readers = await asyncio.gather(*(c.connect() for c in group))
+        tasks += [asyncio.create_task(c.run(r)) for c, r in zip(group, readers)]
+        clients += group
+    return clients, tasks
+
+
+async def publish(broadcaster, events, payload, interval):
+    pad = 'x' * payload
+    for seq in range(events):
+        await asyncio.to_thread(broadcaster.publish, 'bench', {'seq': seq, 'sent': time.time(), 'pad': pad})
+        await asyncio.sleep(interval)
+
+
+async def wait_for(predicate, timeout, step=0.05):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        await asyncio.sleep(step)
+    return predicate()
+
+
+async def scenario(args, base, port, pid, broadcaster):
+    results = {}
+    rss0, _ = proc_stats(pid)
+
+    start = time.perf_counter()
+    clients, tasks = await open_clients(port, args.clients)
+    connect_seconds = time.perf_counter() - start
+    await wait_for(lambda: get_json(base, '/api/stream/stats')['subscribers'] >= args.clients, 10)
+    rss1, cpu1 = proc_stats(pid)
+    results['connect'] = {'clients': args.clients, 'seconds': connect_seconds,
+                          'server_rss_mb': rss1 / 2 ** 20, 'kb_per_connection': (rss1 - rss0) / 1024 / args.clients}
+
+    await asyncio.sleep(args.idle)
+    _, cpu2 = proc_stats(pid)
+    results['idle'] = {'seconds': args.idle, 'server_cpu_percent': (cpu2 - cpu1) / args.idle * 100}
+
+    start = time.perf_counter()
+    await publish(broadcaster, args.events, args.payload, args.interval)
+    await wait_for(lambda: all(len(c.latencies) >= args.events for c in clients), 30)
+    lat = np.array([x for c in clients for x in c.latencies]) * 1000
+    _, cpu3 = proc_stats(pid)
+    results['fanout'] = {'events': args.events, 'delivered': int(lat.size), 'expected': args.events * args.clients,
+                         'p50_ms': float(np.percentile(lat, 50)), 'p99_ms': float(np.percentile(lat, 99)),
+                         'max_ms': float(lat.max()), 'server_cpu_seconds': cpu3 - cpu2,
+                         'seconds': time.perf_counter() - start}
+    for c in clients:
+        c.close()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    slow, slow_tasks = await open_clients(port, args.slow, read=False)
+    fast, fast_tasks = await open_clients(port, args.fast)
+    await publish(broadcaster, args.slow_events, args.slow_payload, args.slow_interval)
+    await wait_for(lambda: all(len(c.latencies) >= args.slow_events for c in fast), 60)
+    stats = get_json(base, '/api/stream/stats')
+    lat = np.array([x for c in fast for x in c.latencies]) * 1000
+    results['slow'] = {'slow_clients': args.slow, 'fast_clients': args.fast, 'events': args.slow_events,
+                       'payload_bytes': args.slow_payload, 'evicted_total': stats['evicted'],
+                       'fast_complete': sum(len(c.latencies) >= args.slow_events for c in fast),
+                       'fast_p99_ms': float(np.percentile(lat, 99)) if lat.size else None}
+    for c in slow + fast:
+        c.close()
+    await asyncio.gather(*slow_tasks, *fast_tasks, return_exceptions=True)
+
+    start = time.perf_counter()
+    gone = await wait_for(lambda: get_json(base, '/api/stream/stats')['subscribers'] == 0, args.heartbeat * 3, 0.2)
+    results['cleanup'] = {'subscribers_left': get_json(base, '/api/stream/stats')['subscribers'], 'ok': gone,
+                          'seconds': time.perf_counter() - start}
+    return results
+
+
+def run(args):
+    tmp = tempfile.mkdtemp(prefix='btc-bench-push-')
+    db_path = os.path.join(tmp, 'db.sqlite')
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    with running_stub() as (stub_url, _):
+        env = {**os.environ, 'DB_PATH': db_path, 'MODEL_PATH': os.path.join(tmp, 'models', 'btc_linreg.pkl'),
+               'SNAPSHOT_DIR': os.path.join(tmp, 'snapshot'), 'COINGECKO_URL': stub_url, 'TRAIN_EXECUTOR': 'thread',
+               'STAGE_LOGS': '0', 'PUSH_POLL_SECONDS': str(args.poll), 'PUSH_HEARTBEAT_SECONDS': str(args.heartbeat),
+               'PUSH_MAX_SUBSCRIBERS': str(args.clients + args.slow + args.fast)}
+        server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port),
+                                   '--log-level', 'warning', '--backlog', '4096'],
+                                  cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 120
+            while True:
+                try:
+                    if get_json(base, '/api/health/ready')['ready']:
+                        break
+                except OSError:
+                    pass
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError('backend não ficou pronto')
+                time.sleep(0.5)
+            engine = make_engine(db_path)
+            broadcaster = Broadcaster(lambda: engine)
+            return asyncio.run(scenario(args, base, port, server.pid, broadcaster))
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=3000)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--payload', type=int, default=200, help='bytes de enchimento por evento na fase fanout')
+    parser.add_argument('--interval', type=float, default=0.25, help='segundos entre eventos na fase fanout')
+    parser.add_argument('--idle', type=float, default=5.0, help='segundos medidos na fase idle')
+    parser.add_argument('--poll', type=float, default=0.05, help='PUSH_POLL_SECONDS do servidor')
+    parser.add_argument('--heartbeat', type=float, default=2.0, help='PUSH_HEARTBEAT_SECONDS do servidor')
+    parser.add_argument('--slow', type=int, default=20)
+    parser.add_argument('--fast', type=int, default=50)
+    parser.add_argument('--slow-events', type=int, default=300)
+    parser.add_argument('--slow-payload', type=int, default=32768)
+    parser.add_argument('--slow-interval', type=float, default=0.01, help='segundos entre eventos na fase slow')
+    parser.add_argument('--json', help='grava os resultados neste arquivo')
+    args = parser.parse_args()
+    results = run(args)
+    for phase, values in results.items():
+        print(f'{phase:<8} ' + '  '.join(f'{k}={v:.2f}' if isinstance(v, float) else f'{k}={v}'
+                                         for k, v in values.items()))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
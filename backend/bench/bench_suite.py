@@ -0,0 +1,243 @@
+"""Suíte de benchmarks dos caminhos quentes do backend, com resultados em JSON.
+
+Uso (a partir da raiz do repositório):
+
+    python backend/bench/bench_suite.py --years 1 5 20 --output bench.json
+    python backend/bench/bench_suite.py --fixture market_chart.json --compare bench.json
+
+Para cada tamanho de histórico o SQLite é recriado com dados do market_chart
+servidos pelo stub local da CoinGecko (série sintética ou um JSON gravado com
+`--fixture`) e são medidos:
+
+- `make_features` sobre o histórico diário inteiro;
+- `fetch_and_insert` incremental contra o stub (rollups e snapshot incluídos);
+- `retrain_model` (refit completo síncrono);
+- GET /api/predict, /api/history, /api/prices e /api/technical_data via TestClient.
+
+O JSON traz commit, máquina e mediana/p95/mínimo de cada caso; com
+`--compare` os casos mais lentos que `--threshold` vezes o arquivo anterior são
+listados e o script sai com código 1.
+
+Para gravar uma fixture real (uma única chamada à CoinGecko):
+
+    python backend/bench/bench_suite.py --record market_chart.json --record-days 7300
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..', 'app'))
+TMP_DIR = tempfile.mkdtemp(prefix='btc-bench-suite-')
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from coingecko_stub import DAY_MS, running_stub  # noqa: E402
+
+ENDPOINTS = {
+    'api_predict': '/api/predict',
+    'api_history': '/api/history?limit=30',
+    'api_prices_365d': '/api/prices?days=365',
+    'api_prices_weekly_all': '/api/prices?interval=week&days=36500',
+    'api_technical_data': '/api/technical_data?days=30',
+}
+
+
+def configure_env():
+    """Banco, modelo e snapshot temporários; treino em thread e sem retreino em background no meio das medições."""
+    os.environ['DB_PATH'] = os.path.join(TMP_DIR, 'db.sqlite')
+    os.environ['MODEL_PATH'] = os.path.join(TMP_DIR, 'models', 'btc_linreg.pkl')
+    os.environ['SNAPSHOT_DIR'] = os.path.join(TMP_DIR, 'snapshot')
+    os.environ['TRAIN_EXECUTOR'] = 'thread'
+    os.environ['TRAIN_DEBOUNCE_SECONDS'] = '86400'
+    os.environ.setdefault('STAGE_LOGS', '0')
+
+
+def timings_summary(timings):
+    timings = sorted(timings)
+    return {
+        'n': len(timings),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[int(0.95 * (len(timings) - 1))] * 1000, 3),
+        'min_ms': round(timings[0] * 1000, 3),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 3),
+    }
+
+
+def measure(func, repeat, warmup=1):
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings_summary(timings)
+
+
+def daily_prices(chart, days):
+    """Último preço de cada dia (como no fetch_and_insert), limitado aos `days` dias mais recentes."""
+    prices = chart['prices']
+    cutoff = prices[-1][0] - days * DAY_MS
+    df = pd.DataFrame([p for p in prices if p[0] > cutoff], columns=['ts', 'price'])
+    df['date'] = pd.to_datetime(df['ts'], unit='ms').dt.strftime('%Y-%m-%d')
+    df = df.groupby('date').last().reset_index()[['date', 'price']]
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def reset_state(main, make_engine, remove_db_files):
+    main.engine.dispose()
+    remove_db_files(os.environ['DB_PATH'])
+    main.engine = make_engine(os.environ['DB_PATH'])
+    main.init_db()
+    main.reset_feature_state()
+    main.prediction_cache.invalidate()
+    main.dashboard_cache.invalidate()
+
+
+def seed(main, df_daily):
+    df = main.make_features(df_daily).dropna()
+    rows = main.bulk_insert_features(df)
+    # uma previsão por dia, para o /history ter o mesmo volume do histórico de preços
+    with main.engine.begin() as conn:
+        conn.exec_driver_sql('INSERT INTO predictions (run_ts, date, pred_7d) VALUES (?, ?, ?)',
+                             [(d.strftime('%Y-%m-%d 00:15:00'), d.strftime('%Y-%m-%d'), p)
+                              for d, p in zip(df['date'], df['price'])])
+    main._on_data_changed()
+    return rows
+
+
+def run_size(main, client, chart, years, repeat, train_repeat):
+    from db import make_engine, remove_db_files
+
+    df_daily = daily_prices(chart, 365 * years)
+    reset_state(main, make_engine, remove_db_files)
+    rows = seed(main, df_daily)
+    cases = {
+        'make_features': measure(lambda: main.make_features(df_daily), repeat),
+        # force=True regrava a linha de hoje: cada repetição faz o caminho completo da ingestão diária
+        'fetch_and_insert': measure(lambda: main.fetch_and_insert(force=True), train_repeat),
+        'retrain_model': measure(main.retrain_model, train_repeat),
+    }
+    for name, path in ENDPOINTS.items():
+        def call(path=path):
+            client.get(path).raise_for_status()
+        cases[name] = measure(call, repeat)
+    return [{'case': name, 'years': years, 'rows': rows, **stats} for name, stats in cases.items()]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(years, repeat, train_repeat, fixture=None, fixture_path=None, verbose=False):
+    configure_env()
+    with running_stub(fixture=fixture) as (url, server):
+        os.environ['COINGECKO_URL'] = url
+        quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with quiet:
+            import main
+            from fastapi.testclient import TestClient
+            from ingest import fetch_market_chart
+            client = TestClient(main.app)
+            # o mesmo market_chart (max dos tamanhos pedidos) serve de base para todos
+            chart = fetch_market_chart(days=365 * max(years), timeout=60)
+            results = []
+            for y in years:
+                results.extend(run_size(main, client, chart, y, repeat, train_repeat))
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'fixture': os.path.abspath(fixture_path) if fixture_path else None,
+            'repeat': repeat,
+            'train_repeat': train_repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Casos com mediana mais de `threshold` vezes a do baseline (mesmo caso e mesmo tamanho)."""
+    before = {(r['case'], r['years']): r for r in baseline['results']}
+    slower = []
+    for r in results['results']:
+        old = before.get((r['case'], r['years']))
+        if old is None or not old['median_ms']:
+            continue
+        ratio = r['median_ms'] / old['median_ms']
+        r['baseline_median_ms'] = old['median_ms']
+        r['ratio'] = round(ratio, 3)
+        if ratio > threshold:
+            slower.append(r)
+    return slower
+
+
+def record(path, days):
+    """Grava uma resposta real do market_chart como fixture."""
+    from ingest import fetch_market_chart
+    chart = fetch_market_chart(days=days, timeout=60)
+    with open(path, 'w') as f:
+        json.dump(chart, f)
+    print(f"Fixture gravada em {path}: {len(chart['prices'])} pontos")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--repeat', type=int, default=30, help='repetições por endpoint e do make_features')
+    parser.add_argument('--train-repeat', type=int, default=5, help='repetições de fetch_and_insert e retrain_model')
+    parser.add_argument('--fixture', help='JSON gravado do market_chart servido pelo stub (padrão: série sintética)')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='JSON de uma execução anterior para comparar')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    parser.add_argument('--record', help='grava o market_chart real da CoinGecko neste arquivo e sai')
+    parser.add_argument('--record-days', type=int, default=365 * 20)
+    parser.add_argument('--verbose', action='store_true', help='mostra os logs do backend')
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.record_days)
+        sys.exit(0)
+
+    fixture = None
+    if args.fixture:
+        with open(args.fixture) as f:
+            fixture = json.load(f)
+    out = run(args.years, args.repeat, args.train_repeat, fixture, args.fixture, args.verbose)
+    slower = []
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(out, json.load(f), args.threshold)
+    with open(args.output, 'w') as f:
+        json.dump(out, f, indent=2)
+
+    print(f"{'caso':<24} {'anos':>4} {'linhas':>7} {'mediana ms':>11} {'p95 ms':>9} {'vs base':>8}")
+    for r in out['results']:
+        ratio = f"{r['ratio']:.2f}x" if 'ratio' in r else ''
+        print(f"{r['case']:<24} {r['years']:>4} {r['rows']:>7} {r['median_ms']:>11} {r['p95_ms']:>9} {ratio:>8}")
+    print(f"Resultados gravados em {args.output}")
+    if slower:
+        print(f"{len(slower)} caso(s) mais lentos que {args.threshold}x o baseline:")
+        for r in slower:
+            print(f"  {r['case']} ({r['years']} anos): {r['baseline_median_ms']} -> {r['median_ms']} ms")
+        sys.exit(1)
@@ -0,0 +1,137 @@
+"""Stub local da CoinGecko que responde /coins/<coin>/market_chart e /market_chart/range.
+
+Reproduz um JSON gravado (`--fixture arquivo.json`, no mesmo formato devolvido
+pela API: {"prices": [[ts_ms, preço], ...], ...}) ou, sem fixture, gera uma
+série sintética. Pode injetar respostas 429 para exercitar o retry.
+
+Uso:
+
+    python backend/bench/coingecko_stub.py --port 8765 --fixture market_chart.json
+    COINGECKO_URL=http://127.0.0.1:8765/api/v3 uvicorn main:app
+
+Ou, em código, `with running_stub() as (url, server): ...`.
+"""
+import argparse
+import contextlib
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+DAY_MS = 86_400_000
+
+
+def synthetic_market_chart(days, points_per_day=24, end_ms=None, seed=0):
+    """Série no formato do market_chart, com `points_per_day` pontos por dia."""
+    if end_ms is None:
+        end_ms = int(time.time() * 1000)
+    n = max(1, int(days * points_per_day))
+    step = DAY_MS // points_per_day
+    ts = end_ms - step * np.arange(n)[::-1]
+    rng = np.random.default_rng(seed)
+    price = 30000 * np.exp(np.cumsum(rng.normal(0, 0.02 / np.sqrt(points_per_day), n)))
+    prices = [[int(t), float(p)] for t, p in zip(ts, price)]
+    return {'prices': prices, 'market_caps': [], 'total_volumes': []}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        server.request_log.append(self.path)
+        is_range = parts[-1] == 'range'
+        if is_range:
+            parts = parts[:-1]
+        if len(parts) < 3 or parts[-1] != 'market_chart' or parts[-3] != 'coins':
+            self._send_json(404, {'error': 'not found'})
+            return
+        with server.lock:
+            if server.fail_429 > 0:
+                server.fail_429 -= 1
+                self._send_json(429, {'status': {'error_code': 429}}, {'Retry-After': str(server.retry_after)})
+                return
+        query = parse_qs(url.query)
+        coin = parts[-2]
+        if is_range:
+            from_ms = int(float(query['from'][0]) * 1000)
+            to_ms = int(float(query['to'][0]) * 1000)
+            if server.fixture is not None:
+                prices = [p for p in server.fixture['prices'] if from_ms <= p[0] <= to_ms]
+                payload = dict(server.fixture, prices=prices)
+            else:
+                days = (to_ms - from_ms) / DAY_MS
+                payload = synthetic_market_chart(days, end_ms=to_ms, seed=zlib.crc32(coin.encode()))
+            self._send_json(200, payload)
+            return
+        days = float(query.get('days', ['1'])[0])
+        if server.fixture is not None:
+            payload = server.fixture
+            if days < 365:
+                cutoff = payload['prices'][-1][0] - days * DAY_MS
+                payload = dict(payload, prices=[p for p in payload['prices'] if p[0] >= cutoff])
+        else:
+            payload = synthetic_market_chart(days, points_per_day=24 if days > 1 else 288,
+                                             seed=zlib.crc32(coin.encode()))
+        if server.latency:
+            time.sleep(server.latency)
+        self._send_json(200, payload)
+
+
+def make_server(port=0, fixture=None, fail_429=0, retry_after=0, latency=0.0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    server.daemon_threads = True
+    server.fixture = fixture
+    server.fail_429 = fail_429
+    server.retry_after = retry_after
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.request_log = []
+    return server
+
+
+@contextlib.contextmanager
+def running_stub(**kwargs):
+    """Sobe o stub numa thread e devolve (base_url, server)."""
+    server = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}/api/v3', server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fixture', help='JSON gravado de /market_chart para reproduzir')
+    parser.add_argument('--fail-429', type=int, default=0, help='responder 429 nas N primeiras requisições')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help='atraso artificial por resposta (s)')
+    args = parser.parse_args()
+    fixture = None
+    if args.fixture:
+        with open(args.fixture) as f:
+            fixture = json.load(f)
+    srv = make_server(args.port, fixture, args.fail_429, args.retry_after, args.latency)
+    print(f'Stub CoinGecko em http://127.0.0.1:{srv.server_address[1]}/api/v3')
+    srv.serve_forever()
@@ -1,12 +1,80 @@
 from flask import Flask, render_template, jsonify, request, redirect, url_for, flash
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import os
+import time
+try:
+    import orjson
+except ImportError:  # sem orjson o corpo é decodificado pelo json da stdlib (requests)
+    orjson = None
+from stream_listener import StreamListener
+from swr_cache import NOT_MODIFIED, StaleWhileRevalidateCache
 
 API_URL = os.environ.get("API_URL", "https://bitcoinguru.ml.caiosaldanha.com/api")
 
 app = Flask(__name__)
 
+# Uma sessão para todas as chamadas ao backend: conexões keep-alive reaproveitadas (pool)
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+# Pede o formato colunar ({coluna: [valores]}), que o template usa sem conversão;
+# um backend antigo ignora o tipo e responde orient='split'
+COLUMNAR_MEDIA_TYPE = 'application/vnd.bitcoinguru.columnar+json'
+session.headers['Accept'] = f'{COLUMNAR_MEDIA_TYPE}, application/json'
+# Chamadas em paralelo quando o backend não tem /dashboard
+panel_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='backend')
+# Backend antigo sem /dashboard: depois de um 404 só tenta de novo após este intervalo
+DASHBOARD_RETRY_SECONDS = 300
+_dashboard_missing_since = None
+
+def backend_get(path, etag=None):
+    """GET condicional no backend: NOT_MODIFIED se o ETag ainda vale, senão (json, etag)."""
+    headers = {'If-None-Match': etag} if etag else None
+    r = session.get(f"{API_URL}{path}", timeout=10, headers=headers)
+    if r.status_code == 304:
+        return NOT_MODIFIED
+    r.raise_for_status()
+    data = orjson.loads(r.content) if orjson is not None else r.json()
+    return data, r.headers.get('ETag')
+
+def has_error(data):
+    """Respostas com erro (inteiras ou em alguma parte do /dashboard) não vão para o cache."""
+    if not isinstance(data, dict):
+        return False
+    return 'error' in data or any(isinstance(v, dict) and 'error' in v for v in data.values())
+
+# Os dados do backend mudam uma vez por dia (cron das 00:15): a página é servida
+# do cache e revalidada em background depois do TTL
+backend_cache = StaleWhileRevalidateCache(
+    backend_get,
+    ttl=float(os.environ.get("CACHE_TTL_SECONDS", "60")),
+    stale_ttl=float(os.environ.get("CACHE_STALE_SECONDS", "3600")),
+    cacheable=lambda data: not has_error(data),
+    logger=app.logger,
+)
+
+# Deltas do /api/stream: com o stream conectado o cache não expira por TTL e só é
+# invalidado quando o backend avisa que preço, previsão ou métricas mudaram
+def on_backend_event(event, data):
+    app.logger.info("Evento %s do backend: invalidando o cache", event)
+    backend_cache.invalidate()
+
+def on_backend_stream(connected):
+    # eventos perdidos enquanto estava desconectado: recomeça com o cache vazio
+    backend_cache.invalidate()
+    backend_cache.set_live(connected)
+
+stream_listener = None
+if os.environ.get("BACKEND_STREAM", "1") == "1":
+    stream_listener = StreamListener(f"{API_URL}/stream", on_backend_event, on_backend_stream,
+                                     logger=app.logger).start()
+# Endereço do stream para o navegador (mesma origem em produção: o Traefik manda /api para o backend);
+# vazio desliga a atualização automática da página
+BROWSER_STREAM_URL = os.environ.get("BROWSER_STREAM_URL", "/api/stream")
+
 # Filtro personalizado para formatar números sem depender de locale
 @app.template_filter('format_number')
 def format_number(value):
@@ -19,22 +87,21 @@ def format_number(value):
         return value
 
 def convert_to_col_dict(data):
-    app.logger.warning(f"[DEBUG] convert_to_col_dict: tipo={type(data)}, chaves={list(data.keys()) if isinstance(data, dict) else 'N/A'}")
+    """Dict de listas (formato colunar) a partir do que o backend devolveu.
+
+    O formato colunar passa direto; orient='split'/'records' (backend antigo)
+    é transposto. Sem log do conteúdo: o payload cresce com o histórico.
+    """
     # Se já for dict de listas, retorna direto
     if isinstance(data, dict) and isinstance(data.get('date'), list):
-        app.logger.info("[DEBUG] Dados já estão no formato correto (dict de listas)")
         return data
     # Se vier como orient='split'
     if isinstance(data, dict) and 'columns' in data and 'data' in data:
         columns = data['columns']
         values = data['data']
-        app.logger.info("[DEBUG] convert_to_col_dict columns: %s", columns)
-        app.logger.info("[DEBUG] convert_to_col_dict values: %s", values)
         if not columns:
-            app.logger.error("[DEBUG] columns vazio!")
             return {}
         if not values:
-            app.logger.warning("[DEBUG] values vazio!")
             return {col: [] for col in columns}
         # Transpõe a matriz de dados para dict de listas
         transposed = list(zip(*values))
@@ -42,96 +109,92 @@ def convert_to_col_dict(data):
         # date_display fallback
         if 'date_display' not in result and 'date' in result:
             result['date_display'] = result['date']
-        app.logger.info("[DEBUG] convert_to_col_dict result: %s", result)
         return result
     # Se vier como lista de dicts (orient='records')
     if isinstance(data, list) and len(data) > 0 and isinstance(data[0], dict):
-        out = {k: [] for k in data[0].keys()}
-        for row in data:
-            for k, v in row.items():
-                out[k].append(v)
-        app.logger.info("[DEBUG] convert_to_col_dict orient=records result: %s", out)
-        return out
-    app.logger.warning("[DEBUG] convert_to_col_dict: formato não reconhecido, retornando {}. Data: %s", data)
+        return {k: [row[k] for row in data] for k in data[0]}
+    app.logger.warning("convert_to_col_dict: formato não reconhecido (%s), retornando {}", type(data).__name__)
     return {}
 
-@app.route("/")
-def index():
-    # Tentar obter a previsão mais recente
-    try:
-        app.logger.info("Buscando previsão em %s", f"{API_URL}/predict")
-        r = requests.get(f"{API_URL}/predict", timeout=10)
-        r.raise_for_status()
-        pred = r.json()
-        app.logger.info("[DEBUG] /predict raw: %s", pred)
-        if 'data' in pred:
-            pred = convert_to_col_dict(pred)
-            app.logger.info("[DEBUG] /predict converted: %s", pred)
-    except requests.exceptions.RequestException as e:
-        app.logger.error("Erro ao acessar API /predict: %s", e)
-        pred = {'error': f'Erro ao acessar API /predict: {e}'}
-    except Exception as e:
-        app.logger.error("Erro ao processar dados de /predict: %s", e)
-        pred = {'error': f'Erro ao processar dados: {e}'}
-    
-    # Tentar obter o histórico de previsões
-    try:
-        app.logger.info("Buscando histórico em %s", f"{API_URL}/history?limit=10")
-        r_hist = requests.get(f"{API_URL}/history?limit=10", timeout=10)
-        r_hist.raise_for_status()
-        hist = r_hist.json()
-        app.logger.info("[DEBUG] /history raw: %s", hist)
-        if 'data' in hist:
-            hist = convert_to_col_dict(hist)
-            app.logger.info("[DEBUG] /history converted: %s", hist)
-    except requests.exceptions.RequestException as e:
-        app.logger.error("Erro ao acessar API /history: %s", e)
-        hist = {'error': f'Erro ao acessar API /history: {e}'}
-    except Exception as e:
-        app.logger.error("Erro ao processar dados de /history: %s", e)
-        hist = {'error': f'Erro ao processar dados: {e}'}
-      # Tentar obter dados técnicos para o dashboard
+# Painéis da página inicial: variável do template -> endpoint do backend
+PANELS = {
+    'pred': '/predict',
+    'hist': '/history?limit=10',
+    'tech_data': '/technical_data?days=30',
+    'prices': '/prices?days=30',
+}
+# Mesmas partes no /dashboard do backend
+DASHBOARD_PARTS = {'pred': 'predict', 'hist': 'history', 'tech_data': 'technical_data', 'prices': 'prices'}
+
+def fetch_panel(path):
+    """Busca um endpoint do backend; em caso de erro devolve {'error': ...}, como o template espera."""
+    name = path.split('?')[0]
     try:
-        app.logger.info("Buscando dados técnicos em %s", f"{API_URL}/technical_data?days=30")
-        r_tech = requests.get(f"{API_URL}/technical_data?days=30", timeout=10)
-        r_tech.raise_for_status()
-        tech_data = r_tech.json()
-        app.logger.info("[DEBUG] /technical_data raw: %s", tech_data)
+        app.logger.info("Buscando %s em %s", name, f"{API_URL}{path}")
+        data = backend_cache.get(path)
+        if 'data' in data:
+            data = convert_to_col_dict(data)
+        return data
     except requests.exceptions.RequestException as e:
-        app.logger.error("Erro ao acessar API /technical_data: %s", e)
-        tech_data = {'error': f'Erro ao acessar API /technical_data: {e}'}
+        app.logger.error("Erro ao acessar API %s: %s", name, e)
+        return {'error': f'Erro ao acessar API {name}: {e}'}
     except Exception as e:
-        app.logger.error("Erro ao processar dados de /technical_data: %s", e)
-        tech_data = {'error': f'Erro ao processar dados: {e}'}
-    
-    # Tentar obter preços históricos para o gráfico
+        app.logger.error("Erro ao processar dados de %s: %s", name, e)
+        return {'error': f'Erro ao processar dados: {e}'}
+
+def fetch_dashboard():
+    """Os quatro painéis numa chamada ao /api/dashboard.
+
+    Retorna None quando é preciso cair nas chamadas separadas: backend antigo
+    sem o endpoint (404, lembrado por DASHBOARD_RETRY_SECONDS) ou erro HTTP do
+    próprio /dashboard. Se o backend nem responde, os quatro painéis já voltam
+    com o erro, sem uma segunda rodada de timeouts.
+    """
+    global _dashboard_missing_since
+    if _dashboard_missing_since is not None:
+        if time.monotonic() - _dashboard_missing_since < DASHBOARD_RETRY_SECONDS:
+            return None
+        _dashboard_missing_since = None
     try:
-        app.logger.info("Buscando preços em %s", f"{API_URL}/prices?days=30")
-        r_prices = requests.get(f"{API_URL}/prices?days=30", timeout=10)
-        r_prices.raise_for_status()
-        prices = r_prices.json()
-        app.logger.info("[DEBUG] /prices raw: %s", prices)
-        if 'data' in prices:
-            prices = convert_to_col_dict(prices)
-            app.logger.info("[DEBUG] /prices converted: %s", prices)
+        data = backend_cache.get('/dashboard')
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            app.logger.warning("Backend sem /dashboard; usando chamadas separadas")
+            _dashboard_missing_since = time.monotonic()
+        else:
+            app.logger.error("Erro no /dashboard, usando chamadas separadas: %s", e)
+        return None
     except requests.exceptions.RequestException as e:
-        app.logger.error("Erro ao acessar API /prices: %s", e)
-        prices = {'error': f'Erro ao acessar API /prices: {e}'}
-    except Exception as e:
-        app.logger.error("Erro ao processar dados de /prices: %s", e)
-        prices = {'error': f'Erro ao processar dados: {e}'}
+        app.logger.error("Erro ao acessar API /dashboard: %s", e)
+        return {name: {'error': f'Erro ao acessar API /dashboard: {e}'} for name in PANELS}
+    panels = {}
+    for name, part in DASHBOARD_PARTS.items():
+        value = data.get(part, {'error': f'Resposta do /dashboard sem {part}'})
+        panels[name] = convert_to_col_dict(value) if isinstance(value, dict) and 'data' in value else value
+    return panels
+
+def fetch_panels_concurrently():
+    """Chamadas separadas em paralelo: a página espera só pela mais lenta, não pela soma."""
+    futures = {name: panel_executor.submit(fetch_panel, path) for name, path in PANELS.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+@app.route("/")
+def index():
+    panels = fetch_dashboard() or fetch_panels_concurrently()
+    pred, hist, tech_data, prices = (panels[name] for name in PANELS)
     
     # Se tudo falhar, tentar inicializar o banco e treinar o modelo via API
     if pred.get('error') and hist.get('error') and prices.get('error'):
         try:
             app.logger.warning("Tentando inicializar o backend via /api/refresh...")
-            r_refresh = requests.post(f"{API_URL}/refresh?force=true", timeout=30)
+            r_refresh = session.post(f"{API_URL}/refresh?force=true", timeout=30)
             r_refresh.raise_for_status()
             app.logger.info("Backend inicializado com sucesso: %s", r_refresh.json())
         except Exception as e:
             app.logger.error("Falha ao inicializar backend: %s", e)
     
-    return render_template("index.html", pred=pred, hist=hist, prices=prices, tech_data=tech_data)
+    return render_template("index.html", pred=pred, hist=hist, prices=prices, tech_data=tech_data,
+                           stream_url=BROWSER_STREAM_URL)
 
 @app.route("/clear_predictions")
 def clear_predictions():
@@ -139,8 +202,10 @@ def clear_predictions():
     message = ""
     try:
         app.logger.info("Limpando tabela de projeções via API")
-        response = requests.post(f"{API_URL}/clear_predictions", timeout=10)
+        response = session.post(f"{API_URL}/clear_predictions", timeout=10)
         response.raise_for_status()
+        # o histórico em cache ficou velho
+        backend_cache.invalidate()
         app.logger.info("Tabela de projeções limpa com sucesso")
         message = "Projeções de cotação limpas com sucesso!"
     except Exception as e:
@@ -151,5 +216,10 @@ def clear_predictions():
     # Redirecione para a página principal
     return redirect(url_for('index'))
 
+@app.route("/metrics/cache")
+def cache_metrics():
+    """Taxa de acerto do cache de respostas do backend e chamadas economizadas."""
+    return jsonify({**backend_cache.stats(), 'stream': stream_listener.stats() if stream_listener else None})
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
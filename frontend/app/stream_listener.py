@@ -0,0 +1,98 @@
+import threading
+import time
+
+import requests
+
+
+def iter_events(lines):
+    """(id, evento, dados) de cada mensagem SSE; comentários (heartbeat) e `retry:` são ignorados."""
+    event_id, event, data = None, 'message', []
+    for line in lines:
+        if not line:
+            if data:
+                yield event_id, event, '\n'.join(data)
+            event_id, event, data = None, 'message', []
+        elif line.startswith(':'):
+            continue
+        else:
+            field, _, value = line.partition(':')
+            value = value[1:] if value.startswith(' ') else value
+            if field == 'id':
+                event_id = value
+            elif field == 'event':
+                event = value
+            elif field == 'data':
+                data.append(value)
+
+
+class StreamListener:
+    """Assina o /api/stream do backend numa thread e chama `on_event(evento, dados)` a cada delta.
+
+    `on_state(conectado)` avisa quando a conexão abre ou cai. Reconecta
+    sozinho (espera dobrando até `max_retry_seconds`) mandando Last-Event-ID,
+    e o backend reenvia o que foi perdido. Uma leitura sem nada por
+    `read_timeout` segundos (o backend manda heartbeat a cada 15 s) derruba a
+    conexão.
+    """
+
+    def __init__(self, url, on_event, on_state=None, logger=None, retry_seconds=5.0, max_retry_seconds=300.0,
+                 read_timeout=60.0):
+        self.url = url
+        self.on_event = on_event
+        self.on_state = on_state
+        self.logger = logger
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.read_timeout = read_timeout
+        self.last_event_id = None
+        self.connected = False
+        self.events = 0
+        self.connects = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='backend-stream', daemon=True)
+            self._thread.start()
+        return self
+
+    def _set_connected(self, connected):
+        if connected == self.connected:
+            return
+        self.connected = connected
+        if self.on_state is not None:
+            self.on_state(connected)
+
+    def _run(self):
+        delay = self.retry_seconds
+        while True:
+            headers = {'Accept': 'text/event-stream'}
+            if self.last_event_id is not None:
+                headers['Last-Event-ID'] = self.last_event_id
+            try:
+                with requests.get(self.url, headers=headers, stream=True, timeout=(10, self.read_timeout)) as r:
+                    r.raise_for_status()
+                    self.connects += 1
+                    self._set_connected(True)
+                    delay = self.retry_seconds
+                    for event_id, event, data in iter_events(r.iter_lines(decode_unicode=True)):
+                        if event_id is not None:
+                            self.last_event_id = event_id
+                        self.events += 1
+                        self.on_event(event, data)
+            except Exception as e:
+                # backend fora do ar, sem /stream (backend antigo) ou conexão derrubada
+                if self.logger is not None:
+                    self.logger.warning("Stream do backend indisponível (%s); nova tentativa em %.0fs", e, delay)
+            self._set_connected(False)
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_seconds)
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'connected': self.connected,
+            'connects': self.connects,
+            'events': self.events,
+            'last_event_id': self.last_event_id,
+        }
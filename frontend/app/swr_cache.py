@@ -0,0 +1,166 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Retorno do loader quando o backend respondeu 304 (o valor guardado continua valendo)
+NOT_MODIFIED = object()
+
+
+class _Entry:
+    __slots__ = ('value', 'etag', 'fetched_at', 'refreshing')
+
+    def __init__(self, value, etag, fetched_at):
+        self.value = value
+        self.etag = etag
+        self.fetched_at = fetched_at
+        self.refreshing = False
+
+
+class StaleWhileRevalidateCache:
+    """Cache em memória das respostas do backend, com TTL e stale-while-revalidate.
+
+    - até `ttl` segundos a resposta sai direto do cache;
+    - entre `ttl` e `ttl + stale_ttl` ela ainda é servida na hora, e uma thread
+      revalida em background mandando o ETag guardado (If-None-Match): um 304
+      só renova o prazo;
+    - sem entrada, ou depois disso, a busca é síncrona. Buscas simultâneas da
+      mesma chave esperam uma única chamada ao backend.
+
+    Com `set_live(True)` (o frontend está recebendo os deltas do /api/stream)
+    as entradas não expiram por idade: quem avisa que os dados mudaram é o
+    push, que chama `invalidate()`. Sem o stream volta a valer o TTL. Uma
+    busca que estava em andamento quando veio o `invalidate()` devolve o que
+    leu, mas não guarda (a resposta pode ser de antes da mudança).
+
+    `loader(key, etag)` devolve `(valor, etag)` ou `NOT_MODIFIED` e levanta
+    exceção em caso de erro; erros nunca são guardados, nem valores para os
+    quais `cacheable(valor)` for falso.
+    """
+
+    def __init__(self, loader, ttl=60.0, stale_ttl=3600.0, max_workers=2, cacheable=None, logger=None):
+        self.loader = loader
+        self.cacheable = cacheable
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.logger = logger
+        self._entries = {}
+        self._loading = {}
+        # incrementado a cada invalidate(): buscas iniciadas antes não gravam no cache
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='revalidate')
+        self.live = False
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.backend_calls = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            age = None if entry is None else now - entry.fetched_at
+            if entry is not None and (self.live or age < self.ttl):
+                self.hits += 1
+                return entry.value
+            if entry is not None and age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                if not entry.refreshing:
+                    entry.refreshing = True
+                    self._executor.submit(self._revalidate, key, entry)
+                return entry.value
+            self.misses += 1
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            value = self._load(key, entry)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                # depois de um invalidate() a chave pode já ter outra busca em andamento
+                if self._loading.get(key) is future:
+                    del self._loading[key]
+
+    def _load(self, key, entry):
+        etag = entry.etag if entry is not None else None
+        with self._lock:
+            self.backend_calls += 1
+            generation = self._generation
+        result = self.loader(key, etag)
+        with self._lock:
+            current = generation == self._generation
+            if result is NOT_MODIFIED:
+                self.not_modified += 1
+                if current:
+                    entry.fetched_at = time.monotonic()
+                return entry.value
+            value, etag = result
+            if not current:
+                # o push invalidou o cache durante a busca: não guarda uma resposta possivelmente velha
+                return value
+            if self.cacheable is None or self.cacheable(value):
+                self._entries[key] = _Entry(value, etag, time.monotonic())
+            else:
+                self._entries.pop(key, None)
+            return value
+
+    def _revalidate(self, key, entry):
+        with self._lock:
+            self.revalidations += 1
+        try:
+            self._load(key, entry)
+        except Exception as e:
+            # segue servindo a versão antiga até o fim da janela stale
+            with self._lock:
+                self.errors += 1
+            if self.logger is not None:
+                self.logger.error("Erro ao revalidar %s: %s", key, e)
+        finally:
+            entry.refreshing = False
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            # quem chegar agora não espera uma busca iniciada antes da mudança
+            self._loading.clear()
+
+    def set_live(self, live):
+        with self._lock:
+            # ao sair do modo live as entradas podem estar velhas: recomeça pelo TTL normal
+            if not live and self.live:
+                for entry in self._entries.values():
+                    entry.fetched_at = min(entry.fetched_at, time.monotonic() - self.ttl)
+            self.live = live
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'live': self.live,
+                'ttl_seconds': self.ttl,
+                'stale_seconds': self.stale_ttl,
+                'lookups': lookups,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.hits + self.stale_hits) / lookups, 4) if lookups else None,
+                'revalidations': self.revalidations,
+                'not_modified': self.not_modified,
+                'errors': self.errors,
+                # chamadas que de fato foram ao backend: buscas síncronas + revalidações
+                'backend_calls': self.backend_calls,
+                'backend_calls_saved': lookups - self.backend_calls,
+            }
@@ -1 +0,0 @@
-from flask import Flask\napp = Flask(__name__)\nprint([[2025-05-26, 109315.14568727918, 108752.39251314868, 389.6176005024276, 0.9990590821569574]][0])\nprint(isinstance([[2025-05-26, 109315.14568727918, 108752.39251314868, 389.6176005024276, 0.9990590821569574]][0], (list, tuple)))